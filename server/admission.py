@@ -0,0 +1,236 @@
+# Standard library imports
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# Third-party imports
+from fastapi import HTTPException
+from pydantic import BaseModel, validator
+
+# Internal imports
+from cache_logic import TTLCache
+from supabase_logic import ApiKeyRecord, UserRole
+
+logger = logging.getLogger("admission")
+
+GPT_CONCURRENCY = int(os.environ.get("GPT_CONCURRENCY", "16"))
+GPT_MAX_WAITING = int(os.environ.get("GPT_MAX_WAITING", "64"))
+# Longest a request waits for a GPT slot before it is shed; waiting longer is queueing, not shedding
+GPT_SLOT_TIMEOUT = float(os.environ.get("GPT_SLOT_TIMEOUT", "1"))
+SHED_RETRY_AFTER = int(os.environ.get("SHED_RETRY_AFTER", "5"))
+RATE_LIMIT_STORE_SIZE = int(os.environ.get("RATE_LIMIT_STORE_SIZE", "100000"))
+
+# Lower numbers are served first when GPT slots are contended
+ROLE_PRIORITY = {
+    UserRole.ADMIN: 0,
+    UserRole.PREMIUM: 1,
+    UserRole.FREE: 2,
+}
+
+
+# ----- Pydantic Models -----
+
+class RateLimit(BaseModel):
+    """Token bucket settings: sustained requests per minute and burst size."""
+    per_minute: float
+    burst: int
+
+    @validator('per_minute')
+    def validate_per_minute(cls, v):
+        if v <= 0:
+            raise ValueError("per_minute must be positive, or 'unlimited' for no limit")
+        return v
+
+    @validator('burst')
+    def validate_burst(cls, v):
+        if v < 1:
+            raise ValueError("burst must be at least 1")
+        return v
+
+    @property
+    def per_second(self) -> float:
+        return self.per_minute / 60.0
+
+    class Config:
+        frozen = True
+
+
+def _role_limit(role: UserRole, per_minute: str, burst: str) -> Optional[RateLimit]:
+    prefix = f"RATE_LIMIT_{role.value.upper()}"
+    per_minute = os.environ.get(f"{prefix}_PER_MINUTE", per_minute)
+    if per_minute.lower() in ("", "none", "unlimited"):
+        return None
+    return RateLimit(per_minute=float(per_minute), burst=int(os.environ.get(f"{prefix}_BURST", burst)))
+
+
+# A free burst covers one failing matrix build; admins are not rate limited by default
+RATE_LIMITS: Dict[UserRole, Optional[RateLimit]] = {
+    UserRole.FREE: _role_limit(UserRole.FREE, "30", "20"),
+    UserRole.PREMIUM: _role_limit(UserRole.PREMIUM, "120", "60"),
+    UserRole.ADMIN: _role_limit(UserRole.ADMIN, "unlimited", "0"),
+}
+
+
+# ----- Rate Limit Backends -----
+
+class RateLimitBackend(ABC):
+    """Token bucket storage, so limits can be shared across workers."""
+
+    @abstractmethod
+    def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        """Take tokens from a key's bucket.
+
+        Returns 0 if the request is admitted, otherwise the number of
+        seconds until enough tokens will have refilled.
+        """
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Process-local token buckets.
+
+    Each bucket expires once it would have refilled, which is the same as
+    being full, so idle keys cost no memory.
+    """
+
+    def __init__(self, maxsize: int = RATE_LIMIT_STORE_SIZE) -> None:
+        self._buckets: TTLCache[Tuple[float, float]] = TTLCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(limit.burst), now))
+            tokens = min(float(limit.burst), tokens + (now - updated) * limit.per_second)
+            if tokens < cost:
+                return (cost - tokens) / limit.per_second
+            tokens -= cost
+            refill_time = (limit.burst - tokens) / limit.per_second
+            self._buckets.set(key, (tokens, now), ttl=refill_time)
+            return 0.0
+
+
+# ----- Concurrency -----
+
+class PrioritySemaphore:
+    """Asyncio semaphore that hands freed slots to the highest-priority waiter.
+
+    Waiters of equal priority are served in arrival order. A bounded wait
+    gives up when too many callers are already queued or the timeout
+    passes, so overload is shed quickly instead of piling up.
+    """
+
+    def __init__(self, limit: int = GPT_CONCURRENCY, max_waiting: int = GPT_MAX_WAITING) -> None:
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    async def acquire(self, priority: int, timeout: Optional[float] = None) -> bool:
+        """Take a slot, returning False if it could not be had within the bound.
+
+        With no timeout the caller waits as long as it takes and is never shed.
+        """
+        if self.active < self.limit:
+            self.active += 1
+            return True
+        if timeout is not None and self.waiting >= self.max_waiting:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._handed_over(future)
+        except asyncio.CancelledError:
+            if self._handed_over(future):
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def _handed_over(self, future: asyncio.Future) -> bool:
+        # A slot may be handed over in the same loop turn as a timeout or cancel
+        if future.done() and not future.cancelled():
+            return True
+        future.cancel()
+        return False
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+# ----- Admission Control -----
+
+class AdmissionController:
+    """Per-key rate limits plus a global, role-prioritized cap on GPT calls."""
+
+    def __init__(
+        self,
+        backend: Optional[RateLimitBackend] = None,
+        limits: Optional[Dict[UserRole, Optional[RateLimit]]] = None,
+        gpt_slots: Optional[PrioritySemaphore] = None
+    ) -> None:
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.gpt_slots = gpt_slots or PrioritySemaphore()
+        self.stats = {"rate_limited": 0, "shed": 0}
+
+    def admit(self, user: ApiKeyRecord) -> None:
+        """Charge one request to the key's bucket or raise a 429 with Retry-After."""
+        limit = self.limits.get(user.role)
+        if limit is None:
+            return
+        retry_after = self.backend.take(user.api_key, limit)
+        if retry_after > 0:
+            self.stats["rate_limited"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded for this API key",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+    async def acquire_gpt_slot(self, user: ApiKeyRecord, timeout: Optional[float] = GPT_SLOT_TIMEOUT) -> None:
+        """Take one of the global GPT slots, or raise a 429 if the request is shed.
+
+        Pass timeout=None for work that must wait rather than be shed, such
+        as queued jobs.
+        """
+        priority = ROLE_PRIORITY.get(user.role, ROLE_PRIORITY[UserRole.FREE])
+        if not await self.gpt_slots.acquire(priority, timeout):
+            self.stats["shed"] += 1
+            logger.warning(f"Shedding {user.role.value} request, {self.gpt_slots.waiting} waiting for GPT")
+            raise HTTPException(
+                status_code=429,
+                detail="Analysis capacity is saturated, retry later",
+                headers={"Retry-After": str(SHED_RETRY_AFTER)}
+            )
+
+    def release_gpt_slot(self) -> None:
+        self.gpt_slots.release()
+
+    @asynccontextmanager
+    async def gpt_slot(self, user: ApiKeyRecord, timeout: Optional[float] = GPT_SLOT_TIMEOUT) -> AsyncIterator[None]:
+        """Hold a GPT slot for the duration of the block."""
+        await self.acquire_gpt_slot(user, timeout)
+        try:
+            yield
+        finally:
+            self.release_gpt_slot()
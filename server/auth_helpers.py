@@ -1,11 +1,23 @@
 # Standard library imports
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Third-party imports
 from fastapi import HTTPException, Request
+from supabase import Client
 import jwt
 
+# Internal imports
+from cache_logic import TTLCache
+from concurrency import run_blocking
+from supabase_logic import ApiKeyRecord, resolve_api_key
+
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", "10000"))
+# invalidate_user only reaches this process, so the TTL bounds how long
+# other workers keep accepting a rotated key
+API_KEY_CACHE_TTL = float(os.environ.get("API_KEY_CACHE_TTL", "30"))
+API_KEY_NEGATIVE_TTL = float(os.environ.get("API_KEY_NEGATIVE_TTL", "60"))
+
 def verify_auth_header(request: Request) -> Dict[str, Any]:
     """Verify authentication header and return payload."""
     auth_header = request.headers.get("Authorization")
@@ -34,4 +46,54 @@ def get_user_id(payload: Dict[str, Any]) -> str:
     user_id = payload.get("sub")
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid user ID")
-    return user_id
\ No newline at end of file
+    return user_id
+
+class ApiKeyAuthenticator:
+    """Resolve API keys to users once, caching hits and misses with a TTL.
+
+    Unknown keys are cached as misses so repeated bad keys do not reach the
+    database. Rotating a key must go through invalidate_user, which evicts
+    the old key in this process; other processes stop accepting it once
+    their entry expires after API_KEY_CACHE_TTL.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = API_KEY_CACHE_SIZE,
+        ttl: float = API_KEY_CACHE_TTL,
+        negative_ttl: float = API_KEY_NEGATIVE_TTL
+    ) -> None:
+        self.valid: TTLCache[ApiKeyRecord] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.invalid: TTLCache[bool] = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        # Bounded like the key cache, and only needed while the key is cached
+        self._keys_by_user: TTLCache[str] = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def authenticate(self, client: Client, api_key: str) -> ApiKeyRecord:
+        """Return the user record for an API key or raise a 401."""
+        record = self.valid.get(api_key)
+        if record is not None:
+            return record
+        if self.invalid.get(api_key):
+            raise HTTPException(status_code=401, detail="Invalid API Key")
+
+        try:
+            record = await run_blocking(resolve_api_key, client, api_key)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Unable to verify API key: {str(e)}")
+
+        if record is None:
+            self.invalid.set(api_key, True)
+            raise HTTPException(status_code=401, detail="Invalid API Key")
+
+        self.valid.set(api_key, record)
+        self._keys_by_user.set(record.user_id, api_key)
+        return record
+
+    def invalidate_user(self, user_id: str, new_api_key: Optional[str] = None) -> None:
+        """Drop the cached key of a user whose API key was rotated."""
+        old_api_key = self._keys_by_user.get(user_id)
+        self._keys_by_user.delete(user_id)
+        if old_api_key:
+            self.valid.delete(old_api_key)
+        if new_api_key:
+            self.invalid.delete(new_api_key)
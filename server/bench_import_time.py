@@ -0,0 +1,68 @@
+# Standard library imports
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", "2500"))
+IMPORT_TIME_RUNS = int(os.environ.get("IMPORT_TIME_RUNS", "3"))
+
+# Only needed by offline clustering; loading them on the /analyze path is a regression
+FORBIDDEN_MODULES = ("pandas", "sklearn", "joblib")
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_import(module: str = "server") -> Tuple[float, Dict[str, int]]:
+    """Import a module in a fresh interpreter with -X importtime.
+
+    Returns the cumulative import time in milliseconds and the cumulative
+    time in microseconds of every module loaded along the way.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    loaded: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            loaded[match.group(4)] = int(match.group(2))
+    return loaded.get(module, 0) / 1000, loaded
+
+
+def main() -> int:
+    timings: List[float] = []
+    loaded: Dict[str, int] = {}
+    for _ in range(IMPORT_TIME_RUNS):
+        elapsed_ms, loaded = measure_import()
+        timings.append(elapsed_ms)
+
+    # The fastest run is the least disturbed by other work on the machine
+    best_ms = min(timings)
+    print(f"import server: {best_ms:.0f} ms (best of {len(timings)}, budget {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+
+    failures = []
+    forbidden = sorted(
+        name for name in loaded
+        if name.split(".")[0] in FORBIDDEN_MODULES
+    )
+    if forbidden:
+        roots = sorted({name.split(".")[0] for name in forbidden})
+        failures.append(f"heavy modules loaded at import: {', '.join(roots)}")
+    if best_ms > IMPORT_TIME_BUDGET_MS:
+        failures.append(f"import time {best_ms:.0f} ms exceeds budget of {IMPORT_TIME_BUDGET_MS:.0f} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
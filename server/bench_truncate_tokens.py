@@ -0,0 +1,81 @@
+# Standard library imports
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+# Internal imports
+from vector_logic import EMBEDDING_MAX_INPUT_TOKENS, get_encoding, truncate_tokens
+
+TRUNCATE_SIZES_MB = [float(size) for size in os.environ.get("TRUNCATE_SIZES_MB", "1,10,50").split(",")]
+TRUNCATE_RUNS = int(os.environ.get("TRUNCATE_RUNS", "3"))
+# Truncation should cost the same whatever the size of the log
+TRUNCATE_BUDGET_MS = float(os.environ.get("TRUNCATE_BUDGET_MS", "100"))
+
+LOG_LINES = [
+    "2024-05-01T12:00:{second:02d}.000Z ##[group]Run npm ci",
+    "2024-05-01T12:00:{second:02d}.000Z npm ERR! code ERESOLVE",
+    "2024-05-01T12:00:{second:02d}.000Z npm ERR! Could not resolve dependency: peer react@\"^17\" from foo@{n}.0.0",
+    "2024-05-01T12:00:{second:02d}.000Z   at Object.<anonymous> (/home/runner/work/app/src/index.js:{n}:17)",
+    "2024-05-01T12:00:{second:02d}.000Z ✗ test {n} failed — expected “ok” but got “error”",
+]
+
+
+def make_log(size_bytes: int, seed: int = 42) -> str:
+    """Build a GitHub Actions-like log of roughly size_bytes of UTF-8."""
+    rng = random.Random(seed)
+    lines: List[str] = []
+    total = 0
+    while total < size_bytes:
+        line = rng.choice(LOG_LINES).format(second=rng.randrange(60), n=rng.randrange(10000))
+        lines.append(line)
+        total += len(line.encode("utf-8")) + 1
+    return "\n".join(lines)
+
+
+def encode_everything(text: str, max_tokens: int, keep: str = "head") -> str:
+    """The old approach: tokenize the whole input, then slice."""
+    encoding = get_encoding("cl100k_base")
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[-max_tokens:] if keep == "tail" else tokens[:max_tokens])
+
+
+def best_of(func: Callable[..., str], *args: object) -> float:
+    """Fastest of TRUNCATE_RUNS calls, in milliseconds."""
+    timings = []
+    for _ in range(TRUNCATE_RUNS):
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main() -> int:
+    # Load the encoding up front so the first measurement does not include it
+    get_encoding("cl100k_base")
+
+    failures = []
+    print(f"{'size':>8} {'keep':>5} {'windowed':>12} {'full encode':>12}")
+    for size_mb in TRUNCATE_SIZES_MB:
+        text = make_log(int(size_mb * 1024 * 1024))
+        for keep in ("head", "tail"):
+            if truncate_tokens(text, EMBEDDING_MAX_INPUT_TOKENS, keep=keep) != \
+                    encode_everything(text, EMBEDDING_MAX_INPUT_TOKENS, keep):
+                failures.append(f"truncating {size_mb:g} MB ({keep}) differs from encoding it all")
+            windowed_ms = best_of(truncate_tokens, text, EMBEDDING_MAX_INPUT_TOKENS, "cl100k_base", keep)
+            full_ms = best_of(encode_everything, text, EMBEDDING_MAX_INPUT_TOKENS, keep)
+            print(f"{size_mb:>6g}MB {keep:>5} {windowed_ms:>10.1f}ms {full_ms:>10.1f}ms")
+            if windowed_ms > TRUNCATE_BUDGET_MS:
+                failures.append(
+                    f"truncating {size_mb:g} MB ({keep}) took {windowed_ms:.0f} ms, "
+                    f"budget {TRUNCATE_BUDGET_MS:.0f} ms"
+                )
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# Standard library imports
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Third-party imports
+import numpy as np
+
+# Internal imports
+from vector_logic import fit_pca_projection, get_pca_projection, get_vector_index, iter_index_vectors, open_vector_index_snapshot
+from vector_store import LocalVectorIndex
+
+# "synthetic" generates embedding-like vectors; "index" pages through the configured vector store
+RECALL_SOURCE = os.environ.get("RECALL_SOURCE", "synthetic")
+RECALL_CORPUS_SIZE = int(os.environ.get("RECALL_CORPUS_SIZE", "20000"))
+RECALL_DIMENSION = int(os.environ.get("RECALL_DIMENSION", "1536"))
+RECALL_QUERIES = int(os.environ.get("RECALL_QUERIES", "200"))
+RECALL_K = 10
+RECALL_PCA_TRAIN_SIZE = int(os.environ.get("RECALL_PCA_TRAIN_SIZE", "5000"))
+# Configurations are (name, PCA dimensions or None for full size, storage dtype)
+RECALL_CONFIGS: List[Tuple[str, Optional[int], str]] = [
+    ("full float32", None, "float32"),
+    ("full float16", None, "float16"),
+    ("full int8", None, "int8"),
+    ("pca-512 float32", 512, "float32"),
+    ("pca-256 float32", 256, "float32"),
+    ("pca-256 int8", 256, "int8"),
+]
+# Lowest acceptable recall@10 for a reduced configuration
+RECALL_MIN = float(os.environ.get("RECALL_MIN", "0.9"))
+
+
+def synthetic_corpus(size: int, dimension: int, seed: int = 42) -> np.ndarray:
+    """Vectors shaped like text embeddings: topic clusters in a low-rank, anisotropic subspace."""
+    rng = np.random.default_rng(seed)
+    latent_dimension, topics = 128, 200
+    scales = 1.0 / np.sqrt(np.arange(1, latent_dimension + 1))
+    centers = rng.normal(size=(topics, latent_dimension)) * scales
+    latent = centers[rng.integers(topics, size=size)] + 0.5 * rng.normal(size=(size, latent_dimension)) * scales
+    basis, _ = np.linalg.qr(rng.normal(size=(dimension, latent_dimension)))
+    vectors = latent @ basis.T + 0.01 * rng.normal(size=(size, dimension))
+    return vectors.astype(np.float32)
+
+
+def index_corpus(limit: int) -> np.ndarray:
+    """Up to limit vectors from the configured vector store."""
+    open_vector_index_snapshot()
+    pages = []
+    total = 0
+    for _, values in iter_index_vectors(get_vector_index()):
+        pages.append(values)
+        total += len(values)
+        if total >= limit:
+            break
+    if not pages:
+        raise RuntimeError("The vector index is empty")
+    return np.vstack(pages)[:limit]
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    """Exact cosine top-k of each query row, excluding the query itself."""
+    normalized = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    neighbours = []
+    for query in queries:
+        scores = normalized @ normalized[query]
+        scores[query] = -np.inf
+        neighbours.append(set(np.argpartition(-scores, k)[:k].tolist()))
+    return neighbours
+
+
+def measure(
+    vectors: np.ndarray,
+    dtype: str,
+    queries: np.ndarray,
+    truth: List[set]
+) -> Dict[str, float]:
+    """Load vectors into a LocalVectorIndex and measure recall@k, memory and query latency."""
+    with tempfile.TemporaryDirectory() as path:
+        index = LocalVectorIndex(path, dimension=vectors.shape[1], dtype=dtype)
+        for start in range(0, len(vectors), 1000):
+            index.upsert([
+                (str(row), vectors[row].tolist(), {})
+                for row in range(start, min(start + 1000, len(vectors)))
+            ])
+
+        hits = 0
+        latencies = []
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            matches = index.query(vectors[query].tolist(), top_k=RECALL_K + 1)["matches"]
+            latencies.append((time.perf_counter() - started) * 1000)
+            found = [int(match["id"]) for match in matches if int(match["id"]) != query][:RECALL_K]
+            hits += len(expected.intersection(found))
+        nbytes = index.nbytes
+        index.close()
+
+    return {
+        "recall": hits / (RECALL_K * len(queries)),
+        "megabytes": nbytes / 1024 / 1024,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def main() -> int:
+    if RECALL_SOURCE == "index":
+        corpus = index_corpus(RECALL_CORPUS_SIZE)
+    else:
+        corpus = synthetic_corpus(RECALL_CORPUS_SIZE, RECALL_DIMENSION)
+    rng = np.random.default_rng(0)
+    queries = rng.choice(len(corpus), size=min(RECALL_QUERIES, len(corpus)), replace=False)
+    truth = exact_neighbours(corpus, queries, RECALL_K)
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dimensions ({RECALL_SOURCE}), {len(queries)} queries")
+
+    failures = []
+    print(f"{'config':<18} {'recall@10':>9} {'memory':>10} {'p50':>9} {'p95':>9}")
+    with tempfile.TemporaryDirectory() as projection_dir:
+        for name, dimensions, dtype in RECALL_CONFIGS:
+            vectors = corpus
+            if dimensions is not None:
+                if dimensions >= corpus.shape[1]:
+                    continue
+                # Fit on a sample, as in production, rather than on the vectors being searched
+                path = os.path.join(projection_dir, f"pca-{dimensions}.npz")
+                sample = corpus[rng.choice(len(corpus), size=min(RECALL_PCA_TRAIN_SIZE, len(corpus)), replace=False)]
+                fit_pca_projection(sample, dimensions, path=path)
+                mean, components = get_pca_projection(path)
+                vectors = (corpus - mean) @ components.T
+
+            result = measure(vectors, dtype, queries, truth)
+            print(
+                f"{name:<18} {result['recall']:>9.3f} {result['megabytes']:>8.1f}MB "
+                f"{result['p50_ms']:>7.2f}ms {result['p95_ms']:>7.2f}ms"
+            )
+            if result["recall"] < RECALL_MIN:
+                failures.append(f"{name} recall@10 {result['recall']:.3f} is below {RECALL_MIN}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
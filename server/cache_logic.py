@@ -0,0 +1,290 @@
+# Standard library imports
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Generic, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+# Third-party imports
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("cache_logic")
+
+V = TypeVar("V")
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "")
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings.sqlite3")
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+
+# Volatile tokens replaced before fingerprinting, most specific first
+NORMALIZE_PATTERNS = [
+    # Log reduction notes how many lines it dropped, which varies between reruns
+    (re.compile(r"\.\.\. \[\d+ lines omitted\] \.\.\."), "... [lines omitted] ..."),
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<ts>"),
+    (re.compile(r"\b\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b"), "<time>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    (re.compile(r"/home/runner/work/[^/\s]+/[^/\s]+"), "<workspace>"),
+    (re.compile(r"(?:/tmp|/var/folders|[A-Za-z]:\\Users\\[^\\\s]+\\AppData\\Local\\Temp)[/\\][^\s'\":]*"), "<tmp>"),
+    (re.compile(r"\bactions/runs/\d+(?:/job/\d+)?"), "actions/runs/<id>"),
+    (re.compile(r"\b(?:run|job|build)[_ -]?(?:id|number)?[:=# ]+\d+\b", re.IGNORECASE), "<run-id>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b"), "<hex>"),
+    (re.compile(r"\b[0-9a-f]{40}\b"), "<sha>"),
+    (re.compile(r"\b\d+(?:\.\d+)?\s?(?:ms|s|sec|seconds)\b"), "<duration>"),
+    (re.compile(r"[ \t]+"), " "),
+]
+
+
+# ----- Pydantic Models -----
+
+class CachedResponse(BaseModel):
+    """Stored analysis for a log fingerprint"""
+    analysis: str
+    new_code: str
+
+
+# ----- Normalization -----
+
+def normalize_log_text(text: str) -> str:
+    """Strip timestamps, run IDs, temp paths and addresses so reruns match."""
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def log_fingerprint(error_section: str, code_context: Optional[str] = None, scope: str = "") -> str:
+    """Hash the normalized error section and code context into a cache key.
+
+    The scope (normally the API key) keeps one user's analyses from being
+    served to another.
+    """
+    digest = hashlib.sha256()
+    digest.update(scope.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_log_text(error_section).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_log_text(code_context or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+# ----- Caches -----
+
+class TTLCache(Generic[V]):
+    """Thread-safe LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SupabaseCacheBackend:
+    """Shared cache backend stored in the Supabase `response_cache` table.
+
+    Create the table with sql/response_cache.sql.
+    """
+
+    def __init__(self, client: Any, table: str = "response_cache") -> None:
+        self.client = client
+        self.table = table
+
+    def get(self, key: str) -> Optional[str]:
+        response = (self.client.table(self.table)
+            .select("value")
+            .eq("key", key)
+            .gte("expires_at", datetime.now(timezone.utc).isoformat())
+            .execute())
+        return response.data[0]["value"] if response.data else None
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items: List[Tuple[str, str]], ttl: float) -> None:
+        """Upsert several entries in one request."""
+        expires_at = (datetime.now(timezone.utc) + timedelta(seconds=ttl)).isoformat()
+        self.client.table(self.table).upsert([
+            {"key": key, "value": value, "expires_at": expires_at}
+            for key, value in items
+        ]).execute()
+
+
+class ResponseCache:
+    """Content-addressed analysis cache: local LRU with TTL, plus an optional shared backend."""
+
+    def __init__(
+        self,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        backend: Optional[Any] = None
+    ) -> None:
+        self.local: TTLCache[CachedResponse] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        cached = self.local.get(key)
+        if cached is not None or self.backend is None:
+            return cached
+
+        try:
+            raw = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Shared response cache read failed: {str(e)}")
+            return None
+        if raw is None:
+            return None
+
+        cached = CachedResponse.parse_obj(json.loads(raw))
+        self.local.set(key, cached)
+        return cached
+
+    def set(self, key: str, value: CachedResponse) -> None:
+        self.set_local(key, value)
+        if self.backend is None:
+            return
+        try:
+            self.set_shared([(key, value)])
+        except Exception as e:
+            logger.error(f"Shared response cache write failed: {str(e)}")
+
+    def set_local(self, key: str, value: CachedResponse) -> None:
+        self.local.set(key, value)
+
+    def set_shared(self, entries: List[Tuple[str, CachedResponse]]) -> None:
+        """Write entries to the shared backend in one request, raising on failure.
+
+        The server calls it from the write-behind queue, so the upsert is
+        off the request path and retried there.
+        """
+        if self.backend is None or not entries:
+            return
+        self.backend.set_many([(key, value.json()) for key, value in entries], self.ttl)
+
+
+class EmbeddingCache:
+    """Persistent SQLite embedding cache with least-recently-used eviction."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+
+    @staticmethod
+    def make_key(model: str, dimensions: int, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{dimensions}:{digest}"
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        if not keys:
+            return found
+
+        with self._lock, self._conn:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+        return found
+
+    def set_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_response_cache(client: Optional[Any] = None) -> ResponseCache:
+    """Build the response cache, attaching the shared backend when configured."""
+    backend = None
+    if RESPONSE_CACHE_BACKEND == "supabase" and client is not None:
+        backend = SupabaseCacheBackend(client)
+    return ResponseCache(backend=backend)
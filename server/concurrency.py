@@ -0,0 +1,83 @@
+# Standard library imports
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+logger = logging.getLogger("concurrency")
+
+T = TypeVar("T")
+
+BLOCKING_POOL_SIZE = int(os.environ.get("BLOCKING_POOL_SIZE", "32"))
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    """Return the shared bounded executor, creating it on first use."""
+    global _blocking_executor
+    with _executor_lock:
+        if _blocking_executor is None:
+            _blocking_executor = ThreadPoolExecutor(
+                max_workers=BLOCKING_POOL_SIZE,
+                thread_name_prefix="blocking-io",
+            )
+        return _blocking_executor
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call on the shared bounded executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_blocking_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Shut down the shared blocking executor; the next call starts a fresh one."""
+    global _blocking_executor
+    with _executor_lock:
+        executor, _blocking_executor = _blocking_executor, None
+    if executor is not None:
+        logger.info("Shutting down blocking executor")
+        executor.shutdown(wait=wait)
+
+
+class SingleFlight(Generic[T]):
+    """Coalesce concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as its own task and later
+    callers await that same task until it finishes. Nothing is remembered
+    afterwards, so this complements caches rather than replacing them. A
+    caller that is cancelled does not cancel the shared work.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, "asyncio.Task[T]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Run func for key, or join the call already in flight.
+
+        Returns the result and whether it was shared with an earlier caller.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: Hashable, task: "asyncio.Task[T]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
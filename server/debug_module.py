@@ -1,29 +1,43 @@
 # Standard library imports
+import io
 import os
 import re
+import json
 import logging
+from collections import deque
 from enum import Enum
 from dotenv import load_dotenv
-from typing import Optional, List, Dict, Any, Literal
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, FrozenSet, Iterable, Literal
 from datetime import datetime
 
 # Third-party imports
-import openai
 from pydantic import BaseModel, Field, validator
 
+# Internal imports
+from resilience import completion_calls
+from vector_logic import get_async_openai_client, get_openai_client, truncate_tokens
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("debug_module")
 
-openai_key = os.environ.get("OPENAI_KEY")
-client = openai.OpenAI(api_key=openai_key)
+GPT_ROUTING_ENABLED = os.environ.get("GPT_ROUTING_ENABLED", "true").lower() == "true"
+GPT_SMALL_MODEL = os.environ.get("GPT_SMALL_MODEL", "gpt-4o-mini")
+GPT_LARGE_MODEL = os.environ.get("GPT_LARGE_MODEL", "gpt-4o")
+# Clusters whose errors have proven too hard for the small model, e.g. "3,7".
+# Refits keep each cluster's id (vector_logic.match_cluster_ids); fit_clusters.py
+# prints the ids that were retired or added.
+GPT_LARGE_CLUSTERS = frozenset(
+    int(cluster) for cluster in os.environ.get("GPT_LARGE_CLUSTERS", "").split(",") if cluster.strip()
+)
 
 
 class AnalysisType(str, Enum):
     """Types of analysis that can be performed."""
     FIX = "fix"
     NEW_CODE = "new_code"
+    COMBINED = "combined"
 
 
 class LogPacket(BaseModel):
@@ -43,20 +57,82 @@ class LogPacket(BaseModel):
         frozen = True
 
 
+class PromptBudget(BaseModel):
+    """Per-section token budgets for the assembled user prompt."""
+    encoding: str = "cl100k_base"
+    error_tail: int = Field(default=12000, ge=0)
+    code_context: int = Field(default=4000, ge=0)
+    metadata: int = Field(default=200, ge=0)
+
+    class Config:
+        frozen = True
+
+
 class GptCompletionConfig(BaseModel):
     """Configuration for OpenAI GPT completion requests."""
     model: str = "gpt-4o"
     max_tokens: Optional[int] = None
     temperature: float = 0.7
+    prompt_budget: PromptBudget = Field(default_factory=PromptBudget)
     
     class Config:
         frozen = True
 
 
+class ModelTier(str, Enum):
+    """Model sizes the router can choose between."""
+    SMALL = "small"
+    LARGE = "large"
+
+
+class RoutingPolicy(BaseModel):
+    """When to send an analysis to the small model instead of the large one."""
+    enabled: bool = GPT_ROUTING_ENABLED
+    small_model: str = GPT_SMALL_MODEL
+    large_model: str = GPT_LARGE_MODEL
+    max_small_tokens: int = Field(default=3000, ge=0)
+    max_small_frames: int = Field(default=30, ge=0)
+    max_small_errors: int = Field(default=5, ge=0)
+    large_clusters: FrozenSet[int] = GPT_LARGE_CLUSTERS
+
+    class Config:
+        frozen = True
+
+
+class RoutingDecision(BaseModel):
+    """Model chosen for one analysis, and why."""
+    tier: ModelTier
+    model: str
+    reason: str
+    escalation_model: Optional[str] = None
+
+    def metadata(self, escalation_reason: Optional[str] = None) -> Dict[str, Any]:
+        """Describe the decision, and any escalation, for logs and stored results."""
+        return {
+            "tier": self.tier.value,
+            "routed_model": self.model,
+            "reason": self.reason,
+            "escalated": escalation_reason is not None,
+            "escalation_reason": escalation_reason,
+        }
+
+
+class LogReductionConfig(BaseModel):
+    """Configuration for reducing build logs to their error-relevant parts."""
+    context_before: int = Field(default=20, ge=0)
+    context_after: int = Field(default=10, ge=0)
+    tail_lines: int = Field(default=150, ge=0)
+    max_anchor_lines: int = Field(default=3000, ge=0)
+
+    class Config:
+        frozen = True
+
+
 class SystemPrompts(BaseModel):
     """Predefined system prompts for different analysis types."""
     fix: str = "You are an agent in charge of helping people fix their broken builds. Analyze these logs and code to identify the error and provide a clear, step-by-step solution. Focus on the actual error shown in the traceback."
     new_code: str = "You are an agent in charge of helping people fix their broken builds. Analyze these logs and code to identify the error and provide a solution for the problem using the code provided. The user should be able to drag and drop the new code into their code and it should work instantly."
+    combined: str = "You are an agent in charge of helping people fix their broken builds. Analyze these logs and code to identify the error. Respond with a JSON object with exactly two string fields: \"analysis\", a clear, step-by-step solution focused on the actual error shown in the traceback, and \"new_code\", replacement code the user can drag and drop into their code so that it works instantly."
 
 
 class AnalysisResult(BaseModel):
@@ -73,7 +149,53 @@ class AnalysisResult(BaseModel):
         return self.error is None
 
 
+class CombinedAnalysis(BaseModel):
+    """Structured response holding both the analysis and the replacement code."""
+    analysis: str
+    new_code: str
+
+    @validator('analysis', 'new_code')
+    def field_not_empty(cls, v):
+        if not v.strip():
+            raise ValueError('Field cannot be empty')
+        return v
+
+
 SYSTEM_PROMPTS = SystemPrompts()
+ROUTING_POLICY = RoutingPolicy()
+
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b[@-Z\\-_]")
+TIMESTAMP_PATTERN = re.compile(r"^\s*(?:\[?\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?\]?|\[\d{2}:\d{2}:\d{2}\])\s*")
+PROGRESS_PATTERN = re.compile(r"\d{1,3}%\s*\|[^|]*\||[━█▉▊▋▌▍▎▏]{5,}|\[[=#>\- ]{5,}\]")
+ERROR_ANCHOR_PATTERN = re.compile(
+    r"Traceback \(most recent call last\)"
+    r"|\b(?:error|ERROR|Error)\b\s*[:\[!]"
+    r"|\b\w+(?:Error|Exception):"
+    r"|\bFAILED\b|\bFAIL:"
+    r"|exit (?:code|status) [1-9]\d*"
+    r"|non-zero exit status"
+    r"|panicked at"
+)
+
+# Failures that need the large model however short the log is
+COMPLEX_ERROR_PATTERN = re.compile(
+    r"undefined reference to|ld returned \d+ exit status|linker command failed|collect2: error"
+    r"|Segmentation fault|core dumped|internal compiler error"
+    r"|no matching function for call|required from here|template argument deduction"
+    r"|data race|deadlock detected"
+)
+# Failures a small model handles as well as a large one
+SIMPLE_ERROR_PATTERN = re.compile(
+    r"ModuleNotFoundError|No module named|ImportError|SyntaxError|IndentationError|NameError"
+    r"|command not found|Cannot find module|missing script|FileNotFoundError|No such file or directory"
+)
+STACK_FRAME_PATTERN = re.compile(
+    r'^\s*(?:File "[^"]+", line \d+|at [\w$.<>]+\(.*\)|#\d+\s+0x[0-9a-fA-F]+)',
+    re.MULTILINE
+)
+
+FIX_ERROR_MESSAGE = "I encountered an error analyzing your logs. Please try again or contact support."
+NEW_CODE_ERROR_MESSAGE = "I encountered an error generating new code. Please try again or contact support."
 
 
 def analyze(logs: str) -> AnalysisResult:
@@ -84,7 +206,75 @@ def analyze(logs: str) -> AnalysisResult:
     return result
 
 
-def parse_logs(logs: str) -> LogPacket:
+def clean_log_line(line: str) -> str:
+    """Strip ANSI codes, carriage-return redraws and timestamps from a log line."""
+    line = line.rstrip("\r\n")
+    if "\r" in line:
+        line = line.rsplit("\r", 1)[-1]
+    line = ANSI_ESCAPE_PATTERN.sub("", line)
+    return TIMESTAMP_PATTERN.sub("", line, count=1)
+
+
+def reduce_log_lines(
+    lines: Iterable[str],
+    config: Optional[LogReductionConfig] = None
+) -> str:
+    """Reduce a stream of log lines to windows around error anchors plus the tail.
+
+    Lines are consumed one at a time, so only the context buffers and the
+    kept lines are ever held in memory.
+    """
+    if config is None:
+        config = LogReductionConfig()
+
+    before: deque = deque(maxlen=config.context_before)
+    tail: deque = deque(maxlen=config.tail_lines)
+    kept: Dict[int, str] = {}
+    after_remaining = 0
+    total = 0
+
+    for index, raw_line in enumerate(lines):
+        total = index + 1
+        line = clean_log_line(raw_line)
+        is_anchor = bool(ERROR_ANCHOR_PATTERN.search(line))
+
+        if not is_anchor and PROGRESS_PATTERN.search(line):
+            continue
+
+        if is_anchor and len(kept) < config.max_anchor_lines:
+            kept.update(before)
+            before.clear()
+            kept[index] = line
+            after_remaining = config.context_after
+        elif after_remaining > 0:
+            kept[index] = line
+            after_remaining -= 1
+        else:
+            before.append((index, line))
+
+        tail.append((index, line))
+
+    kept.update(tail)
+
+    reduced = []
+    previous = -1
+    for index in sorted(kept):
+        if index - previous > 1:
+            reduced.append(f"... [{index - previous - 1} lines omitted] ...")
+        reduced.append(kept[index])
+        previous = index
+    if total - previous > 1:
+        reduced.append(f"... [{total - previous - 1} lines omitted] ...")
+
+    return "\n".join(reduced)
+
+
+def reduce_logs(logs: str, config: Optional[LogReductionConfig] = None) -> str:
+    """Reduce raw build logs to their error-relevant parts."""
+    return reduce_log_lines(io.StringIO(logs), config)
+
+
+def parse_logs(logs: str, reduce: bool = True) -> LogPacket:
     """Parse logs to extract error details and context."""
     file_pattern = r"===BEGIN_FILE:\s*(.*?)===\n(.*?)===END_FILE==="
     file_match = re.search(file_pattern, logs, re.DOTALL)
@@ -92,61 +282,311 @@ def parse_logs(logs: str) -> LogPacket:
     file_name = None
     if file_match:
         file_name = file_match.group(1).strip()
+
+    if reduce:
+        reduced = reduce_logs(logs)
+        if reduced.strip() and len(reduced) < len(logs):
+            logger.info(f"Reduced logs from {len(logs)} to {len(reduced)} characters")
+            logs = reduced
         
     return LogPacket(logs=logs, file_name=file_name)
 
 
+def assemble_prompt(
+    log_packet: LogPacket,
+    code_context: Optional[str] = None,
+    budget: Optional[PromptBudget] = None
+) -> str:
+    """Build the user prompt once per section, each trimmed to its token budget.
+
+    The error logs keep their tail, where the failure usually is; code context
+    and metadata keep their head.
+    """
+    if budget is None:
+        budget = PromptBudget()
+
+    sections = []
+
+    metadata_lines = []
+    if log_packet.file_name:
+        metadata_lines.append(f"File: {log_packet.file_name}")
+    if log_packet.line_number is not None:
+        metadata_lines.append(f"Line: {log_packet.line_number}")
+    if metadata_lines:
+        metadata = truncate_tokens("\n".join(metadata_lines), budget.metadata, budget.encoding)
+        sections.append(f"Metadata:\n{metadata}")
+
+    error_tail = truncate_tokens(log_packet.logs, budget.error_tail, budget.encoding, keep="tail")
+    sections.append(f"Build logs:\n{error_tail}")
+
+    if code_context and code_context.strip():
+        context = truncate_tokens(code_context, budget.code_context, budget.encoding)
+        sections.append(f"Code context from repository:\n{context}")
+
+    return "\n\n".join(sections)
+
+
+def _build_messages(
+    log_packet: LogPacket,
+    analysis_type: AnalysisType,
+    config: GptCompletionConfig,
+    custom_add: Optional[str] = None,
+    code_context: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """Build the chat messages sent to GPT for an analysis type."""
+    content = assemble_prompt(log_packet, code_context, config.prompt_budget)
+    if custom_add:
+        content += f"\n\nAdditional context: {custom_add}"
+
+    system_prompt = getattr(SYSTEM_PROMPTS, analysis_type.value)
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+
+
+def _response_format(analysis_type: AnalysisType) -> Dict[str, Any]:
+    """Extra completion arguments needed for structured analysis types."""
+    if analysis_type == AnalysisType.COMBINED:
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+
+def parse_combined_response(content: Optional[str]) -> Optional[CombinedAnalysis]:
+    """Parse and validate a combined JSON response, returning None if it is unusable."""
+    if not content:
+        return None
+
+    text = content.strip()
+    fence_match = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    if fence_match:
+        text = fence_match.group(1)
+
+    try:
+        return CombinedAnalysis.parse_obj(json.loads(text))
+    except Exception as e:
+        logger.warning(f"Combined GPT response failed validation: {str(e)}")
+        return None
+
+
+def _completion_result(
+    completion: Any,
+    log_packet: LogPacket,
+    analysis_type: AnalysisType,
+    config: GptCompletionConfig
+) -> AnalysisResult:
+    """Wrap an OpenAI completion in an AnalysisResult."""
+    return AnalysisResult(
+        analysis_type=analysis_type,
+        content=completion.choices[0].message.content,
+        log_packet=log_packet,
+        metadata={
+            "model": config.model,
+            "temperature": config.temperature,
+            "finish_reason": completion.choices[0].finish_reason
+        }
+    )
+
+
+def _error_result(
+    error: Exception,
+    log_packet: LogPacket,
+    analysis_type: AnalysisType,
+    config: GptCompletionConfig
+) -> AnalysisResult:
+    """Wrap a failed GPT call in an AnalysisResult."""
+    logger.error(f"Error calling GPT: {str(error)}")
+    return AnalysisResult(
+        analysis_type=analysis_type,
+        content="",
+        log_packet=log_packet,
+        error=f"Failed to analyze logs with GPT: {str(error)}",
+        metadata={"model": config.model}
+    )
+
+
+def route_analysis(
+    log_packet: LogPacket,
+    code_context: Optional[str] = None,
+    cluster: Optional[int] = None,
+    policy: Optional[RoutingPolicy] = None
+) -> RoutingDecision:
+    """Pick the small or large model from the reduced log's size, error class and cluster.
+
+    Small-model decisions carry the large model as their escalation target.
+    """
+    if policy is None:
+        policy = ROUTING_POLICY
+
+    def large(reason: str) -> RoutingDecision:
+        return RoutingDecision(tier=ModelTier.LARGE, model=policy.large_model, reason=reason)
+
+    if not policy.enabled:
+        return large("routing disabled")
+    if cluster is not None and cluster in policy.large_clusters:
+        return large(f"cluster {cluster} needs the large model")
+
+    logs = log_packet.logs
+    complex_match = COMPLEX_ERROR_PATTERN.search(logs)
+    if complex_match:
+        return large(f"complex error: {complex_match.group(0)}")
+
+    estimated_tokens = (len(logs) + len(code_context or "")) // 4
+    if estimated_tokens > policy.max_small_tokens:
+        return large(f"input of about {estimated_tokens} tokens")
+    frames = len(STACK_FRAME_PATTERN.findall(logs))
+    if frames > policy.max_small_frames:
+        return large(f"{frames} stack frames")
+    errors = len(ERROR_ANCHOR_PATTERN.findall(logs))
+    if errors > policy.max_small_errors:
+        return large(f"{errors} error lines")
+
+    simple_match = SIMPLE_ERROR_PATTERN.search(logs)
+    return RoutingDecision(
+        tier=ModelTier.SMALL,
+        model=policy.small_model,
+        reason=f"simple error: {simple_match.group(0)}" if simple_match else "small input",
+        escalation_model=policy.large_model
+    )
+
+
+def response_is_usable(result: AnalysisResult) -> bool:
+    """Default check that a text response is complete enough to return."""
+    return bool(result.content and result.content.strip()) and result.metadata.get("finish_reason") != "length"
+
+
 def call_gpt(
     log_packet: LogPacket, 
     analysis_type: AnalysisType, 
     config: Optional[GptCompletionConfig] = None,
-    custom_add: Optional[str] = None
+    custom_add: Optional[str] = None,
+    code_context: Optional[str] = None
 ) -> AnalysisResult:
-    """Call GPT to analyze logs according to the specified analysis type."""
-    content = log_packet.logs
-    if custom_add:
-        content += f"\nAdditional context: {custom_add}"
-    
+    """Call GPT to analyze logs according to the specified analysis type.
+
+    Transient provider errors are retried within the current request
+    deadline, and calls fail fast while the completions circuit is open.
+    Whatever still fails is returned as an error result.
+    """
     if config is None:
         config = GptCompletionConfig()
     
-    system_prompt = getattr(SYSTEM_PROMPTS, analysis_type.value)
-    
     try:
-        completion = client.chat.completions.create(
-            model=config.model,
-            temperature=config.temperature,
-            max_tokens=config.max_tokens,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": content},
-            ],
+        messages = _build_messages(log_packet, analysis_type, config, custom_add, code_context)
+        completion = completion_calls.call_sync(
+            lambda timeout: get_openai_client().chat.completions.create(
+                model=config.model,
+                temperature=config.temperature,
+                max_tokens=config.max_tokens,
+                messages=messages,
+                timeout=timeout,
+                **_response_format(analysis_type),
+            )
         )
-        
-        gpt_response = completion.choices[0].message.content
-        
-        return AnalysisResult(
-            analysis_type=analysis_type,
-            content=gpt_response,
-            log_packet=log_packet,
-            metadata={
-                "model": config.model,
-                "temperature": config.temperature,
-                "finish_reason": completion.choices[0].finish_reason
-            }
-        )
-        
+        return _completion_result(completion, log_packet, analysis_type, config)
     except Exception as e:
-        logger.error(f"Error calling GPT: {str(e)}")
-        error_message = f"Failed to analyze logs with GPT: {str(e)}"
-        
-        return AnalysisResult(
-            analysis_type=analysis_type,
-            content="",
-            log_packet=log_packet,
-            error=error_message,
-            metadata={"model": config.model}
+        return _error_result(e, log_packet, analysis_type, config)
+
+
+async def call_gpt_async(
+    log_packet: LogPacket,
+    analysis_type: AnalysisType,
+    config: Optional[GptCompletionConfig] = None,
+    custom_add: Optional[str] = None,
+    code_context: Optional[str] = None
+) -> AnalysisResult:
+    """Async variant of call_gpt that does not block the event loop."""
+    if config is None:
+        config = GptCompletionConfig()
+
+    try:
+        messages = _build_messages(log_packet, analysis_type, config, custom_add, code_context)
+        completion = await completion_calls.call(
+            lambda timeout: get_async_openai_client().chat.completions.create(
+                model=config.model,
+                temperature=config.temperature,
+                max_tokens=config.max_tokens,
+                messages=messages,
+                timeout=timeout,
+                **_response_format(analysis_type),
+            )
         )
+        return _completion_result(completion, log_packet, analysis_type, config)
+    except Exception as e:
+        return _error_result(e, log_packet, analysis_type, config)
+
+
+async def call_gpt_routed_async(
+    log_packet: LogPacket,
+    analysis_type: AnalysisType,
+    routing: RoutingDecision,
+    config: Optional[GptCompletionConfig] = None,
+    custom_add: Optional[str] = None,
+    code_context: Optional[str] = None,
+    validate: Callable[[AnalysisResult], bool] = response_is_usable
+) -> AnalysisResult:
+    """Call the routed model, escalating once to the large model if the answer is unusable.
+
+    The routing decision and any escalation are recorded in the result's
+    metadata under "routing".
+    """
+    if config is None:
+        config = GptCompletionConfig()
+
+    result = await call_gpt_async(
+        log_packet, analysis_type, config.copy(update={"model": routing.model}), custom_add, code_context)
+    escalation_reason = None
+    if routing.escalation_model and not (result.successful and validate(result)):
+        escalation_reason = result.error or "response failed validation"
+        logger.info(f"Escalating {analysis_type.value} analysis to {routing.escalation_model}: {escalation_reason}")
+        result = await call_gpt_async(
+            log_packet, analysis_type, config.copy(update={"model": routing.escalation_model}),
+            custom_add, code_context)
+
+    result.metadata["routing"] = routing.metadata(escalation_reason)
+    return result
+
+
+def record_routing(routing_log: Optional[Dict[str, Any]], result: AnalysisResult) -> None:
+    """Copy a routed result's routing metadata and final model into routing_log."""
+    if routing_log is not None and "routing" in result.metadata:
+        routing_log[result.analysis_type.value] = {
+            **result.metadata["routing"], "model": result.metadata.get("model")}
+
+
+async def stream_gpt_async(
+    log_packet: LogPacket,
+    analysis_type: AnalysisType,
+    config: Optional[GptCompletionConfig] = None,
+    custom_add: Optional[str] = None,
+    code_context: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Yield the completion text as GPT generates it.
+
+    Unlike call_gpt_async, errors are raised to the caller, which decides
+    how to report a stream that failed part way through.
+    """
+    if config is None:
+        config = GptCompletionConfig()
+
+    messages = _build_messages(log_packet, analysis_type, config, custom_add, code_context)
+    # Only opening the stream is retried; tokens already yielded cannot be replayed
+    stream = await completion_calls.call(
+        lambda timeout: get_async_openai_client().chat.completions.create(
+            model=config.model,
+            temperature=config.temperature,
+            max_tokens=config.max_tokens,
+            messages=messages,
+            stream=True,
+            timeout=timeout,
+            **_response_format(analysis_type),
+        ),
+        hedge=False
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
 
 
 def call_gpt_fix(
@@ -189,23 +629,16 @@ def call_gpt_new_code(
 
 def call_gpt_fix_with_combined_logs(
     log_packet: LogPacket, 
-    combined_logs: str,
+    code_context: Optional[str] = None,
     config: Optional[GptCompletionConfig] = None
 ) -> str:
-    """Call GPT for fix with additional context from combined logs."""
+    """Call GPT for fix with code context from the repository."""
     try:
-        prompt = f"""Original error:
-{log_packet.logs}
-
-Full context with additional repository information:
-{combined_logs}
-"""
-        
         result = call_gpt(
             log_packet=log_packet,
             analysis_type=AnalysisType.FIX,
             config=config,
-            custom_add=combined_logs
+            code_context=code_context
         )
         
         if result.error:
@@ -214,21 +647,21 @@ Full context with additional repository information:
         return result.content
     except Exception as e:
         logger.error(f"Error in call_gpt_fix_with_combined_logs: {str(e)}")
-        return "I encountered an error analyzing your logs. Please try again or contact support."
+        return FIX_ERROR_MESSAGE
 
 
 def call_gpt_new_code_with_combined_logs(
     log_packet: LogPacket, 
-    combined_logs: str,
+    code_context: Optional[str] = None,
     config: Optional[GptCompletionConfig] = None
 ) -> str:
-    """Call GPT for new code with additional context from combined logs."""
+    """Call GPT for new code with code context from the repository."""
     try:
         result = call_gpt(
             log_packet=log_packet,
             analysis_type=AnalysisType.NEW_CODE,
             config=config,
-            custom_add=combined_logs
+            code_context=code_context
         )
         
         if result.error:
@@ -237,4 +670,119 @@ def call_gpt_new_code_with_combined_logs(
         return result.content
     except Exception as e:
         logger.error(f"Error in call_gpt_new_code_with_combined_logs: {str(e)}")
-        return "I encountered an error generating new code. Please try again or contact support."
\ No newline at end of file
+        return NEW_CODE_ERROR_MESSAGE
+
+
+async def call_gpt_fix_with_combined_logs_async(
+    log_packet: LogPacket,
+    code_context: Optional[str] = None,
+    config: Optional[GptCompletionConfig] = None,
+    routing: Optional[RoutingDecision] = None,
+    routing_log: Optional[Dict[str, Any]] = None
+) -> str:
+    """Async variant of call_gpt_fix_with_combined_logs, optionally routed.
+
+    With routing_log, the routing decision is recorded in it (see record_routing).
+    """
+    try:
+        if routing is None:
+            result = await call_gpt_async(
+                log_packet=log_packet,
+                analysis_type=AnalysisType.FIX,
+                config=config,
+                code_context=code_context
+            )
+        else:
+            result = await call_gpt_routed_async(
+                log_packet=log_packet,
+                analysis_type=AnalysisType.FIX,
+                routing=routing,
+                config=config,
+                code_context=code_context
+            )
+            record_routing(routing_log, result)
+
+        if result.error:
+            raise RuntimeError(result.error)
+
+        return result.content
+    except Exception as e:
+        logger.error(f"Error in call_gpt_fix_with_combined_logs_async: {str(e)}")
+        return FIX_ERROR_MESSAGE
+
+
+async def call_gpt_new_code_with_combined_logs_async(
+    log_packet: LogPacket,
+    code_context: Optional[str] = None,
+    config: Optional[GptCompletionConfig] = None,
+    routing: Optional[RoutingDecision] = None,
+    routing_log: Optional[Dict[str, Any]] = None
+) -> str:
+    """Async variant of call_gpt_new_code_with_combined_logs, optionally routed.
+
+    With routing_log, the routing decision is recorded in it (see record_routing).
+    """
+    try:
+        if routing is None:
+            result = await call_gpt_async(
+                log_packet=log_packet,
+                analysis_type=AnalysisType.NEW_CODE,
+                config=config,
+                code_context=code_context
+            )
+        else:
+            result = await call_gpt_routed_async(
+                log_packet=log_packet,
+                analysis_type=AnalysisType.NEW_CODE,
+                routing=routing,
+                config=config,
+                code_context=code_context
+            )
+            record_routing(routing_log, result)
+
+        if result.error:
+            raise RuntimeError(result.error)
+
+        return result.content
+    except Exception as e:
+        logger.error(f"Error in call_gpt_new_code_with_combined_logs_async: {str(e)}")
+        return NEW_CODE_ERROR_MESSAGE
+
+
+async def call_gpt_combined_with_combined_logs_async(
+    log_packet: LogPacket,
+    code_context: Optional[str] = None,
+    config: Optional[GptCompletionConfig] = None,
+    routing: Optional[RoutingDecision] = None,
+    routing_log: Optional[Dict[str, Any]] = None
+) -> Optional[CombinedAnalysis]:
+    """Get analysis and new code from a single structured completion.
+
+    Returns None when the call fails or the response does not match the
+    schema, so callers can fall back to the separate fix and new code calls.
+    With routing, a small-model response that fails the schema is retried
+    on the large model first, and the decision is recorded in routing_log.
+    """
+    if routing is None:
+        result = await call_gpt_async(
+            log_packet=log_packet,
+            analysis_type=AnalysisType.COMBINED,
+            config=config,
+            code_context=code_context
+        )
+    else:
+        result = await call_gpt_routed_async(
+            log_packet=log_packet,
+            analysis_type=AnalysisType.COMBINED,
+            routing=routing,
+            config=config,
+            code_context=code_context,
+            validate=lambda candidate: parse_combined_response(candidate.content) is not None
+        )
+        record_routing(routing_log, result)
+
+    if result.error:
+        logger.error(f"Error in call_gpt_combined_with_combined_logs_async: {result.error}")
+        return None
+
+    return parse_combined_response(result.content)
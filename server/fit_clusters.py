@@ -0,0 +1,44 @@
+# Standard library imports
+import os
+import sys
+
+# Internal imports
+from vector_logic import ClusteringConfig, cluster_ids, clustering_fit_incremental, get_cluster_model, open_vector_index_snapshot
+
+CLUSTER_COUNT = int(os.environ.get("CLUSTER_COUNT", str(ClusteringConfig().n_clusters)))
+CLUSTER_N_INIT = int(os.environ.get("CLUSTER_N_INIT", str(ClusteringConfig().n_init)))
+
+
+def main() -> int:
+    """Refit the error clusters over the whole vector index.
+
+    Meant to run as a scheduled job (e.g. nightly cron) against the same
+    VECTOR_STORE_* and CLUSTER_MODEL_PATH settings as the server. Running
+    servers pick up the new model on their next cluster assignment. A local
+    vector store is read through a snapshot, since the server holds it.
+    """
+    open_vector_index_snapshot()
+    config = ClusteringConfig(n_clusters=CLUSTER_COUNT, n_init=CLUSTER_N_INIT)
+    previous = get_cluster_model(config.model_path)
+    previous_ids = set(cluster_ids(previous).tolist()) if previous is not None else set()
+
+    assignments, model = clustering_fit_incremental(config)
+    if model is None:
+        print("FAIL: clustering did not produce a model, see the log above")
+        return 1
+
+    ids = set(cluster_ids(model).tolist())
+    print(f"Clustered {len(assignments)} vectors into {len(ids)} clusters")
+    for cluster, size in assignments["cluster"].value_counts().sort_index().items():
+        print(f"  cluster {cluster}: {size} vectors")
+    if previous is not None:
+        retired, added = sorted(previous_ids - ids), sorted(ids - previous_ids)
+        if retired:
+            print(f"Retired cluster ids (drop them from GPT_LARGE_CLUSTERS): {retired}")
+        if added:
+            print(f"New cluster ids: {added}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
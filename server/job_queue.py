@@ -0,0 +1,332 @@
+# Standard library imports
+import asyncio
+import ipaddress
+import logging
+import os
+import random
+import socket
+from abc import ABC, abstractmethod
+from datetime import datetime
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+# Third-party imports
+import httpx
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+# Internal imports
+from cache_logic import TTLCache
+
+logger = logging.getLogger("job_queue")
+
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "1000"))
+# Total size of the payloads waiting in the queue, since one job's logs can be many megabytes
+JOB_QUEUE_MAX_BYTES = int(os.environ.get("JOB_QUEUE_MAX_BYTES", str(256 * 1024 * 1024)))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "3600"))
+JOB_STORE_SIZE = int(os.environ.get("JOB_STORE_SIZE", "10000"))
+JOB_SHUTDOWN_GRACE = float(os.environ.get("JOB_SHUTDOWN_GRACE", "30"))
+JOB_WEBHOOK_TIMEOUT = float(os.environ.get("JOB_WEBHOOK_TIMEOUT", "10"))
+JOB_WEBHOOK_RETRIES = int(os.environ.get("JOB_WEBHOOK_RETRIES", "3"))
+JOB_WEBHOOK_CONCURRENCY = int(os.environ.get("JOB_WEBHOOK_CONCURRENCY", "16"))
+# Comma-separated hostnames webhooks may be sent to; empty allows any public host
+JOB_WEBHOOK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.environ.get("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+
+# A handler runs one job's payload and returns its JSON-serializable result
+JobHandler = Callable[[Any], Awaitable[Dict[str, Any]]]
+
+
+# ----- Pydantic Models -----
+
+class JobStatus(str, Enum):
+    """Lifecycle of an analysis job."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    """State of a queued job and, once finished, its result."""
+    job_id: str
+    status: JobStatus = JobStatus.QUEUED
+    created_at: str = ""
+    finished_at: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    webhook_url: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+
+# ----- Webhooks -----
+
+async def check_webhook_url(url: str) -> None:
+    """Reject webhook URLs that could reach the server's own network.
+
+    The URL must be https and its host must be allowed and resolve only to
+    public addresses, so callers cannot aim deliveries at loopback, private
+    or link-local hosts such as cloud metadata endpoints. Raises a 400.
+    Checked again before each delivery, since DNS answers can change.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" or not host:
+        raise HTTPException(status_code=400, detail="Webhook URL must be an https URL")
+    if JOB_WEBHOOK_ALLOWED_HOSTS and host not in JOB_WEBHOOK_ALLOWED_HOSTS:
+        raise HTTPException(status_code=400, detail="Webhook host is not allowed")
+
+    try:
+        port = parts.port or 443
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (ValueError, OSError):
+        raise HTTPException(status_code=400, detail="Webhook host could not be resolved")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise HTTPException(status_code=400, detail="Webhook host must resolve to a public address")
+
+
+# ----- Queues -----
+
+class JobQueue(ABC):
+    """Queue of pending jobs plus the store their state is polled from."""
+
+    @property
+    @abstractmethod
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+
+    @abstractmethod
+    async def submit(self, job: Job, payload: Any, size: int = 0) -> None:
+        """Record a job and queue its payload, raising 503 if the queue is full.
+
+        size is the payload's approximate size in bytes, counted against
+        the queue's byte budget while the job waits.
+        """
+
+    @abstractmethod
+    async def next(self) -> Tuple[Job, Any]:
+        """Wait for the next queued job and its payload."""
+
+    @abstractmethod
+    async def update(self, job: Job) -> None:
+        """Store a job's new state, waking anyone waiting for it to finish."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Return a job's current state, or None if it is unknown or expired."""
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Return a job's state once it finishes, or its current state after timeout."""
+        job = await self.get(job_id)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while job is not None and not job.done:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 0.5))
+            job = await self.get(job_id)
+        return job
+
+
+class InMemoryJobQueue(JobQueue):
+    """Process-local job queue; jobs are lost on restart.
+
+    Job state is kept in a TTL cache so finished results expire, and
+    long-polling callers are woken by an event instead of polling.
+
+    Jobs live in the memory of the process that accepted them, so this
+    queue needs the server to run as a single worker process. With
+    several, a poll for a job lands on a worker that never saw it and
+    gets a 404.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = JOB_QUEUE_SIZE,
+        result_ttl: float = JOB_RESULT_TTL,
+        store_size: int = JOB_STORE_SIZE,
+        max_bytes: int = JOB_QUEUE_MAX_BYTES
+    ) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._jobs: TTLCache[Job] = TTLCache(maxsize=store_size, ttl=result_ttl)
+        self._events: Dict[str, asyncio.Event] = {}
+        self.max_bytes = max_bytes
+        self.queued_bytes = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, job: Job, payload: Any, size: int = 0) -> None:
+        if size > self.max_bytes:
+            raise HTTPException(status_code=413, detail="Logs are too large to queue for analysis")
+        if self._queue.full() or self.queued_bytes + size > self.max_bytes:
+            raise HTTPException(
+                status_code=503,
+                detail="Analysis queue is full, retry later",
+                headers={"Retry-After": "5"}
+            )
+        self._queue.put_nowait((job.job_id, payload, size))
+        self.queued_bytes += size
+        self._jobs.set(job.job_id, job)
+
+    async def next(self) -> Tuple[Job, Any]:
+        while True:
+            job_id, payload, size = await self._queue.get()
+            self.queued_bytes -= size
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job, payload
+            logger.warning(f"Skipping job {job_id}, its state expired while queued")
+
+    async def update(self, job: Job) -> None:
+        self._jobs.set(job.job_id, job)
+        if job.done:
+            event = self._events.pop(job.job_id, None)
+            if event is not None:
+                event.set()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or job.done or timeout <= 0:
+            return job
+        event = self._events.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._jobs.get(job_id)
+
+
+# ----- Workers -----
+
+class JobWorkerPool:
+    """Fixed number of workers that run queued jobs and deliver webhooks.
+
+    The pool size bounds how many analyses run at once, however many jobs
+    are queued. Webhooks are delivered by separate tasks, so a slow
+    endpoint does not hold a worker. Shutdown waits up to a grace period
+    for running jobs and pending deliveries.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: JobHandler,
+        workers: int = JOB_WORKERS,
+        webhook_timeout: float = JOB_WEBHOOK_TIMEOUT,
+        webhook_retries: int = JOB_WEBHOOK_RETRIES,
+        webhook_concurrency: int = JOB_WEBHOOK_CONCURRENCY
+    ) -> None:
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self._tasks: List[asyncio.Task] = []
+        self._running: Set[asyncio.Task] = set()
+        self._deliveries: Set[asyncio.Task] = set()
+        self._delivery_slots = asyncio.Semaphore(webhook_concurrency)
+        self._http: Optional[httpx.AsyncClient] = None
+        self.stats = {"succeeded": 0, "failed": 0, "webhooks_failed": 0}
+
+    @property
+    def busy(self) -> int:
+        """Number of jobs currently being run."""
+        return len(self._running)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        # Redirects are not followed, since they could lead past the address checks
+        self._http = httpx.AsyncClient(timeout=self.webhook_timeout, follow_redirects=False)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self, grace: float = JOB_SHUTDOWN_GRACE) -> None:
+        """Stop taking jobs and give running jobs and webhooks up to grace seconds to finish."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + grace
+        if self._running:
+            _, pending = await asyncio.wait(self._running, timeout=grace)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Cancelled {len(pending)} jobs still running at shutdown")
+        if self._deliveries:
+            _, pending = await asyncio.wait(self._deliveries, timeout=max(0.0, deadline - loop.time()))
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Cancelled {len(pending)} webhook deliveries still pending at shutdown")
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        logger.info(f"Job workers closed: {self.stats}")
+
+    async def _work(self) -> None:
+        while True:
+            job, payload = await self.queue.next()
+            task = asyncio.create_task(self._run(job, payload))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            # Shielded so cancelling the worker at shutdown leaves the job to finish
+            await asyncio.shield(task)
+
+    async def _run(self, job: Job, payload: Any) -> None:
+        job = job.copy(update={"status": JobStatus.RUNNING})
+        await self.queue.update(job)
+        try:
+            result = await self.handler(payload)
+            job = job.copy(update={"status": JobStatus.SUCCEEDED, "result": result})
+            self.stats["succeeded"] += 1
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Job {job.job_id} failed: {detail}")
+            job = job.copy(update={"status": JobStatus.FAILED, "error": str(detail)})
+            self.stats["failed"] += 1
+        job = job.copy(update={"finished_at": datetime.now().isoformat()})
+        await self.queue.update(job)
+        if job.webhook_url:
+            delivery = asyncio.create_task(self._deliver_webhook(job))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+
+    async def _deliver_webhook(self, job: Job) -> None:
+        async with self._delivery_slots:
+            await self._post_webhook(job)
+
+    async def _post_webhook(self, job: Job) -> None:
+        payload = job.dict(exclude={"webhook_url"})
+        for attempt in range(self.webhook_retries + 1):
+            try:
+                await check_webhook_url(job.webhook_url)
+            except HTTPException as e:
+                logger.error(f"Not delivering webhook for job {job.job_id}: {e.detail}")
+                self.stats["webhooks_failed"] += 1
+                return
+            try:
+                response = await self._http.post(job.webhook_url, json=payload)
+                response.raise_for_status()
+                return
+            except Exception as e:
+                if attempt == self.webhook_retries:
+                    logger.error(f"Webhook for job {job.job_id} failed after {attempt + 1} attempts: {str(e)}")
+                    self.stats["webhooks_failed"] += 1
+                    return
+                delay = 0.5 * (2 ** attempt) * (0.5 + random.random())
+                await asyncio.sleep(delay)
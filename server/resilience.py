@@ -0,0 +1,370 @@
+# Standard library imports
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Deque, FrozenSet, Iterator, Optional, TypeVar
+
+# Third-party imports
+import openai
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger("resilience")
+
+T = TypeVar("T")
+
+PROVIDER_ATTEMPT_TIMEOUT = float(os.environ.get("PROVIDER_ATTEMPT_TIMEOUT", "60"))
+PROVIDER_MAX_ATTEMPTS = int(os.environ.get("PROVIDER_MAX_ATTEMPTS", "3"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+GPT_HEDGE_ENABLED = os.environ.get("GPT_HEDGE_ENABLED", "false").lower() == "true"
+EMBEDDING_HEDGE_ENABLED = os.environ.get("EMBEDDING_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider that is failing."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request's deadline budget is spent."""
+
+
+# ----- Pydantic Models -----
+
+class RetryPolicy(BaseModel):
+    """Exponential backoff with full jitter for transient provider errors."""
+    max_attempts: int = Field(default=PROVIDER_MAX_ATTEMPTS, ge=1)
+    base_delay: float = Field(default=0.5, ge=0)
+    max_delay: float = Field(default=8.0, ge=0)
+    attempt_timeout: float = Field(default=PROVIDER_ATTEMPT_TIMEOUT, gt=0)
+    retryable_status_codes: FrozenSet[int] = RETRYABLE_STATUS_CODES
+
+    class Config:
+        frozen = True
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+# ----- Deadlines -----
+
+class Deadline:
+    """Absolute point in time by which a request must be finished."""
+
+    def __init__(self, seconds: float) -> None:
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """The deadline of the request being handled, if one was set."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[Deadline]:
+    """Give the enclosed pipeline stages one shared time budget.
+
+    The deadline follows the context into tasks started inside the block.
+    A nested scope can only shorten the budget, never extend it.
+    """
+    deadline = Deadline(seconds)
+    outer = _current_deadline.get()
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+# ----- Circuit Breaker -----
+
+class CircuitBreaker:
+    """Fail fast after repeated provider failures, probing again after a cool-down.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail immediately. Once reset_timeout has passed, one trial call is let
+    through; its outcome closes or reopens the circuit. A trial that ends
+    without an outcome, for example because it was cancelled, must be
+    handed back with release_trial so the next call can probe instead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial: Optional[object] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> Optional[object]:
+        """Admit a call or raise CircuitOpenError.
+
+        Returns a token when the call is the half-open trial, which the
+        caller passes back when recording the outcome or releasing it.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return None
+            if state == "half-open" and self._trial is None:
+                self._trial = object()
+                return self._trial
+        raise CircuitOpenError(f"{self.name} circuit is open, failing fast")
+
+    def release_trial(self, trial: Optional[object]) -> None:
+        """Give back a trial that finished without recording an outcome."""
+        with self._lock:
+            if trial is not None and trial is self._trial:
+                self._trial = None
+
+    def record_success(self, trial: Optional[object] = None) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"{self.name} circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = None
+
+    def record_failure(self, trial: Optional[object] = None) -> None:
+        with self._lock:
+            self.failures += 1
+            was_trial = trial is not None and trial is self._trial
+            if was_trial:
+                self._trial = None
+            if was_trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or was_trial:
+                    logger.warning(f"{self.name} circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+# ----- Latency Tracking -----
+
+class LatencyTracker:
+    """Rolling window of call latencies, used to decide when to hedge."""
+
+    def __init__(self, window: int = 200) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+# ----- Resilient Calls -----
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read a Retry-After header from a provider error, if it sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ResilientCaller:
+    """Deadline-aware retries, optional hedging and a circuit breaker for one operation.
+
+    The wrapped function receives the timeout for the attempt, which it
+    should pass to the provider client. Retrying and hedging happen only
+    within the current deadline.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: bool = False,
+        hedge_percentile: float = HEDGE_PERCENTILE
+    ) -> None:
+        self.name = name
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(name)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.latency = LatencyTracker()
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "failures": 0, "short_circuited": 0}
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+            return True
+        status_code = getattr(error, "status_code", None)
+        return status_code in self.retry.retryable_status_codes
+
+    def _attempt_timeout(self) -> float:
+        deadline = current_deadline()
+        if deadline is None:
+            return self.retry.attempt_timeout
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded before {self.name} call")
+        return min(remaining, self.retry.attempt_timeout)
+
+    def _before_attempt(self) -> Optional[object]:
+        try:
+            return self.breaker.before_call()
+        except CircuitOpenError:
+            self.stats["short_circuited"] += 1
+            raise
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Delay before the next attempt, or None if the error should be raised."""
+        if not self.is_retryable(error) or attempt == self.retry.max_attempts - 1:
+            return None
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = self.retry.backoff(attempt)
+        deadline = current_deadline()
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
+
+    def _record_outcome(self, error: Optional[Exception], trial: Optional[object]) -> None:
+        if error is not None and self.is_retryable(error):
+            self.breaker.record_failure(trial)
+        else:
+            # Any answer, even a rejected bad request, shows the provider is up
+            self.breaker.record_success(trial)
+
+    async def call(self, func: Callable[[float], Awaitable[T]], hedge: bool = True) -> T:
+        """Run an async provider call under the deadline, retry policy and breaker.
+
+        Pass hedge=False for calls whose latency is not comparable with the
+        rest, such as opening a stream; they are neither hedged nor sampled.
+        """
+        self.stats["calls"] += 1
+        for attempt in range(self.retry.max_attempts):
+            # Checked before the breaker, so an exhausted budget never claims the trial
+            timeout = self._attempt_timeout()
+            trial = self._before_attempt()
+            started = time.monotonic()
+            try:
+                attempt_call = self._hedged(func, timeout) if hedge else func(timeout)
+                result = await asyncio.wait_for(attempt_call, timeout=timeout)
+            except Exception as e:
+                self._record_outcome(e, trial)
+                error = e
+            else:
+                self._record_outcome(None, trial)
+                if hedge:
+                    self.latency.record(time.monotonic() - started)
+                return result
+            finally:
+                # Frees the trial if the attempt was cancelled before recording an outcome
+                self.breaker.release_trial(trial)
+            await asyncio.sleep(self._next_delay(error, attempt))
+        raise RuntimeError(f"{self.name} retry loop exited without a result")
+
+    def call_sync(self, func: Callable[[float], T]) -> T:
+        """Blocking variant of call, with retries and the breaker but no hedging."""
+        self.stats["calls"] += 1
+        for attempt in range(self.retry.max_attempts):
+            timeout = self._attempt_timeout()
+            trial = self._before_attempt()
+            try:
+                result = func(timeout)
+            except Exception as e:
+                self._record_outcome(e, trial)
+                error = e
+            else:
+                self._record_outcome(None, trial)
+                return result
+            finally:
+                self.breaker.release_trial(trial)
+            time.sleep(self._next_delay(error, attempt))
+        raise RuntimeError(f"{self.name} retry loop exited without a result")
+
+    def _next_delay(self, error: Exception, attempt: int) -> float:
+        """Delay before retrying a failed attempt, re-raising the error if it is final."""
+        delay = self._retry_delay(error, attempt)
+        if delay is None:
+            self.stats["failures"] += 1
+            raise error
+        self.stats["retries"] += 1
+        logger.warning(f"{self.name} attempt {attempt + 1} failed ({str(error) or type(error).__name__}), retrying in {delay:.2f}s")
+        return delay
+
+    async def _hedged(self, func: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        """Start a second identical request if the first outlives the tail latency.
+
+        Whichever request succeeds first wins and the other is cancelled.
+        """
+        hedge_after = self.latency.percentile(self.hedge_percentile) if self.hedge else None
+        if hedge_after is None or hedge_after >= timeout:
+            return await func(timeout)
+
+        primary = asyncio.ensure_future(func(timeout))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self.stats["hedges"] += 1
+        secondary = asyncio.ensure_future(func(timeout - hedge_after))
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (primary, secondary):
+                if not task.done():
+                    task.cancel()
+
+
+# One breaker and latency window per operation, shared by every request in the process
+completion_calls = ResilientCaller("completions", hedge=GPT_HEDGE_ENABLED)
+embedding_calls = ResilientCaller("embeddings", hedge=EMBEDDING_HEDGE_ENABLED)
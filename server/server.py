@@ -1,29 +1,87 @@
 # Standard library imports
+import asyncio
 import base64
+import json
+import logging
 import os
 import re
 import secrets
 import string
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, Any, Optional, List, Tuple
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, Optional, List, Tuple
 
 # Third-party imports
 import jwt
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, File, Form, HTTPException, Request, Depends, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, Field
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, EmailStr, Field, validator
+from starlette.background import BackgroundTask
+from starlette.types import Receive, Scope, Send
+from supabase import Client
 
 # Internal imports
 import debug_module
 import vector_logic
 import supabase_logic
-from auth_helpers import verify_auth_header
+import admission
+import cache_logic
+import job_queue
+import resilience
+import upload_logic
+from auth_helpers import ApiKeyAuthenticator, verify_auth_header
+from concurrency import SingleFlight, run_blocking, shutdown_executor
+from write_queue import WriteBehindQueue
 
 from dotenv import load_dotenv
 load_dotenv()
 
-app = FastAPI(title="GitHub Actions Chatbot API")
+logger = logging.getLogger("server")
+
+def build_write_queue(client: Client, response_cache: cache_logic.ResponseCache) -> WriteBehindQueue:
+    """Create the write-behind queue for bookkeeping and shared cache writes."""
+    return WriteBehindQueue({
+        "recommendations": lambda rows: supabase_logic.insert_recommendations(client, rows),
+        "usage": lambda entries: supabase_logic.record_usage_batch(client, entries),
+        "vectors": vector_logic.add_vectors,
+        "response_cache": response_cache.set_shared,
+    })
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage shared resources for the lifetime of the app."""
+    supabase_client, http_client = await run_blocking(supabase_logic.open_supabase_pool)
+    app.state.supabase = supabase_client
+    app.state.response_cache = cache_logic.build_response_cache(supabase_client)
+    app.state.api_key_authenticator = ApiKeyAuthenticator()
+    app.state.write_queue = build_write_queue(supabase_client, app.state.response_cache)
+    app.state.write_queue.start()
+    app.state.single_flight = SingleFlight()
+    app.state.admission = admission.AdmissionController()
+    app.state.job_queue = job_queue.InMemoryJobQueue()
+    app.state.job_pool = job_queue.JobWorkerPool(
+        app.state.job_queue, lambda payload: run_analysis_job(app, payload))
+    app.state.job_pool.start()
+    try:
+        await run_blocking(vector_logic.get_vector_index)
+    except Exception as e:
+        logger.warning(f"Vector index not ready at startup, will retry on first use: {str(e)}")
+    yield
+    await app.state.job_pool.close()
+    await app.state.write_queue.close()
+    await run_blocking(vector_logic.close_vector_index)
+    supabase_logic.close_supabase_pool(http_client)
+    shutdown_executor(wait=False)
+
+GPT_BRANCH_TIMEOUT = float(os.environ.get("GPT_BRANCH_TIMEOUT", "90"))
+# Budget shared by the embedding, retries and GPT calls of one analysis
+ANALYSIS_DEADLINE = float(os.environ.get("ANALYSIS_DEADLINE", "120"))
+GPT_ANALYSIS_MODE = os.environ.get("GPT_ANALYSIS_MODE", "combined")
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", "30"))
+
+app = FastAPI(title="GitHub Actions Chatbot API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +102,16 @@ class AnalyzeRequest(BaseModel):
     logs: str
     code_context: Optional[str] = None
 
+class AnalyzeJobRequest(AnalyzeRequest):
+    """Request model for queued log analysis."""
+    webhook_url: Optional[str] = None
+
+    @validator('webhook_url')
+    def validate_webhook_url(cls, v):
+        if v is not None and not v.startswith("https://"):
+            raise ValueError("Webhook URL must use https")
+        return v
+
 class ApiKeyRequest(BaseModel):
     """Request model for API key generation."""
     user_id: str = Field(..., description="Supabase user ID")
@@ -58,6 +126,14 @@ class AnalysisResponse(ApiResponse):
     """Response model for analysis endpoint."""
     analysis: str
     new_code: str
+    cache_hit: bool = False
+
+class JobResponse(ApiResponse):
+    """Response model for analysis jobs."""
+    job_id: str
+    job_status: job_queue.JobStatus
+    result: Optional[AnalysisResponse] = None
+    error: Optional[str] = None
 
 class ApiKeyResponse(ApiResponse):
     """Response model for API key generation."""
@@ -68,6 +144,30 @@ class CodeExtraction(BaseModel):
     code: str
     file_name: str
 
+class AnalysisJobPayload(BaseModel):
+    """Decoded request handed to a job worker."""
+    user: supabase_logic.ApiKeyRecord
+    api_key: str
+    logs: str
+    code_context: str
+
+class PreparedAnalysis(BaseModel):
+    """Everything known about an analysis request before GPT is called."""
+    user: supabase_logic.ApiKeyRecord
+    api_key: str
+    logs: str
+    code_context: str
+    logs_packet: debug_module.LogPacket
+    error_id: str
+    fingerprint: str
+    exact_hit: bool = False
+    coalesced: bool = False
+    cached: Optional[cache_logic.CachedResponse] = None
+    error_vector: Optional[List[float]] = None
+    cluster: Optional[int] = None
+    # Model routing per analysis type, stored with the recommendation
+    routing: Optional[Dict[str, Any]] = None
+
 # ----- Helper Functions -----
 
 def generate_api_key(length: int = 32) -> str:
@@ -89,11 +189,25 @@ def verify_jwt(token: str) -> dict:
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
 
-def extract_code_from_context(code_context: str) -> CodeExtraction:
-    """Extract code and filename from code context."""
+def decode_code_context(code_context: Optional[str]) -> str:
+    """Decode base64 code context, falling back to the raw text."""
+    if not code_context:
+        return ""
+    try:
+        return base64.b64decode(code_context, validate=True).decode("utf-8")
+    except Exception:
+        return code_context
+
+def decode_request_logs(logs: str, code_context: Optional[str]) -> Tuple[str, str]:
+    """Decode a JSON request's base64 logs and code context.
+
+    Logs can run to megabytes, so call it through run_blocking.
+    """
+    return base64.b64decode(logs).decode("utf-8"), decode_code_context(code_context)
+
+def extract_code_from_decoded_context(decoded_context: str) -> CodeExtraction:
+    """Extract code and filename from decoded code context."""
     try:
-        decoded_context = base64.b64decode(code_context).decode("utf-8")
-        
         context_pattern = r'===BEGIN_FILE: ([^=]+)===\n(.*?)===END_FILE==='
         context_matches = re.findall(context_pattern, decoded_context, re.DOTALL)
         
@@ -122,7 +236,7 @@ def extract_code_from_context(code_context: str) -> CodeExtraction:
         return CodeExtraction(code=old_code, file_name=file_name)
         
     except Exception as e:
-        print(f"Error extracting from code context: {str(e)}")
+        logger.error(f"Error extracting from code context: {str(e)}")
         return CodeExtraction(code="", file_name="unknown")
 
 def extract_code_from_logs(logs: str) -> CodeExtraction:
@@ -146,6 +260,34 @@ def extract_repository_info(logs: str) -> str:
     repo_match = re.search(repo_pattern, logs)
     return repo_match.group(1) if repo_match else "unknown/repo"
 
+def get_supabase(request: Request) -> Client:
+    """Dependency returning the shared Supabase client created at startup."""
+    return request.app.state.supabase
+
+def get_response_cache(request: Request) -> cache_logic.ResponseCache:
+    """Dependency returning the shared response cache."""
+    return request.app.state.response_cache
+
+def get_write_queue(request: Request) -> WriteBehindQueue:
+    """Dependency returning the shared write-behind queue."""
+    return request.app.state.write_queue
+
+def get_api_key_authenticator(request: Request) -> ApiKeyAuthenticator:
+    """Dependency returning the shared API key authenticator."""
+    return request.app.state.api_key_authenticator
+
+def get_single_flight(request: Request) -> SingleFlight:
+    """Dependency returning the shared in-flight analysis coalescer."""
+    return request.app.state.single_flight
+
+def get_admission(request: Request) -> admission.AdmissionController:
+    """Dependency returning the shared admission controller."""
+    return request.app.state.admission
+
+def get_job_queue(request: Request) -> job_queue.JobQueue:
+    """Dependency returning the shared analysis job queue."""
+    return request.app.state.job_queue
+
 async def get_auth_user_id(request: Request) -> str:
     """Extract and verify user ID from auth header."""
     auth_header = request.headers.get("Authorization")
@@ -161,125 +303,563 @@ async def get_auth_user_id(request: Request) -> str:
     
     return user_id
 
-async def analyze_and_get_results(logs_packet: debug_module.LogPacket) -> Tuple[str, str]:
-    """Generate analysis and new code from logs."""
-    analysis = debug_module.call_gpt_fix(logs_packet)
-    new_code = debug_module.call_gpt_new_code(logs_packet)
-    return analysis, new_code
+async def run_gpt_branch(coro: Awaitable[str], timeout: float, fallback: str, name: str) -> str:
+    """Await one GPT branch, returning the fallback text if it fails or times out."""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"GPT {name} branch timed out after {timeout}s")
+        return fallback
+    except Exception as e:
+        logger.error(f"GPT {name} branch failed: {str(e)}")
+        return fallback
+
+async def analyze_and_get_results_with_combined_logs(
+    logs_packet: debug_module.LogPacket,
+    code_context: Optional[str] = None,
+    fan_out: bool = True,
+    timeout: float = GPT_BRANCH_TIMEOUT,
+    mode: str = GPT_ANALYSIS_MODE,
+    cluster: Optional[int] = None,
+    routing_log: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str]:
+    """Generate analysis and new code from logs plus repository code context.
+
+    The model is picked per request by debug_module.route_analysis; simple
+    failures go to the small model and are escalated if its answer is
+    unusable. In "combined" mode a single structured completion returns both
+    parts; if it fails validation we fall back to the separate fix and new
+    code calls. With fan_out the fix and new code completions run
+    concurrently, each with its own timeout, so one slow or failed branch
+    does not hold back the other. The model used for each part is recorded
+    in routing_log, keyed by analysis type.
+    """
+    routing = debug_module.route_analysis(logs_packet, code_context, cluster)
+    logger.info(f"Routing analysis to {routing.model}: {routing.reason}")
+
+    if mode == debug_module.AnalysisType.COMBINED.value:
+        try:
+            combined = await asyncio.wait_for(
+                debug_module.call_gpt_combined_with_combined_logs_async(
+                    logs_packet, code_context, routing=routing, routing_log=routing_log),
+                timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"GPT combined call timed out after {timeout}s")
+            combined = None
+        if combined:
+            return combined.analysis, combined.new_code
+        logger.info("Falling back to separate fix and new code completions")
+
+    fix_branch = run_gpt_branch(
+        debug_module.call_gpt_fix_with_combined_logs_async(
+            logs_packet, code_context, routing=routing, routing_log=routing_log),
+        timeout, debug_module.FIX_ERROR_MESSAGE, "fix")
+    new_code_branch = run_gpt_branch(
+        debug_module.call_gpt_new_code_with_combined_logs_async(
+            logs_packet, code_context, routing=routing, routing_log=routing_log),
+        timeout, debug_module.NEW_CODE_ERROR_MESSAGE, "new_code")
+
+    if not fan_out:
+        analysis = await fix_branch
+        new_code = await new_code_branch
+        return analysis, new_code
 
-async def analyze_and_get_results_with_combined_logs(logs_packet: debug_module.LogPacket, combined_logs: str) -> Tuple[str, str]:
-    """Generate analysis and new code using combined logs."""
-    analysis = debug_module.call_gpt_fix_with_combined_logs(logs_packet, combined_logs)
-    new_code = debug_module.call_gpt_new_code_with_combined_logs(logs_packet, combined_logs)
+    analysis, new_code = await asyncio.gather(fix_branch, new_code_branch)
     return analysis, new_code
 
-async def create_or_update_user_api_key(user_id: str) -> str:
-    """Create or update an API key for a user."""
-    api_key = generate_api_key()
-    client = supabase_logic.initialize_supabase()
-    response = client.table("users").select("*").eq("user_id", user_id).execute()
-    
-    if len(response.data) > 0:
-        client.table("users").update({
-            "api_key": api_key,
-            "last_updated": datetime.now().isoformat()
-        }).eq("user_id", user_id).execute()
-    else:
-        client.table("users").insert({
-            "user_id": user_id,
-            "api_key": api_key,
-            "api_calls": 0,
-            "created_at": datetime.now().isoformat(),
-            "repo_used": []
-        }).execute()
+async def prepare_analysis(
+    request: AnalyzeRequest,
+    client: Client,
+    response_cache: cache_logic.ResponseCache,
+    authenticator: ApiKeyAuthenticator,
+    admission_controller: admission.AdmissionController
+) -> PreparedAnalysis:
+    """Authenticate and rate limit a JSON analysis request, then prepare its base64 logs."""
+    user = await authenticator.authenticate(client, request.api_key)
+    admission_controller.admit(user)
+
+    logs, code_context = await run_blocking(decode_request_logs, request.logs, request.code_context)
+    return await prepare_decoded_analysis(user, request.api_key, logs, code_context, response_cache)
+
+async def prepare_decoded_analysis(
+    user: supabase_logic.ApiKeyRecord,
+    api_key: str,
+    logs: str,
+    code_context: str,
+    response_cache: cache_logic.ResponseCache
+) -> PreparedAnalysis:
+    """Parse the logs, fingerprint them and check the exact-match cache."""
+    # Reducing a large log takes seconds of CPU, so keep it off the event loop
+    logs_packet = await run_blocking(debug_module.parse_logs, logs)
     
-    return api_key
+    prepared = PreparedAnalysis(
+        user=user,
+        api_key=api_key,
+        logs=logs,
+        code_context=code_context,
+        logs_packet=logs_packet,
+        error_id=str(uuid.uuid4()),
+        fingerprint=cache_logic.log_fingerprint(
+            logs_packet.logs, code_context, scope=api_key),
+    )
+    exact_hit = await run_blocking(response_cache.get, prepared.fingerprint)
+    if exact_hit:
+        prepared.exact_hit = True
+        prepared.cached = exact_hit
+    return prepared
 
-# ----- API Endpoints -----
+async def lookup_similar_analysis(prepared: PreparedAnalysis) -> None:
+    """Embed the logs, assign their cluster and check the semantic cache.
 
-@app.get("/health")
-async def health_check() -> Dict[str, str]:
-    """Health check endpoint."""
-    return {"status": "healthy", "service": "github-actions-chatbot"}
+    The vector is kept on the prepared analysis so it can be stored afterwards.
+    If embedding fails (an open circuit, a spent deadline or a provider
+    outage) the analysis goes to GPT without a vector, cluster or cache check.
+    """
+    combined_logs = prepared.logs_packet.logs
+    if prepared.code_context:
+        combined_logs += f"\n\nCode context from repository:\n{prepared.code_context}"
 
+    try:
+        processed_logs = await run_blocking(vector_logic.token_checker, combined_logs, "cl100k_base")
+        prepared.error_vector = await vector_logic.vector_embeddings_async(processed_logs)
+    except Exception as e:
+        logger.error(f"Embedding failed, analyzing without the semantic cache: {str(e)}")
+        return
+    prepared.cluster = await run_blocking(vector_logic.assign_cluster, prepared.error_vector)
 
-@app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_logs(request: AnalyzeRequest) -> AnalysisResponse:
-    """Analyze logs and return insights."""
-    client = supabase_logic.initialize_supabase()
-    
-    if not supabase_logic.check_api_key(client, request.api_key):
-        raise HTTPException(status_code=401, detail="Invalid API Key")
+    cached = await run_blocking(vector_logic.find_cached_analysis, prepared.error_vector, prepared.api_key)
+    if cached:
+        prepared.cached = cache_logic.CachedResponse(analysis=cached.analysis, new_code=cached.new_code)
 
-    logs = base64.b64decode(request.logs).decode("utf-8")
-    logs_packet = debug_module.parse_logs(logs)
-    
-    combined_logs = logs_packet.logs
-    if request.code_context:
-        combined_logs += f"\n\nCode context from repository:\n{request.code_context}"
-        
-    error_id = str(uuid.uuid4())
-    processed_logs = vector_logic.token_checker(combined_logs, "cl100k_base")
-    error_vector = vector_logic.vector_embeddings(processed_logs)
+def analysis_succeeded(analysis: str, new_code: str) -> bool:
+    """Whether GPT produced both parts, rather than the canned error messages."""
+    return (
+        analysis != debug_module.FIX_ERROR_MESSAGE
+        and new_code != debug_module.NEW_CODE_ERROR_MESSAGE
+    )
+
+def analysis_response(
+    prepared: PreparedAnalysis,
+    analysis: str,
+    new_code: str,
+    cache_hit: bool
+) -> AnalysisResponse:
+    """Build the response for an analysis, flagging one that GPT failed to produce."""
+    if analysis_succeeded(analysis, new_code):
+        return AnalysisResponse(
+            analysis=analysis, error_id=prepared.error_id, new_code=new_code, cache_hit=cache_hit)
+    return AnalysisResponse(
+        status="error",
+        message="Analysis is temporarily unavailable, please retry later",
+        analysis=analysis,
+        error_id=prepared.error_id,
+        new_code=new_code,
+        cache_hit=cache_hit
+    )
+
+async def record_analysis(
+    prepared: PreparedAnalysis,
+    analysis: str,
+    new_code: str,
+    response_cache: cache_logic.ResponseCache,
+    write_queue: WriteBehindQueue
+) -> None:
+    """Cache a successful analysis and queue the recommendation, usage and vector writes.
 
-    analysis, new_code = await analyze_and_get_results_with_combined_logs(
-        logs_packet, combined_logs)
+    A failed analysis is not stored as a recommendation or cached; its
+    usage and error vector are still recorded. The local cache is filled
+    at once, and the shared backend's upsert is queued with the other writes.
+    """
+    logs_packet = prepared.logs_packet
+    succeeded = analysis_succeeded(analysis, new_code)
+    if succeeded and not (prepared.exact_hit or prepared.coalesced):
+        cached = cache_logic.CachedResponse(analysis=analysis, new_code=new_code)
+        response_cache.set_local(prepared.fingerprint, cached)
+        if response_cache.backend is not None:
+            await write_queue.submit("response_cache", (prepared.fingerprint, cached))
 
     old_code = ""
     file_name = logs_packet.file_name if logs_packet.file_name else "unknown"
     
-    if request.code_context:
-        extraction = extract_code_from_context(request.code_context)
+    if prepared.code_context:
+        extraction = extract_code_from_decoded_context(prepared.code_context)
         if extraction.code:
             old_code = extraction.code
             file_name = extraction.file_name
     
     if not old_code:
-        extraction = extract_code_from_logs(logs)
+        extraction = extract_code_from_logs(prepared.logs)
         if extraction.code:
             old_code = extraction.code
             if extraction.file_name != "unknown":
                 file_name = extraction.file_name
     
-    user_response = client.table("users").select("user_id").eq("api_key", request.api_key).execute()
-    
-    if user_response.data and len(user_response.data) > 0:
-        user_id = user_response.data[0]["user_id"]
-        repo = extract_repository_info(logs)
-        
-        supabase_logic.update_recommendations(
-            client, 
-            user_id, 
+    repo = extract_repository_info(prepared.logs)
+    if succeeded:
+        await write_queue.submit("recommendations", supabase_logic.build_recommendation_row(
+            prepared.user.user_id, 
             repo, 
             file_name, 
             old_code, 
             new_code, 
-            analysis
-        )
-        
-        supabase_logic.update_user_logs(client, request.api_key, logs_packet.file_name, repo)
+            analysis,
+            routing=prepared.routing
+        ))
+    
+    await write_queue.submit("usage", {
+        "api_key": prepared.api_key,
+        "issue": logs_packet.file_name,
+        "repo": repo,
+        # Lets record_usage ignore a retry of a write that already committed
+        "request_id": prepared.error_id
+    })
     
-    metadata = vector_logic.VectorMetadata(
-        genre="errors",
-        api_key=request.api_key,
-        issue=str(logs_packet.file_name or "unknown"),
-        timestamp=supabase_logic.datetime.now().isoformat(),
+    if prepared.error_vector is not None:
+        metadata = vector_logic.VectorMetadata(
+            genre="errors",
+            api_key=prepared.api_key,
+            issue=str(logs_packet.file_name or "unknown"),
+            timestamp=supabase_logic.datetime.now().isoformat(),
+            repository=repo,
+            analysis=analysis if succeeded else None,
+            new_code=new_code if succeeded else None,
+            cluster=prepared.cluster,
+        )
+        await write_queue.submit("vectors", (prepared.error_id, prepared.error_vector, metadata))
+
+async def run_analysis(
+    prepared: PreparedAnalysis,
+    response_cache: cache_logic.ResponseCache,
+    write_queue: WriteBehindQueue,
+    single_flight: SingleFlight,
+    admission_controller: admission.AdmissionController,
+    slot_timeout: Optional[float] = admission.GPT_SLOT_TIMEOUT
+) -> AnalysisResponse:
+    """Serve a prepared analysis from cache or GPT, then record it.
+
+    On a cache miss, identical requests in flight at the same time (keyed
+    on the fingerprint) share one embedding and one set of GPT calls. Each
+    caller keeps its own error_id and bookkeeping. Only the first caller
+    stores the vector and fills the response cache. GPT calls hold a global
+    admission slot; slot_timeout=None waits for one instead of shedding.
+    The embedding, the wait for a slot and the GPT calls share one
+    ANALYSIS_DEADLINE budget, so retries in one stage leave less time for
+    the next rather than adding to the tail.
+    """
+    if prepared.cached is not None:
+        analysis, new_code = prepared.cached.analysis, prepared.cached.new_code
+        cache_hit = True
+    else:
+        async def analyze() -> Tuple[str, str, bool, Optional[Dict[str, Any]]]:
+            with resilience.deadline_scope(ANALYSIS_DEADLINE):
+                await lookup_similar_analysis(prepared)
+                if prepared.cached is not None:
+                    return prepared.cached.analysis, prepared.cached.new_code, True, None
+                routing_log: Dict[str, Any] = {}
+                async with admission_controller.gpt_slot(prepared.user, slot_timeout):
+                    analysis, new_code = await analyze_and_get_results_with_combined_logs(
+                        prepared.logs_packet, prepared.code_context, cluster=prepared.cluster,
+                        routing_log=routing_log)
+            return analysis, new_code, False, routing_log or None
+
+        (analysis, new_code, cache_hit, prepared.routing), prepared.coalesced = await single_flight.do(
+            prepared.fingerprint, analyze)
+        cache_hit = cache_hit or prepared.coalesced
+
+    await record_analysis(prepared, analysis, new_code, response_cache, write_queue)
+    return analysis_response(prepared, analysis, new_code, cache_hit)
+
+async def run_analysis_job(app: FastAPI, payload: AnalysisJobPayload) -> Dict[str, Any]:
+    """Run the analysis pipeline for a queued job on one of the job workers."""
+    state = app.state
+    prepared = await prepare_decoded_analysis(
+        payload.user, payload.api_key, payload.logs, payload.code_context, state.response_cache)
+    # Jobs already wait in the queue, so they wait for a GPT slot instead of being shed
+    response = await run_analysis(
+        prepared, state.response_cache, state.write_queue, state.single_flight,
+        state.admission, slot_timeout=None)
+    return response.dict()
+
+def job_response(job: job_queue.Job) -> JobResponse:
+    """Build the API view of a job."""
+    return JobResponse(
+        job_id=job.job_id,
+        job_status=job.status,
+        result=AnalysisResponse.parse_obj(job.result) if job.result else None,
+        error=job.error
     )
-    vector_logic.add_vector(vector_id=error_id, vector_values=error_vector, metadata=metadata)
 
-    return AnalysisResponse(
-        analysis=analysis, 
-        error_id=error_id, 
-        new_code=new_code
+def call_once(func: Callable[[], None]) -> Callable[[], None]:
+    """Wrap a cleanup callback so that only its first call has any effect."""
+    called = False
+
+    def wrapper() -> None:
+        nonlocal called
+        if not called:
+            called = True
+            func()
+
+    return wrapper
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that runs on_close once the response is over, however it ends.
+
+    The body generator's own finally never runs if the client disconnects
+    before the first chunk is pulled, and on a disconnect the background
+    task is skipped too, so neither can free something taken before the
+    response started.
+    """
+
+    def __init__(self, *args: Any, on_close: Optional[Callable[[], None]] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_analysis_events(
+    prepared: PreparedAnalysis,
+    outcome: Dict[str, str],
+    timeout: float = GPT_BRANCH_TIMEOUT,
+    on_close: Optional[Callable[[], None]] = None
+) -> AsyncIterator[str]:
+    """Stream the fix analysis token by token, then a final event with the full result.
+
+    The new code completion runs concurrently while the analysis streams. The
+    finished analysis and new code are stored in outcome for the bookkeeping
+    that runs after the stream closes. A stream that fails part way through
+    reports an error event and falls back to the canned error message.
+    on_close runs as soon as the stream ends, so it must be safe to call
+    again from the response once the request is over.
+    """
+    try:
+        async for event in _analysis_events(prepared, outcome, timeout):
+            yield event
+    finally:
+        if on_close is not None:
+            on_close()
+
+async def _analysis_events(
+    prepared: PreparedAnalysis,
+    outcome: Dict[str, str],
+    timeout: float
+) -> AsyncIterator[str]:
+    if prepared.cached is not None:
+        analysis, new_code = prepared.cached.analysis, prepared.cached.new_code
+        yield sse_event("token", {"text": analysis})
+    else:
+        routing = debug_module.route_analysis(prepared.logs_packet, prepared.code_context, prepared.cluster)
+        # The fix is streamed from the routed model and never escalated
+        prepared.routing = {
+            debug_module.AnalysisType.FIX.value: {**routing.metadata(), "model": routing.model}}
+        # The task takes a copy of the deadline when it is created; the fix
+        # stream is bounded per token instead
+        with resilience.deadline_scope(ANALYSIS_DEADLINE):
+            new_code_task = asyncio.create_task(run_gpt_branch(
+                debug_module.call_gpt_new_code_with_combined_logs_async(
+                    prepared.logs_packet, prepared.code_context, routing=routing,
+                    routing_log=prepared.routing),
+                timeout, debug_module.NEW_CODE_ERROR_MESSAGE, "new_code"))
+        try:
+            chunks: List[str] = []
+            # Tokens already sent cannot be taken back, so the stream uses the
+            # routed model without escalation
+            tokens = debug_module.stream_gpt_async(
+                prepared.logs_packet, debug_module.AnalysisType.FIX,
+                config=debug_module.GptCompletionConfig(model=routing.model),
+                code_context=prepared.code_context).__aiter__()
+            try:
+                while True:
+                    try:
+                        # The timeout bounds the wait for each token, not the whole stream
+                        text = await asyncio.wait_for(tokens.__anext__(), timeout=timeout)
+                    except StopAsyncIteration:
+                        break
+                    chunks.append(text)
+                    yield sse_event("token", {"text": text})
+                analysis = "".join(chunks) or debug_module.FIX_ERROR_MESSAGE
+            except Exception as e:
+                logger.error(f"GPT fix stream failed: {str(e) or type(e).__name__}")
+                analysis = debug_module.FIX_ERROR_MESSAGE
+                yield sse_event("error", {"message": analysis})
+            new_code = await new_code_task
+        finally:
+            new_code_task.cancel()
+
+    outcome.update(analysis=analysis, new_code=new_code)
+    yield sse_event("done", analysis_response(
+        prepared, analysis, new_code, prepared.cached is not None).dict())
+
+async def create_or_update_user_api_key(client: Client, user_id: str) -> str:
+    """Create or update an API key for a user."""
+    api_key = generate_api_key()
+    await run_blocking(supabase_logic.upsert_user_api_key, client, user_id, api_key)
+    return api_key
+
+# ----- API Endpoints -----
+
+@app.get("/health")
+async def health_check(request: Request) -> Dict[str, Any]:
+    """Health check endpoint."""
+    write_queue = getattr(request.app.state, "write_queue", None)
+    jobs = getattr(request.app.state, "job_queue", None)
+    return {
+        "status": "healthy",
+        "service": "github-actions-chatbot",
+        "write_queue_depth": write_queue.depth if write_queue else 0,
+        "job_queue_depth": jobs.depth if jobs else 0,
+        "circuits": {
+            caller.name: caller.breaker.state
+            for caller in (resilience.completion_calls, resilience.embedding_calls)
+        },
+    }
+
+
+@app.post("/analyze", response_model=AnalysisResponse)
+async def analyze_logs(
+    request: AnalyzeRequest,
+    client: Client = Depends(get_supabase),
+    response_cache: cache_logic.ResponseCache = Depends(get_response_cache),
+    authenticator: ApiKeyAuthenticator = Depends(get_api_key_authenticator),
+    write_queue: WriteBehindQueue = Depends(get_write_queue),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    admission_controller: admission.AdmissionController = Depends(get_admission)
+) -> AnalysisResponse:
+    """Analyze logs and return insights."""
+    prepared = await prepare_analysis(request, client, response_cache, authenticator, admission_controller)
+    return await run_analysis(prepared, response_cache, write_queue, single_flight, admission_controller)
+
+@app.post("/analyze/upload", response_model=AnalysisResponse)
+async def analyze_uploaded_logs(
+    api_key: str = Form(...),
+    logs: UploadFile = File(...),
+    code_context: Optional[UploadFile] = File(None),
+    client: Client = Depends(get_supabase),
+    response_cache: cache_logic.ResponseCache = Depends(get_response_cache),
+    authenticator: ApiKeyAuthenticator = Depends(get_api_key_authenticator),
+    write_queue: WriteBehindQueue = Depends(get_write_queue),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    admission_controller: admission.AdmissionController = Depends(get_admission)
+) -> AnalysisResponse:
+    """Analyze logs sent as a multipart upload instead of base64 in JSON.
+
+    The logs and code context files may be gzip- or zstd-compressed, or
+    plain text. They are decompressed incrementally.
+    """
+    user = await authenticator.authenticate(client, api_key)
+    admission_controller.admit(user)
+
+    logs_text = await run_blocking(upload_logic.read_upload_text, logs.file)
+    context_text = ""
+    if code_context is not None:
+        context_text = await run_blocking(upload_logic.read_upload_text, code_context.file)
+
+    prepared = await prepare_decoded_analysis(user, api_key, logs_text, context_text, response_cache)
+    return await run_analysis(prepared, response_cache, write_queue, single_flight, admission_controller)
+
+@app.post("/analyze/jobs", response_model=JobResponse, status_code=202)
+async def submit_analysis_job(
+    request: AnalyzeJobRequest,
+    client: Client = Depends(get_supabase),
+    authenticator: ApiKeyAuthenticator = Depends(get_api_key_authenticator),
+    admission_controller: admission.AdmissionController = Depends(get_admission),
+    jobs: job_queue.JobQueue = Depends(get_job_queue)
+) -> JobResponse:
+    """Queue logs for analysis and return a job ID without waiting for GPT.
+
+    Poll GET /analyze/jobs/{job_id} for the result, or pass webhook_url to
+    have it posted there when the job finishes.
+    """
+    user = await authenticator.authenticate(client, request.api_key)
+    admission_controller.admit(user)
+    if request.webhook_url:
+        await job_queue.check_webhook_url(request.webhook_url)
+
+    logs, code_context = await run_blocking(decode_request_logs, request.logs, request.code_context)
+    payload = AnalysisJobPayload(user=user, api_key=request.api_key, logs=logs, code_context=code_context)
+    job = job_queue.Job(
+        job_id=str(uuid.uuid4()),
+        created_at=datetime.now().isoformat(),
+        webhook_url=request.webhook_url
+    )
+    # Characters stand in for bytes: logs are mostly ASCII
+    await jobs.submit(job, payload, size=len(logs) + len(code_context))
+    return job_response(job)
+
+@app.get("/analyze/jobs/{job_id}", response_model=JobResponse)
+async def get_analysis_job(
+    job_id: str,
+    wait: float = 0,
+    jobs: job_queue.JobQueue = Depends(get_job_queue)
+) -> JobResponse:
+    """Return a job's state, long-polling up to `wait` seconds for it to finish."""
+    job = await jobs.wait(job_id, min(max(wait, 0.0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+@app.post("/analyze/stream")
+async def analyze_logs_stream(
+    request: AnalyzeRequest,
+    client: Client = Depends(get_supabase),
+    response_cache: cache_logic.ResponseCache = Depends(get_response_cache),
+    authenticator: ApiKeyAuthenticator = Depends(get_api_key_authenticator),
+    write_queue: WriteBehindQueue = Depends(get_write_queue),
+    admission_controller: admission.AdmissionController = Depends(get_admission)
+) -> StreamingResponse:
+    """Analyze logs, streaming the analysis as server-sent events.
+
+    "token" events carry analysis text as it is generated and the final
+    "done" event carries the same fields as /analyze. Bookkeeping runs once
+    the stream has closed. Streams are not coalesced, since each one
+    forwards its own tokens.
+    """
+    prepared = await prepare_analysis(request, client, response_cache, authenticator, admission_controller)
+    if prepared.cached is None:
+        with resilience.deadline_scope(ANALYSIS_DEADLINE):
+            await lookup_similar_analysis(prepared)
+
+    # Take the GPT slot before the response starts, so a shed request still gets a 429.
+    # It is released when the stream ends, or by the response if the stream never starts.
+    on_close = None
+    if prepared.cached is None:
+        await admission_controller.acquire_gpt_slot(prepared.user)
+        on_close = call_once(admission_controller.release_gpt_slot)
+    outcome: Dict[str, str] = {}
+
+    async def finish() -> None:
+        if outcome:
+            await record_analysis(
+                prepared, outcome["analysis"], outcome["new_code"], response_cache, write_queue)
+
+    return ClosingStreamingResponse(
+        stream_analysis_events(prepared, outcome, on_close=on_close),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(finish),
+        on_close=on_close
     )
 
 @app.post("/api/generate-key", response_model=ApiKeyResponse)
-async def generate_user_api_key(request: Request) -> ApiKeyResponse:
+async def generate_user_api_key(
+    request: Request,
+    client: Client = Depends(get_supabase),
+    authenticator: ApiKeyAuthenticator = Depends(get_api_key_authenticator)
+) -> ApiKeyResponse:
     """Generate an API key for a user."""
     try:
         user_id = await get_auth_user_id(request)
         
-        api_key = await create_or_update_user_api_key(user_id)
+        api_key = await create_or_update_user_api_key(client, user_id)
+        authenticator.invalidate_user(user_id, api_key)
         
         return ApiKeyResponse(api_key=api_key)
     except HTTPException as e:
@@ -0,0 +1,12 @@
+-- Store which model produced each recommendation.
+--
+-- routing maps each analysis type ("combined", or "fix" and "new_code") to
+-- the routing decision: tier, routed_model, reason, whether the answer was
+-- escalated to the large model and why, and the model that answered. It is
+-- null for answers served from a cache.
+--
+-- Apply before deploying the server version that writes it, with the
+-- Supabase SQL editor or `psql -f recommendations_routing.sql`. The script
+-- is safe to run again.
+
+alter table recommendations add column if not exists routing jsonb;
@@ -0,0 +1,147 @@
+-- Atomically record one /analyze call for an API key.
+--
+-- Increments users.api_calls, adds the repository to users.repo_used if it
+-- is not already there, and inserts the matching logs row, all in a single
+-- statement-level transaction so concurrent builds cannot lose updates.
+--
+-- Calls carry a request id that is stored on the logs row, so a retry of a
+-- call that committed but whose response was lost is recorded only once.
+--
+-- Apply with the Supabase SQL editor or `psql -f record_usage.sql`. The
+-- script is safe to run again.
+
+-- Older clients stored repo_used as a JSON array, a JSON scalar or a
+-- comma-separated string, and the column type varies between databases.
+-- record_usage reads whatever is there through to_jsonb, normalizes it to
+-- text[] here and writes it back in the column's own type, so this script
+-- never changes the users table.
+drop function if exists parse_repo_list(text);
+
+create or replace function parse_repo_list(value jsonb)
+returns text[]
+language plpgsql
+immutable
+as $$
+declare
+    raw text;
+    parsed jsonb;
+begin
+    if value is null or jsonb_typeof(value) = 'null' then
+        return '{}'::text[];
+    elsif jsonb_typeof(value) = 'array' then
+        return array(select jsonb_array_elements_text(value));
+    elsif jsonb_typeof(value) <> 'string' then
+        return array[value #>> '{}'];
+    end if;
+
+    -- A text column holds either JSON or a comma-separated list
+    raw := value #>> '{}';
+    if btrim(raw) = '' then
+        return '{}'::text[];
+    end if;
+
+    begin
+        parsed := raw::jsonb;
+    exception when invalid_text_representation then
+        return array(
+            select btrim(part)
+            from unnest(string_to_array(raw, ',')) as part
+            where btrim(part) <> ''
+        );
+    end;
+
+    if jsonb_typeof(parsed) = 'string' then
+        return array[parsed #>> '{}'];
+    end if;
+    return parse_repo_list(parsed);
+end;
+$$;
+
+alter table logs add column if not exists request_id text;
+create unique index if not exists logs_request_id_key on logs (request_id);
+
+-- Replaced by the version that takes a request id
+drop function if exists record_usage(text, text, text);
+
+create or replace function record_usage(
+    p_api_key text,
+    p_issue text,
+    p_repository text,
+    p_request_id text default null
+) returns boolean
+language plpgsql
+as $$
+declare
+    inserted_rows integer;
+    repos text[];
+    repos_type text;
+begin
+    -- Locking the user row serializes concurrent calls for the same key
+    select parse_repo_list(to_jsonb(repo_used)), pg_typeof(repo_used)::text
+    into repos, repos_type
+    from users where api_key = p_api_key for update;
+    if not found then
+        return false;
+    end if;
+
+    insert into logs (api_key, issue, repository, timestamp, request_id)
+    values (p_api_key, p_issue, p_repository, now(), p_request_id)
+    on conflict (request_id) do nothing;
+
+    get diagnostics inserted_rows = row_count;
+    if inserted_rows = 0 then
+        -- An earlier attempt with this request id already committed
+        return true;
+    end if;
+
+    if not p_repository = any(repos) then
+        repos := array_append(repos, p_repository);
+    end if;
+
+    update users
+    set api_calls = coalesce(api_calls, 0) + 1,
+        last_log_time = now(),
+        last_issue = p_issue
+    where api_key = p_api_key;
+
+    -- Each statement is only planned when its branch runs, so the others
+    -- never see a repo_used of the wrong type
+    if repos_type = 'text[]' then
+        update users set repo_used = repos where api_key = p_api_key;
+    elsif repos_type = 'jsonb' then
+        update users set repo_used = to_jsonb(repos) where api_key = p_api_key;
+    elsif repos_type = 'json' then
+        update users set repo_used = to_json(repos) where api_key = p_api_key;
+    else
+        -- Text columns keep the JSON array form the client writes
+        update users set repo_used = to_jsonb(repos)::text where api_key = p_api_key;
+    end if;
+
+    return true;
+end;
+$$;
+
+-- Record a batch of calls from the write-behind queue in one round trip.
+-- Entries are objects with api_key, issue, repo and request_id. They are
+-- applied in api_key order so concurrent batches lock users rows in the
+-- same order and cannot deadlock. Returns the number of calls recorded.
+create or replace function record_usage_batch(p_entries jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    entry jsonb;
+    recorded integer := 0;
+begin
+    for entry in
+        select value from jsonb_array_elements(p_entries) order by value->>'api_key'
+    loop
+        if record_usage(
+            entry->>'api_key', entry->>'issue', entry->>'repo', entry->>'request_id'
+        ) then
+            recorded := recorded + 1;
+        end if;
+    end loop;
+    return recorded;
+end;
+$$;
@@ -0,0 +1,30 @@
+-- Shared exact-match cache of analyses, used by cache_logic.SupabaseCacheBackend
+-- when RESPONSE_CACHE_BACKEND=supabase.
+--
+-- Keys are log fingerprints (a SHA-256 hex digest scoped to the API key) and
+-- values are the JSON-encoded CachedResponse. Reads ignore expired rows;
+-- purge_response_cache() deletes them and can be scheduled with pg_cron.
+--
+-- Apply with the Supabase SQL editor or `psql -f response_cache.sql`. The
+-- script is safe to run again.
+
+create table if not exists response_cache (
+    key text primary key,
+    value text not null,
+    expires_at timestamptz not null
+);
+
+create index if not exists response_cache_expires_at_idx on response_cache (expires_at);
+
+create or replace function purge_response_cache()
+returns integer
+language plpgsql
+as $$
+declare
+    purged integer;
+begin
+    delete from response_cache where expires_at < now();
+    get diagnostics purged = row_count;
+    return purged;
+end;
+$$;
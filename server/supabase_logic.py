@@ -1,4 +1,5 @@
 # Standard library imports
+import functools
 import json
 import logging
 import os
@@ -6,13 +7,15 @@ import secrets
 import string
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Dict, List, Optional, Set, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 # Third-party imports
+import httpx
 from fastapi import HTTPException
 from pydantic import BaseModel, Field, root_validator, validator
+from postgrest.exceptions import APIError
 from pydantic_settings import BaseSettings
-from supabase import Client, create_client
+from supabase import Client, ClientOptions, create_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -54,6 +57,19 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.now)
     
 
+class ApiKeyRecord(BaseModel):
+    """User record resolved from an API key"""
+    user_id: str
+    api_key: str
+    role: UserRole = UserRole.FREE
+
+    @validator('role', pre=True)
+    def default_role(cls, v):
+        return v or UserRole.FREE
+
+    class Config:
+        frozen = True
+
 class LogEntry(BaseModel):
     """Log entry for user API calls"""
     id: Optional[str] = None
@@ -82,6 +98,10 @@ class SupabaseConfig(BaseSettings):
     url: str
     key: str
     jwt_secret: Optional[str] = None
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    timeout: float = 30.0
     
     class Config:
         env_prefix = "SUPABASE_"
@@ -107,6 +127,57 @@ def initialize_supabase() -> Client:
         logger.error(f"ERROR initializing Supabase client: {str(e)}")
         raise RuntimeError("Failed to initialize Supabase client") from e
 
+@functools.lru_cache(maxsize=None)
+def get_supabase_client() -> Client:
+    """Return a shared Supabase client for scripts, connecting on first use."""
+    return initialize_supabase()
+
+def _http2_available() -> bool:
+    """Check whether httpx can negotiate HTTP/2 (needs the h2 package)."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def open_supabase_pool() -> Tuple[Client, Optional[httpx.Client]]:
+    """Create a Supabase client backed by a pooled keep-alive HTTP client.
+
+    Returns the client and the HTTP client to close on shutdown. Older
+    supabase-py releases cannot take an external HTTP client, in which case
+    the client manages its own connections and None is returned.
+    """
+    try:
+        config = SupabaseConfig()
+        http_client = httpx.Client(
+            http2=_http2_available(),
+            timeout=config.timeout,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+        try:
+            options = ClientOptions(httpx_client=http_client, postgrest_client_timeout=config.timeout)
+        except TypeError:
+            http_client.close()
+            http_client = None
+            options = ClientOptions(postgrest_client_timeout=config.timeout)
+
+        logger.info("Connecting to Supabase with pooled HTTP client...")
+        client = create_client(config.url, config.key, options=options)
+        return client, http_client
+    except Exception as e:
+        logger.error(f"ERROR initializing pooled Supabase client: {str(e)}")
+        raise RuntimeError("Failed to initialize Supabase client") from e
+
+def close_supabase_pool(http_client: Optional[httpx.Client]) -> None:
+    """Close the pooled HTTP client behind the shared Supabase client."""
+    if http_client is not None:
+        http_client.close()
+        logger.info("Supabase HTTP pool closed")
+
 def generate_api_key(length: int = 32) -> str:
     """Generate a secure random API key"""
     alphabet = string.ascii_letters + string.digits
@@ -167,6 +238,36 @@ def get_user_by_api_key(client: Client, api_key: str) -> Optional[User]:
         logger.error(f"ERROR getting user by API key: {str(e)}")
         return None
 
+def resolve_api_key(client: Client, api_key: str) -> Optional[ApiKeyRecord]:
+    """Resolve an API key to its user record, or None if the key is unknown"""
+    response = (client.table("users")
+        .select("user_id, api_key, role")
+        .eq("api_key", api_key)
+        .execute())
+
+    if not response.data:
+        return None
+
+    return ApiKeyRecord.parse_obj(response.data[0])
+
+def upsert_user_api_key(client: Client, user_id: str, api_key: str) -> None:
+    """Store a new API key for a user, creating the user row if needed"""
+    response = client.table("users").select("*").eq("user_id", user_id).execute()
+
+    if len(response.data) > 0:
+        client.table("users").update({
+            "api_key": api_key,
+            "last_updated": datetime.now().isoformat()
+        }).eq("user_id", user_id).execute()
+    else:
+        client.table("users").insert({
+            "user_id": user_id,
+            "api_key": api_key,
+            "api_calls": 0,
+            "created_at": datetime.now().isoformat(),
+            "repo_used": []
+        }).execute()
+
 def create_user(client: Client, user: User) -> bool:
     """Create a new user"""
     try:
@@ -260,14 +361,52 @@ def get_user_repositories(client: Client, api_key: str) -> List[str]:
         logger.error(f"ERROR getting user repositories: {str(e)}")
         return []
 
+# PostgREST and Postgres codes for a function that does not exist
+MISSING_FUNCTION_CODES = frozenset({"PGRST202", "42883"})
+
 def update_user_logs(
     client: Client, 
     api_key: str, 
     issue: Any, 
-    repo: str
+    repo: str,
+    request_id: Optional[str] = None
 ) -> bool:
-    """Update user logs in the database"""
+    """Update user logs in the database.
+
+    Passing the request's id makes the call idempotent, so it can be
+    retried safely. Only a missing record_usage function falls back to the
+    read-modify-write; any other error is raised, since the RPC may have
+    committed.
+    """
     logger.info(f"Updating logs for user with repo: {repo}")
+    try:
+        # Increment, repo merge and log insert happen atomically in sql/record_usage.sql
+        response = client.rpc("record_usage", {
+            "p_api_key": api_key,
+            "p_issue": str(issue),
+            "p_repository": repo,
+            "p_request_id": request_id
+        }).execute()
+    except APIError as e:
+        if e.code not in MISSING_FUNCTION_CODES:
+            raise
+        logger.warning("record_usage is not installed, falling back to read-modify-write")
+        return _update_user_logs_legacy(client, api_key, issue, repo)
+        
+    if not response.data:
+        logger.warning(f"No user found with API key: {api_key[:5]}...")
+        return False
+    
+    logger.info(f"Database updated successfully with repo: {repo}")
+    return True
+
+def _update_user_logs_legacy(
+    client: Client, 
+    api_key: str, 
+    issue: Any, 
+    repo: str
+) -> bool:
+    """Update user logs with a read-modify-write, for databases without record_usage"""
     try:
         # First, get the current user data
         response = client.table("users").select("repo_used,api_calls").eq("api_key", api_key).execute()
@@ -332,6 +471,34 @@ def process_repository_list(current_repos: Any, new_repo: str) -> List[str]:
 
 # ----- Recommendation Functions -----
 
+def build_recommendation_row(
+    user_id: str, 
+    repository: str, 
+    file_name: str, 
+    old_code: str, 
+    new_code: str, 
+    response_data: str,
+    routing: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Build a recommendations row with an ISO-formatted timestamp
+
+    The routing key is left out when there is no routing, so rows still
+    insert into tables without the routing column. A batch insert sends the
+    union of its rows' columns and fills the gaps with null.
+    """
+    row = {
+        "repository": repository,
+        "file_name": file_name,
+        "old_code": old_code,
+        "new_code": new_code,
+        "response_data": response_data,
+        "user_id": user_id,
+        "created_at": datetime.now().isoformat()
+    }
+    if routing is not None:
+        row["routing"] = routing
+    return row
+
 def update_recommendations(
     client: Client, 
     user_id: str, 
@@ -345,16 +512,8 @@ def update_recommendations(
     try:
         logger.info(f"Saving recommendation for repo: {repository}")
         
-        # Create recommendation dict with ISO-formatted datetime
-        recommendation_data = {
-            "repository": repository,
-            "file_name": file_name,
-            "old_code": old_code,
-            "new_code": new_code,
-            "response_data": response_data,
-            "user_id": user_id,
-            "created_at": datetime.now().isoformat()  # Convert to ISO string
-        }
+        recommendation_data = build_recommendation_row(
+            user_id, repository, file_name, old_code, new_code, response_data)
         
         client.table("recommendations").insert(recommendation_data).execute()
         
@@ -364,6 +523,57 @@ def update_recommendations(
         logger.error(f"ERROR updating recommendations in Supabase: {str(e)}")
         return False
 
+# PostgREST and Postgres codes for a column that does not exist
+MISSING_COLUMN_CODES = frozenset({"PGRST204", "42703"})
+
+def insert_recommendations(client: Client, rows: List[Dict[str, Any]]) -> None:
+    """Insert a batch of recommendation rows in one request, raising on failure
+
+    If the routing column has not been added yet, the batch is inserted
+    again without it.
+    """
+    try:
+        client.table("recommendations").insert(rows).execute()
+    except APIError as e:
+        if e.code not in MISSING_COLUMN_CODES or not any("routing" in row for row in rows):
+            raise
+        logger.warning("recommendations has no routing column, saving without routing")
+        rows = [{key: value for key, value in row.items() if key != "routing"} for row in rows]
+        client.table("recommendations").insert(rows).execute()
+    logger.info(f"Saved {len(rows)} recommendations")
+
+def record_usage_batch(client: Client, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Record usage for a batch of calls in one RPC, returning the entries that should be retried
+
+    Raises if the batch RPC fails; retrying is safe, since calls carrying a
+    request id are only recorded once.
+    """
+    try:
+        response = client.rpc("record_usage_batch", {"p_entries": [
+            {
+                "api_key": entry["api_key"],
+                "issue": str(entry["issue"]),
+                "repo": entry["repo"],
+                "request_id": entry.get("request_id")
+            }
+            for entry in entries
+        ]}).execute()
+        logger.info(f"Recorded usage for {response.data} of {len(entries)} calls")
+        return []
+    except APIError as e:
+        if e.code not in MISSING_FUNCTION_CODES:
+            raise
+        logger.warning("record_usage_batch is not installed, recording usage one call at a time")
+
+    failed = []
+    for entry in entries:
+        try:
+            update_user_logs(client, entry["api_key"], entry["issue"], entry["repo"], entry.get("request_id"))
+        except Exception as e:
+            logger.error(f"ERROR recording usage: {str(e)}")
+            failed.append(entry)
+    return failed
+
 def get_recommendations_for_user(
     client: Client, 
     user_id: str, 
@@ -392,6 +602,3 @@ def get_recommendations_for_user(
     except Exception as e:
         logger.error(f"ERROR getting recommendations: {str(e)}")
         return []
-
-
-supabase_client = initialize_supabase()
\ No newline at end of file
@@ -0,0 +1,15 @@
+# Standard library imports
+import os
+import sys
+
+# The server modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Clients are built from these at import time; tests stub every call they make
+for name, value in {
+    "OPENAI_KEY": "test",
+    "PINECONE_KEY": "test",
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
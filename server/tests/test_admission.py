@@ -0,0 +1,21 @@
+# Third-party imports
+import pytest
+
+# Internal imports
+import admission
+from supabase_logic import UserRole
+
+
+@pytest.mark.parametrize("per_minute, burst", [("0", "20"), ("-5", "20"), ("30", "0")])
+def test_rate_limits_that_could_never_refill_are_rejected(monkeypatch, per_minute, burst):
+    monkeypatch.setenv("RATE_LIMIT_FREE_PER_MINUTE", per_minute)
+    monkeypatch.setenv("RATE_LIMIT_FREE_BURST", burst)
+    with pytest.raises(ValueError):
+        admission._role_limit(UserRole.FREE, "30", "20")
+
+
+def test_unlimited_role_has_no_limit(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_FREE_PER_MINUTE", "unlimited")
+    assert admission._role_limit(UserRole.FREE, "30", "20") is None
+    monkeypatch.setenv("RATE_LIMIT_FREE_PER_MINUTE", "12")
+    assert admission._role_limit(UserRole.FREE, "30", "20").per_second == 0.2
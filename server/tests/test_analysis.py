@@ -0,0 +1,180 @@
+# Standard library imports
+import asyncio
+import base64
+import time
+from typing import Any, Dict, List
+
+# Third-party imports
+import httpx
+
+# Internal imports
+import auth_helpers
+import cache_logic
+import debug_module
+import resilience
+import server
+import vector_logic
+from admission import AdmissionController
+from auth_helpers import ApiKeyAuthenticator
+from concurrency import SingleFlight
+from supabase_logic import ApiKeyRecord
+from write_queue import WriteBehindQueue
+
+LOGS = "##[error]Process completed with exit code 1.\nError: Cannot find module 'left-pad'\n"
+
+
+class SharedCacheBackend:
+    """Shared response cache backend that records its writes."""
+
+    def __init__(self) -> None:
+        self.writes: List[Any] = []
+
+    def get(self, key: str) -> None:
+        return None
+
+    def set_many(self, items: List[Any], ttl: float) -> None:
+        self.writes.extend(items)
+
+
+def test_concurrent_identical_requests_share_one_backend_call(monkeypatch):
+    calls: Dict[str, int] = {"embed": 0, "gpt": 0}
+
+    async def embed(text: str) -> List[float]:
+        calls["embed"] += 1
+        await asyncio.sleep(0.05)
+        return [1.0, 0.0]
+
+    async def analyze(logs_packet: Any, code_context: str, **kwargs: Any) -> Any:
+        calls["gpt"] += 1
+        kwargs["routing_log"]["combined"] = {"tier": "small", "model": "gpt-4o-mini"}
+        await asyncio.sleep(0.05)
+        return "Install left-pad", "npm install left-pad"
+
+    monkeypatch.setattr(vector_logic, "vector_embeddings_async", embed)
+    monkeypatch.setattr(vector_logic, "assign_cluster", lambda vector: None)
+    monkeypatch.setattr(vector_logic, "find_cached_analysis", lambda vector, api_key: None)
+    monkeypatch.setattr(server, "analyze_and_get_results_with_combined_logs", analyze)
+
+    async def scenario() -> None:
+        shared = SharedCacheBackend()
+        response_cache = cache_logic.ResponseCache(backend=shared)
+        written: Dict[str, List[Any]] = {"recommendations": [], "usage": [], "vectors": [], "response_cache": []}
+        write_queue = WriteBehindQueue({kind: rows.extend for kind, rows in written.items()})
+        single_flight = SingleFlight()
+        controller = AdmissionController(limits={})
+        user = ApiKeyRecord(user_id="user", api_key="key")
+
+        async def request() -> server.AnalysisResponse:
+            prepared = await server.prepare_decoded_analysis(user, "key", LOGS, "", response_cache)
+            return await server.run_analysis(prepared, response_cache, write_queue, single_flight, controller)
+
+        responses = await asyncio.gather(*(request() for _ in range(20)))
+
+        assert calls == {"embed": 1, "gpt": 1}
+        assert len({response.error_id for response in responses}) == 20
+        assert all(response.analysis == "Install left-pad" for response in responses)
+        assert sum(not response.cache_hit for response in responses) == 1
+        assert len(single_flight) == 0
+        # Usage is recorded per request, under that request's own id
+        usage = [write_queue._queues["usage"].get_nowait() for _ in range(20)]
+        assert {entry["request_id"] for entry in usage} == {response.error_id for response in responses}
+        # Every caller stores the routing of the shared GPT call with its recommendation
+        recommendations = [write_queue._queues["recommendations"].get_nowait() for _ in range(20)]
+        assert all(row["routing"]["combined"]["model"] == "gpt-4o-mini" for row in recommendations)
+        # The leader fills the local cache now and queues the shared upsert
+        assert len(response_cache.local) == 1
+        assert shared.writes == []
+        assert write_queue._queues["response_cache"].qsize() == 1
+
+    asyncio.run(scenario())
+
+
+def test_open_embeddings_circuit_falls_through_to_gpt(monkeypatch):
+    gpt_calls = []
+
+    async def analyze(logs_packet: Any, code_context: str, **kwargs: Any) -> Any:
+        gpt_calls.append(logs_packet)
+        return "Install left-pad", "npm install left-pad"
+
+    def find_cached(vector: List[float], api_key: str) -> None:
+        raise AssertionError("the semantic cache needs a vector")
+
+    # Everything up to the embeddings call runs for real, without tokenizer data or a disk cache
+    monkeypatch.setattr(vector_logic, "token_checker", lambda text, model_name: text)
+    monkeypatch.setattr(vector_logic, "plan_embedding_batches", lambda texts: [texts])
+    monkeypatch.setattr(vector_logic, "get_embedding_cache", lambda: None)
+    monkeypatch.setattr(resilience.embedding_calls.breaker, "opened_at", time.monotonic())
+    monkeypatch.setattr(vector_logic, "find_cached_analysis", find_cached)
+    monkeypatch.setattr(server, "analyze_and_get_results_with_combined_logs", analyze)
+
+    async def scenario() -> None:
+        response_cache = cache_logic.ResponseCache()
+        write_queue = WriteBehindQueue({kind: list for kind in ("recommendations", "usage", "vectors")})
+        user = ApiKeyRecord(user_id="user", api_key="key")
+        prepared = await server.prepare_decoded_analysis(user, "key", LOGS, "", response_cache)
+        response = await server.run_analysis(
+            prepared, response_cache, write_queue, SingleFlight(), AdmissionController(limits={}))
+
+        assert response.analysis == "Install left-pad"
+        assert not response.cache_hit
+        assert len(gpt_calls) == 1
+        assert prepared.error_vector is None and prepared.cluster is None
+        assert write_queue._queues["vectors"].empty()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_requests_take_about_as_long_as_one(monkeypatch):
+    """Slow stubbed backends must overlap, not queue behind each other on the event loop."""
+    def resolve(client: Any, api_key: str) -> ApiKeyRecord:
+        time.sleep(0.1)
+        return ApiKeyRecord(user_id="user", api_key=api_key)
+
+    def find_cached(vector: List[float], api_key: str) -> None:
+        time.sleep(0.1)
+        return None
+
+    async def embed(text: str) -> List[float]:
+        await asyncio.sleep(0.1)
+        return [1.0, 0.0]
+
+    async def combined(*args: Any, **kwargs: Any) -> debug_module.CombinedAnalysis:
+        await asyncio.sleep(0.3)
+        return debug_module.CombinedAnalysis(analysis="Install left-pad", new_code="npm install left-pad")
+
+    monkeypatch.setattr(auth_helpers, "resolve_api_key", resolve)
+    monkeypatch.setattr(vector_logic, "find_cached_analysis", find_cached)
+    monkeypatch.setattr(vector_logic, "vector_embeddings_async", embed)
+    monkeypatch.setattr(vector_logic, "assign_cluster", lambda vector: None)
+    monkeypatch.setattr(debug_module, "call_gpt_combined_with_combined_logs_async", combined)
+
+    async def scenario() -> None:
+        state = server.app.state
+        state.supabase = None
+        state.response_cache = cache_logic.ResponseCache()
+        state.api_key_authenticator = ApiKeyAuthenticator()
+        state.write_queue = WriteBehindQueue({kind: list for kind in ("recommendations", "usage", "vectors")})
+        state.single_flight = SingleFlight()
+        state.admission = AdmissionController(limits={})
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def analyze(n: int) -> httpx.Response:
+                # Distinct logs, so requests are not coalesced or served from cache
+                logs = base64.b64encode(f"{LOGS}failed at step {n}\n".encode()).decode()
+                return await client.post("/analyze", json={"api_key": f"key-{n}", "logs": logs})
+
+            started = time.perf_counter()
+            assert (await analyze(-1)).status_code == 200
+            one = time.perf_counter() - started
+
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(analyze(n) for n in range(10)))
+            ten = time.perf_counter() - started
+
+        assert all(response.status_code == 200 for response in responses)
+        assert all(response.json()["analysis"] == "Install left-pad" for response in responses)
+        # Run one after another, ten requests would take 6s
+        assert ten < 2 * one
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+# Standard library imports
+import asyncio
+
+# Third-party imports
+import pytest
+from fastapi import HTTPException
+
+# Internal imports
+import auth_helpers
+from auth_helpers import ApiKeyAuthenticator
+from supabase_logic import ApiKeyRecord
+
+
+@pytest.fixture
+def users(monkeypatch):
+    """API keys by user id, resolved through a stand-in for resolve_api_key."""
+    keys = {}
+
+    def resolve(client, api_key):
+        for user_id, key in keys.items():
+            if key == api_key:
+                return ApiKeyRecord(user_id=user_id, api_key=api_key)
+        return None
+
+    monkeypatch.setattr(auth_helpers, "resolve_api_key", resolve)
+    return keys
+
+
+def test_rotated_key_is_rejected_after_invalidation(users):
+    async def scenario() -> None:
+        authenticator = ApiKeyAuthenticator()
+        users["alice"] = "old-key"
+        assert (await authenticator.authenticate(None, "old-key")).user_id == "alice"
+
+        users["alice"] = "new-key"
+        authenticator.invalidate_user("alice", "new-key")
+        with pytest.raises(HTTPException) as error:
+            await authenticator.authenticate(None, "old-key")
+        assert error.value.status_code == 401
+        assert (await authenticator.authenticate(None, "new-key")).user_id == "alice"
+
+    asyncio.run(scenario())
+
+
+def test_other_processes_drop_a_rotated_key_after_the_ttl(users):
+    async def scenario() -> None:
+        authenticator = ApiKeyAuthenticator(ttl=0.05)
+        users["alice"] = "old-key"
+        await authenticator.authenticate(None, "old-key")
+        # Rotated elsewhere, so this process never hears about it
+        users["alice"] = "new-key"
+        await asyncio.sleep(0.1)
+        with pytest.raises(HTTPException):
+            await authenticator.authenticate(None, "old-key")
+
+    asyncio.run(scenario())
+
+
+def test_user_index_is_bounded_like_the_key_cache(users):
+    async def scenario() -> None:
+        authenticator = ApiKeyAuthenticator(maxsize=10)
+        for n in range(100):
+            users[f"user-{n}"] = f"key-{n}"
+            await authenticator.authenticate(None, f"key-{n}")
+        assert len(authenticator.valid) == 10
+        assert len(authenticator._keys_by_user) == 10
+
+    asyncio.run(scenario())
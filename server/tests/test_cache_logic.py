@@ -0,0 +1,20 @@
+# Internal imports
+from cache_logic import log_fingerprint, normalize_log_text
+from debug_module import reduce_logs
+
+ERROR_LINE = "Error: Cannot find module 'left-pad'"
+
+
+def build_log(noise_lines: int) -> str:
+    noise = ["Downloading packages"] * noise_lines
+    return "\n".join(noise + [ERROR_LINE] + noise)
+
+
+def test_omitted_line_counts_do_not_change_the_fingerprint():
+    short, long = reduce_logs(build_log(200)), reduce_logs(build_log(300))
+    assert "lines omitted" in short and short != long
+    assert log_fingerprint(short, scope="key") == log_fingerprint(long, scope="key")
+
+
+def test_omitted_marker_is_normalized():
+    assert normalize_log_text("... [42 lines omitted] ...") == "... [lines omitted] ..."
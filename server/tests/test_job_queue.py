@@ -0,0 +1,83 @@
+# Standard library imports
+import asyncio
+import time
+
+# Third-party imports
+import httpx
+import pytest
+from fastapi import HTTPException
+
+# Internal imports
+from job_queue import InMemoryJobQueue, Job, JobWorkerPool, check_webhook_url
+
+PUBLIC_WEBHOOK = "https://93.184.216.34/hooks/analysis"
+
+
+@pytest.mark.parametrize("url", [
+    "http://93.184.216.34/hook",
+    "https://127.0.0.1/hook",
+    "https://localhost/hook",
+    "https://10.0.0.5/hook",
+    "https://192.168.1.1:8443/hook",
+    "https://169.254.169.254/latest/meta-data",
+    "https://[::1]/hook",
+    "https://[fe80::1]/hook",
+])
+def test_webhook_url_rejects_internal_targets(url):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(check_webhook_url(url))
+    assert error.value.status_code == 400
+
+
+def test_webhook_url_accepts_public_address():
+    asyncio.run(check_webhook_url(PUBLIC_WEBHOOK))
+
+
+def test_slow_webhook_does_not_hold_worker():
+    async def scenario() -> None:
+        delivered = []
+
+        async def slow_endpoint(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(0.5)
+            delivered.append(request.url)
+            return httpx.Response(200)
+
+        async def handler(payload: int) -> dict:
+            return {"value": payload}
+
+        queue = InMemoryJobQueue()
+        pool = JobWorkerPool(queue, handler, workers=1)
+        pool.start()
+        pool._http = httpx.AsyncClient(transport=httpx.MockTransport(slow_endpoint))
+
+        started = time.monotonic()
+        for number in range(3):
+            await queue.submit(Job(job_id=str(number), webhook_url=PUBLIC_WEBHOOK), number)
+        for number in range(3):
+            job = await queue.wait(str(number), timeout=2)
+            assert job.done
+        assert time.monotonic() - started < 0.4
+
+        await pool.close(grace=2)
+        assert len(delivered) == 3
+
+    asyncio.run(scenario())
+
+
+def test_queue_is_bounded_by_payload_bytes():
+    async def scenario() -> None:
+        queue = InMemoryJobQueue(max_bytes=100)
+        await queue.submit(Job(job_id="a"), "a" * 60, size=60)
+        with pytest.raises(HTTPException) as error:
+            await queue.submit(Job(job_id="b"), "b" * 60, size=60)
+        assert error.value.status_code == 503
+        with pytest.raises(HTTPException) as error:
+            await queue.submit(Job(job_id="c"), "c" * 101, size=101)
+        assert error.value.status_code == 413
+
+        # Taking a job off the queue frees its share of the budget
+        job, payload = await queue.next()
+        assert job.job_id == "a" and queue.queued_bytes == 0
+        await queue.submit(Job(job_id="b"), "b" * 60, size=60)
+
+    asyncio.run(scenario())
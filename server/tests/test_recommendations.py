@@ -0,0 +1,47 @@
+# Standard library imports
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+# Third-party imports
+from postgrest.exceptions import APIError
+
+# Internal imports
+import supabase_logic
+
+
+class RecommendationsTable:
+    """Stand-in for a recommendations table that predates the routing column."""
+
+    def __init__(self) -> None:
+        self.inserts: List[List[Dict[str, Any]]] = []
+
+    def table(self, name: str) -> "RecommendationsTable":
+        assert name == "recommendations"
+        return self
+
+    def insert(self, rows: List[Dict[str, Any]]) -> SimpleNamespace:
+        self.inserts.append(rows)
+        return SimpleNamespace(execute=lambda: self._execute(rows))
+
+    def _execute(self, rows: List[Dict[str, Any]]) -> None:
+        if any("routing" in row for row in rows):
+            raise APIError({"code": "PGRST204", "message": "Could not find the 'routing' column"})
+
+
+def row(routing: Any) -> Dict[str, Any]:
+    return supabase_logic.build_recommendation_row("user", "org/repo", "", "", "fix", "analysis", routing)
+
+
+def test_rows_without_routing_omit_the_column():
+    assert "routing" not in row(None)
+    assert row({"combined": {"tier": "small"}})["routing"] == {"combined": {"tier": "small"}}
+
+
+def test_insert_falls_back_when_routing_column_is_missing():
+    client = RecommendationsTable()
+
+    supabase_logic.insert_recommendations(client, [row(None), row({"combined": {"tier": "small"}})])
+
+    assert len(client.inserts) == 2
+    assert all("routing" not in saved for saved in client.inserts[-1])
+    assert [saved["response_data"] for saved in client.inserts[-1]] == ["analysis", "analysis"]
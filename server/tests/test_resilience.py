@@ -0,0 +1,188 @@
+# Standard library imports
+import asyncio
+import time
+
+# Third-party imports
+import httpx
+import openai
+import pytest
+
+# Internal imports
+from resilience import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientCaller, RetryPolicy, deadline_scope
+)
+
+
+def status_error(status: int) -> openai.APIStatusError:
+    response = httpx.Response(status, request=httpx.Request("POST", "https://api.openai.com"))
+    return openai.APIStatusError("provider error", response=response, body=None)
+
+
+def make_caller(threshold: int = 2, reset_timeout: float = 0.05) -> ResilientCaller:
+    return ResilientCaller(
+        "test",
+        retry=RetryPolicy(max_attempts=1, base_delay=0),
+        breaker=CircuitBreaker("test", failure_threshold=threshold, reset_timeout=reset_timeout)
+    )
+
+
+def failing(status: int):
+    async def call(timeout: float) -> None:
+        raise status_error(status)
+    return call
+
+
+def failing_sync(status: int):
+    def call(timeout: float) -> None:
+        raise status_error(status)
+    return call
+
+
+async def succeed(timeout: float) -> str:
+    return "ok"
+
+
+async def open_circuit(caller: ResilientCaller) -> None:
+    for _ in range(caller.breaker.failure_threshold):
+        with pytest.raises(openai.APIStatusError):
+            await caller.call(failing(503))
+    assert caller.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await caller.call(succeed)
+    await asyncio.sleep(caller.breaker.reset_timeout)
+    assert caller.breaker.state == "half-open"
+
+
+def test_retries_transient_errors_until_success():
+    caller = ResilientCaller("test", retry=RetryPolicy(base_delay=0))
+    attempts = []
+
+    async def flaky(timeout: float) -> str:
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise status_error(503)
+        return "ok"
+
+    assert asyncio.run(caller.call(flaky)) == "ok"
+    assert len(attempts) == 3
+    assert caller.breaker.failures == 0
+
+
+def test_bad_request_is_not_retried():
+    caller = ResilientCaller("test", retry=RetryPolicy(base_delay=0))
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(caller.call(failing(400)))
+    assert caller.stats["retries"] == 0
+    assert caller.breaker.failures == 0
+
+
+def test_successful_trial_closes_circuit():
+    async def scenario() -> None:
+        caller = make_caller()
+        await open_circuit(caller)
+        assert await caller.call(succeed) == "ok"
+        assert caller.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_failed_trial_reopens_circuit():
+    async def scenario() -> None:
+        caller = make_caller()
+        await open_circuit(caller)
+        with pytest.raises(openai.APIStatusError):
+            await caller.call(failing(503))
+        assert caller.breaker.state == "open"
+
+    asyncio.run(scenario())
+
+
+def test_bad_request_trial_closes_circuit():
+    async def scenario() -> None:
+        caller = make_caller()
+        await open_circuit(caller)
+        with pytest.raises(openai.APIStatusError):
+            await caller.call(failing(400))
+        assert caller.breaker.state == "closed"
+        assert await caller.call(succeed) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_trial_is_released():
+    async def scenario() -> None:
+        caller = make_caller()
+        await open_circuit(caller)
+
+        async def hang(timeout: float) -> None:
+            await asyncio.sleep(10)
+
+        trial = asyncio.ensure_future(caller.call(hang))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpenError):
+            await caller.call(succeed)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert caller.breaker.state == "half-open"
+        assert await caller.call(succeed) == "ok"
+        assert caller.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_expired_deadline_does_not_claim_trial():
+    async def scenario() -> None:
+        caller = make_caller()
+        await open_circuit(caller)
+        with deadline_scope(0):
+            with pytest.raises(DeadlineExceeded):
+                await caller.call(succeed)
+        assert await caller.call(succeed) == "ok"
+        assert caller.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_sync_trial_is_released_on_bad_request():
+    caller = make_caller()
+    for _ in range(2):
+        with pytest.raises(openai.APIStatusError):
+            caller.call_sync(failing_sync(503))
+    time.sleep(caller.breaker.reset_timeout)
+    with pytest.raises(openai.APIStatusError):
+        caller.call_sync(failing_sync(400))
+    assert caller.call_sync(lambda timeout: "ok") == "ok"
+
+
+def test_retry_stops_at_deadline():
+    async def scenario() -> None:
+        caller = ResilientCaller("test", retry=RetryPolicy(base_delay=5, max_delay=5))
+        started = time.monotonic()
+        with deadline_scope(0.2):
+            with pytest.raises(openai.APIStatusError):
+                await caller.call(failing(503))
+        assert time.monotonic() - started < 0.2
+
+    asyncio.run(scenario())
+
+
+def test_hedge_returns_faster_request():
+    async def scenario() -> None:
+        caller = ResilientCaller("test", hedge=True)
+        for _ in range(30):
+            caller.latency.record(0.02)
+        calls = []
+
+        async def slow_first(timeout: float) -> int:
+            calls.append(timeout)
+            number = len(calls)
+            await asyncio.sleep(1.0 if number == 1 else 0.01)
+            return number
+
+        started = time.monotonic()
+        assert await caller.call(slow_first) == 2
+        assert time.monotonic() - started < 0.5
+        assert caller.stats["hedges"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,49 @@
+# Standard library imports
+import asyncio
+from typing import AsyncIterator
+
+# Internal imports
+import server
+from admission import AdmissionController, PrioritySemaphore
+
+
+def test_stream_releases_slot_when_client_leaves_before_first_chunk():
+    async def scenario() -> None:
+        controller = AdmissionController(gpt_slots=PrioritySemaphore(limit=1, max_waiting=0))
+        assert await controller.gpt_slots.acquire(priority=0)
+        on_close = server.call_once(controller.release_gpt_slot)
+        started = False
+
+        async def events() -> AsyncIterator[str]:
+            nonlocal started
+            started = True
+            try:
+                yield "event: done\n\n"
+            finally:
+                on_close()
+
+        async def receive() -> dict:
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict) -> None:
+            raise OSError("client went away")
+
+        response = server.ClosingStreamingResponse(events(), on_close=on_close)
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        try:
+            await response(scope, receive, send)
+        except Exception:
+            pass
+
+        assert not started
+        assert controller.gpt_slots.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_call_once_runs_cleanup_once():
+    calls = []
+    cleanup = server.call_once(lambda: calls.append(1))
+    cleanup()
+    cleanup()
+    assert calls == [1]
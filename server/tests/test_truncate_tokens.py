@@ -0,0 +1,54 @@
+# Standard library imports
+from typing import List
+
+# Third-party imports
+import pytest
+
+# Internal imports
+import vector_logic
+
+
+class ByteEncoding:
+    """Stands in for tiktoken with one token per UTF-8 byte, the worst case."""
+
+    def __init__(self) -> None:
+        self.encoded: List[int] = []
+
+    def encode(self, text, disallowed_special=()):
+        self.encoded.append(len(text))
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", "ignore")
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    encoding = ByteEncoding()
+    monkeypatch.setattr(vector_logic, "get_encoding", lambda model_name: encoding)
+    return encoding
+
+
+LOG = "".join(f"step {n}: npm ERR! code ERESOLVE\n" for n in range(100000))
+
+
+def test_short_text_is_returned_without_encoding(encoding):
+    assert vector_logic.truncate_tokens("npm ERR!", 12) == "npm ERR!"
+    assert vector_logic.truncate_tokens("npm ERR!", 0) == ""
+    assert encoding.encoded == []
+
+
+@pytest.mark.parametrize("keep", ["head", "tail"])
+def test_windowed_truncation_matches_encoding_everything(encoding, keep):
+    tokens = list(LOG.encode("utf-8"))
+    expected = bytes(tokens[-8000:] if keep == "tail" else tokens[:8000]).decode("utf-8")
+    assert vector_logic.truncate_tokens(LOG, 8000, keep=keep) == expected
+    # Only a window around the kept end is ever encoded
+    assert max(encoding.encoded) < len(LOG) // 10
+
+
+def test_truncate_tokens_bounds_multibyte_text_by_bytes(encoding):
+    # 10 characters but 30 tokens: a character count would wrongly pass it through
+    assert vector_logic.truncate_tokens("€" * 10, 12) == "€" * 4
+    assert vector_logic.truncate_tokens("€" * 10, 12, keep="tail") == "€" * 4
+    assert vector_logic.truncate_tokens("€" * 4, 12) == "€" * 4
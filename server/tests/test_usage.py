@@ -0,0 +1,142 @@
+# Standard library imports
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# Third-party imports
+import pytest
+from postgrest.exceptions import APIError
+
+# Internal imports
+import supabase_logic
+
+
+class InMemoryUsageDb:
+    """Stand-in for the users and logs tables plus the record_usage function.
+
+    record_usage holds a per-database lock, as the procedure holds the
+    user's row lock, and applies the same idempotency rule on request_id.
+    """
+
+    def __init__(self, rpc_error: Optional[Exception] = None, batch_error: Optional[Exception] = None) -> None:
+        self.users: Dict[str, Dict[str, Any]] = {"key": {"api_calls": 0, "repo_used": []}}
+        self.logs: List[Dict[str, Any]] = []
+        self.rpc_error = rpc_error
+        self.batch_error = batch_error
+        self.rpc_calls: List[str] = []
+        self.table_calls = 0
+        self._lock = threading.Lock()
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> SimpleNamespace:
+        self.rpc_calls.append(name)
+        if name == "record_usage_batch":
+            return SimpleNamespace(execute=lambda: self._record_usage_batch(**params))
+        assert name == "record_usage"
+        return SimpleNamespace(execute=lambda: self._record_usage(**params))
+
+    def _record_usage_batch(self, p_entries: List[Dict[str, Any]]) -> SimpleNamespace:
+        if self.batch_error is not None:
+            raise self.batch_error
+        recorded = sum(
+            self._record_usage(entry["api_key"], entry["issue"], entry["repo"], entry["request_id"]).data
+            for entry in sorted(p_entries, key=lambda entry: entry["api_key"])
+        )
+        return SimpleNamespace(data=recorded)
+
+    def _record_usage(self, p_api_key, p_issue, p_repository, p_request_id=None) -> SimpleNamespace:
+        if self.rpc_error is not None:
+            raise self.rpc_error
+        with self._lock:
+            user = self.users.get(p_api_key)
+            if user is None:
+                return SimpleNamespace(data=False)
+            if p_request_id is not None and any(log["request_id"] == p_request_id for log in self.logs):
+                return SimpleNamespace(data=True)
+            self.logs.append({"api_key": p_api_key, "issue": p_issue, "request_id": p_request_id})
+            # Widen the window a lost update would need
+            api_calls = user["api_calls"]
+            time.sleep(0.001)
+            user["api_calls"] = api_calls + 1
+            if p_repository not in user["repo_used"]:
+                user["repo_used"].append(p_repository)
+            return SimpleNamespace(data=True)
+
+    def table(self, name: str) -> Any:
+        self.table_calls += 1
+        raise RuntimeError("legacy read-modify-write path should not be used")
+
+
+def test_no_lost_updates_under_100_parallel_requests():
+    db = InMemoryUsageDb()
+
+    def record(number: int) -> bool:
+        return supabase_logic.update_user_logs(db, "key", "build.py", f"org/repo-{number % 3}", f"req-{number}")
+
+    with ThreadPoolExecutor(max_workers=100) as pool:
+        results = list(pool.map(record, range(100)))
+
+    assert all(results)
+    assert db.users["key"]["api_calls"] == 100
+    assert len(db.logs) == 100
+    assert sorted(db.users["key"]["repo_used"]) == ["org/repo-0", "org/repo-1", "org/repo-2"]
+
+
+def test_retried_request_is_counted_once():
+    db = InMemoryUsageDb()
+    for _ in range(3):
+        assert supabase_logic.update_user_logs(db, "key", "build.py", "org/repo", "req-1")
+    assert db.users["key"]["api_calls"] == 1
+    assert len(db.logs) == 1
+
+
+def test_rpc_failure_is_raised_without_fallback():
+    db = InMemoryUsageDb(rpc_error=APIError({"code": "57014", "message": "canceling statement due to statement timeout"}))
+    with pytest.raises(APIError):
+        supabase_logic.update_user_logs(db, "key", "build.py", "org/repo", "req-1")
+    assert db.table_calls == 0
+
+
+def test_missing_function_falls_back_to_legacy_update(monkeypatch):
+    db = InMemoryUsageDb(rpc_error=APIError({"code": "PGRST202", "message": "Could not find the function"}))
+    legacy_calls = []
+    monkeypatch.setattr(
+        supabase_logic, "_update_user_logs_legacy", lambda *args: legacy_calls.append(args) or True)
+    assert supabase_logic.update_user_logs(db, "key", "build.py", "org/repo", "req-1")
+    assert len(legacy_calls) == 1
+
+
+ENTRIES = [
+    {"api_key": "key", "issue": "a.py", "repo": "org/repo", "request_id": "req-1"},
+    {"api_key": "key", "issue": None, "repo": "org/other", "request_id": "req-2"},
+    {"api_key": "unknown", "issue": "b.py", "repo": "org/repo", "request_id": "req-3"},
+]
+
+
+def test_usage_batch_is_one_rpc():
+    db = InMemoryUsageDb()
+    assert supabase_logic.record_usage_batch(db, ENTRIES) == []
+    assert db.rpc_calls == ["record_usage_batch"]
+    assert db.users["key"]["api_calls"] == 2
+
+    # A retried batch is not counted again
+    supabase_logic.record_usage_batch(db, ENTRIES)
+    assert db.users["key"]["api_calls"] == 2
+
+
+def test_usage_batch_failure_is_raised_for_retry():
+    db = InMemoryUsageDb(batch_error=RuntimeError("connection reset"))
+    with pytest.raises(RuntimeError):
+        supabase_logic.record_usage_batch(db, ENTRIES)
+
+
+def test_usage_batch_falls_back_to_single_calls_and_returns_failures():
+    missing = APIError({"code": "PGRST202", "message": "Could not find the function"})
+    db = InMemoryUsageDb(batch_error=missing)
+    assert supabase_logic.record_usage_batch(db, ENTRIES) == []
+    assert db.rpc_calls.count("record_usage") == 3
+    assert db.users["key"]["api_calls"] == 2
+
+    db.rpc_error = RuntimeError("connection reset")
+    assert supabase_logic.record_usage_batch(db, ENTRIES) == ENTRIES
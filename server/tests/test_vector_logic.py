@@ -0,0 +1,134 @@
+# Standard library imports
+import json
+import os
+import subprocess
+import sys
+
+# Third-party imports
+import numpy as np
+
+# Internal imports
+import vector_logic
+from vector_logic import MAX_METADATA_BYTES, VectorMetadata
+from vector_store import InMemoryVectorIndex
+
+
+def metadata(**fields):
+    base = {"genre": "errors", "api_key": "key", "issue": "boom", "timestamp": "2026-01-01T00:00:00"}
+    base.update(fields)
+    return VectorMetadata(**base)
+
+
+def encoded_size(record):
+    return len(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+
+def test_small_metadata_is_untouched():
+    record = metadata(analysis="fix it", new_code="print(1)").to_record()
+    assert record["analysis"] == "fix it"
+    assert "truncated" not in record
+
+
+def test_multibyte_text_is_cut_by_bytes_across_fields():
+    # 15k characters each, but 45 KB of UTF-8 apiece
+    record = metadata(analysis="€" * 15000, new_code="é\n" * 15000).to_record()
+    assert encoded_size(record) <= MAX_METADATA_BYTES
+    assert {"analysis", "new_code"} <= set(record["truncated"])
+    assert record["analysis"] and set(record["analysis"]) == {"€"}
+
+
+def test_truncated_answers_are_not_served_from_the_cache():
+    index = InMemoryVectorIndex()
+    vector_logic.set_vector_index(index)
+    try:
+        vector_logic.add_vectors([
+            ("full", [1.0, 0.0], metadata(analysis="short", new_code="x = 1")),
+            ("cut", [0.0, 1.0], metadata(analysis="a" * 50000, new_code="x = 1")),
+        ])
+        assert vector_logic.find_cached_analysis([1.0, 0.0], "key").vector_id == "full"
+        assert vector_logic.find_cached_analysis([0.0, 1.0], "key") is None
+    finally:
+        vector_logic.set_vector_index(None)
+
+
+def test_cache_lookup_skips_unusable_neighbours():
+    index = InMemoryVectorIndex()
+    vector_logic.set_vector_index(index)
+    try:
+        vector_logic.add_vectors([
+            ("failed", [1.0, 0.0, 0.0], metadata()),
+            ("cut", [1.0, 0.01, 0.0], metadata(analysis="a" * 50000, new_code="x = 1")),
+            ("usable", [1.0, 0.02, 0.0], metadata(analysis="short", new_code="x = 1")),
+            ("far", [1.0, 1.0, 0.0], metadata(analysis="other", new_code="x = 2")),
+        ])
+        assert vector_logic.find_cached_analysis([1.0, 0.0, 0.0], "key").vector_id == "usable"
+        # Below the threshold the search stops, even with a usable answer further out
+        index.upsert([("usable", [1.0, 0.5, 0.0], metadata(analysis="short", new_code="x = 1").to_record())])
+        assert vector_logic.find_cached_analysis([1.0, 0.0, 0.0], "key") is None
+    finally:
+        vector_logic.set_vector_index(None)
+
+
+def test_refit_keeps_cluster_ids(tmp_path):
+    rng = np.random.default_rng(0)
+    centers = np.eye(4, 8, dtype=np.float32) * 10
+    index = InMemoryVectorIndex()
+    # Interleaved so every mini-batch sees all four blobs
+    index.upsert([
+        (f"{blob}-{i}", (centers[blob] + rng.normal(scale=0.1, size=8)).tolist(), {})
+        for i in range(100) for blob in range(4)
+    ])
+    vector_logic.set_vector_index(index)
+    model_path = str(tmp_path / "clusters.joblib")
+    try:
+        first, _ = vector_logic.clustering_fit_incremental(vector_logic.ClusteringConfig(
+            n_clusters=4, batch_size=64, random_state=1, n_init=1, model_path=model_path))
+        second, model = vector_logic.clustering_fit_incremental(vector_logic.ClusteringConfig(
+            n_clusters=4, batch_size=64, random_state=3, n_init=1, model_path=model_path))
+        assert model.n_init == 1
+        # The raw k-means labels differ between the two fits; the ids do not
+        assert not np.array_equal(model.cluster_ids_, np.arange(4))
+        assert first.set_index("id")["cluster"].to_dict() == second.set_index("id")["cluster"].to_dict()
+        assert vector_logic.assign_cluster(centers[2].tolist(), model_path) == second.set_index("id")["cluster"]["2-0"]
+    finally:
+        vector_logic.set_vector_index(None)
+
+
+def test_new_clusters_get_unused_ids():
+    previous = np.eye(2, 4)
+    ids = vector_logic.match_cluster_ids(np.eye(3, 4)[::-1], previous, np.array([5, 9]))
+    assert ids.tolist() == [10, 9, 5]
+
+
+def test_assigning_and_storing_vectors_never_load_sklearn(tmp_path):
+    from sklearn.cluster import MiniBatchKMeans
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(300, 8)).astype(np.float32)
+    model = MiniBatchKMeans(n_clusters=5, random_state=0, n_init=1).fit(data)
+    model.cluster_ids_ = np.array([4, 7, 1, 0, 9])
+    model_path = str(tmp_path / "clusters.joblib")
+    vector_logic._save_cluster_model(model, model_path)
+
+    expected = model.cluster_ids_[model.predict(data[:20])].tolist()
+    model_mtime = os.stat(model_path).st_mtime_ns
+    script = (
+        "import json, sys, numpy as np, vector_logic\n"
+        "from vector_store import InMemoryVectorIndex\n"
+        f"data = np.load({str(tmp_path / 'data.npy')!r})\n"
+        f"print(json.dumps([vector_logic.assign_cluster(v.tolist(), {model_path!r}) for v in data]))\n"
+        "vector_logic.set_vector_index(InMemoryVectorIndex())\n"
+        "vector_logic.add_vectors([(str(n), v.tolist(), vector_logic.VectorMetadata(\n"
+        "    genre='errors', api_key='key', issue='boom', timestamp='2026-01-01T00:00:00'))\n"
+        "    for n, v in enumerate(data)])\n"
+        "print(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] in ('sklearn', 'joblib'))))\n"
+    )
+    np.save(tmp_path / "data.npy", data[:20])
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=os.path.dirname(vector_logic.__file__),
+        env={**os.environ, "CLUSTER_MODEL_PATH": model_path}, capture_output=True, text=True, check=True)
+    assigned, heavy_modules = [json.loads(line) for line in result.stdout.splitlines()[-2:]]
+    assert assigned == expected
+    assert heavy_modules == []
+    # Only fit_clusters.py rewrites the model
+    assert os.stat(model_path).st_mtime_ns == model_mtime
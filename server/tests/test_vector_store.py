@@ -0,0 +1,157 @@
+# Standard library imports
+import json
+import os
+
+# Third-party imports
+import numpy as np
+import pytest
+
+# Internal imports
+import vector_store
+from vector_store import LocalVectorIndex
+
+
+def records(count, start=0, dimension=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (f"id-{start + i}", rng.normal(size=dimension).tolist(), {"n": start + i})
+        for i in range(count)
+    ]
+
+
+def crash(index):
+    """Drop an index the way a killed process would: files as written, lock released."""
+    index._log.close()
+    index._lock_file.close()
+
+
+def test_upsert_appends_instead_of_rewriting_metadata(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), dimension=8)
+    index.upsert(records(10))
+    log_path = os.path.join(str(tmp_path), "meta.jsonl")
+    size = os.path.getsize(log_path)
+    index.upsert(records(1, start=10))
+    with open(log_path) as f:
+        lines = f.readlines()
+    assert len(lines) == 11
+    assert os.path.getsize(log_path) - size == len(lines[-1])
+    index.close()
+
+
+def test_reopen_replays_log_with_last_write_winning(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), dimension=8)
+    vectors = records(5)
+    index.upsert(vectors)
+    index.upsert([("id-2", vectors[2][1], {"n": "updated"})])
+    crash(index)
+
+    reopened = LocalVectorIndex(str(tmp_path), dimension=8)
+    assert reopened.ids == [f"id-{i}" for i in range(5)]
+    assert reopened.fetch(["id-2"])["vectors"]["id-2"]["metadata"] == {"n": "updated"}
+    reopened.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), dimension=8)
+    index.upsert(records(3))
+    index._log.write('{"id": "id-3", "meta')
+    crash(index)
+
+    reopened = LocalVectorIndex(str(tmp_path), dimension=8)
+    assert reopened.count == 3
+    reopened.close()
+
+
+def test_close_compacts_superseded_entries(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), dimension=8)
+    for _ in range(3):
+        index.upsert(records(4))
+    index.close()
+    with open(os.path.join(str(tmp_path), "meta.jsonl")) as f:
+        assert len(f.readlines()) == 4
+
+
+def test_ivf_assignments_survive_reopen(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), dimension=8, nprobe=2)
+    index.upsert(records(200))
+    index.build_ivf(nlist=8)
+    added = records(20, start=200, seed=1)
+    index.upsert(added)
+    assignments = np.array(index.assignments[:index.count])
+    index.close()
+
+    reopened = LocalVectorIndex(str(tmp_path), dimension=8, nprobe=2)
+    assert np.array_equal(np.array(reopened.assignments[:reopened.count]), assignments)
+    assert reopened.query(added[-1][1], top_k=1)["matches"][0]["id"] == "id-219"
+    reopened.close()
+
+
+def test_legacy_layout_is_migrated(tmp_path):
+    path = str(tmp_path)
+    vectors = np.eye(4, 8, dtype=np.float32)
+    capacity = 1024
+    matrix = np.memmap(os.path.join(path, "vectors.bin"), dtype=np.float32, mode="w+", shape=(capacity, 8))
+    matrix[:4] = vectors
+    matrix.flush()
+    del matrix
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({
+            "dimension": 8, "dtype": "float32", "capacity": capacity,
+            "ids": ["a", "b", "c", "d"], "metadata": [{"n": i} for i in range(4)],
+        }, f)
+
+    index = LocalVectorIndex(path, dimension=8)
+    assert not os.path.exists(os.path.join(path, "meta.json"))
+    assert index.query(vectors[2].tolist(), top_k=1, include_metadata=True)["matches"][0]["metadata"] == {"n": 2}
+    index.close()
+    assert LocalVectorIndex(path, dimension=8).ids == ["a", "b", "c", "d"]
+
+
+def test_second_writer_is_refused_until_the_first_closes(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), dimension=8)
+    index.upsert(records(3))
+    with pytest.raises(RuntimeError, match="already open"):
+        LocalVectorIndex(str(tmp_path), dimension=8)
+
+    snapshot = LocalVectorIndex(str(tmp_path), read_only=True)
+    assert snapshot.ids == ["id-0", "id-1", "id-2"]
+    with pytest.raises(RuntimeError, match="read-only"):
+        snapshot.upsert(records(1, start=3))
+    snapshot.close()
+
+    index.close()
+    LocalVectorIndex(str(tmp_path), dimension=8).close()
+
+
+def test_filtered_query_uses_the_row_index(tmp_path, monkeypatch):
+    index = LocalVectorIndex(str(tmp_path), dimension=8, nprobe=2)
+    rng = np.random.default_rng(0)
+    index.upsert([
+        (f"id-{i}", rng.normal(size=8).tolist(), {"api_key": f"key-{i % 10}", "genre": "errors"})
+        for i in range(500)
+    ])
+    # Moving a vector to another key moves its row too
+    moved = index.fetch(["id-0"])["vectors"]["id-0"]["values"]
+    index.upsert([("id-0", moved, {"api_key": "key-1", "genre": "errors"})])
+    checked = []
+    monkeypatch.setattr(vector_store, "matches_filter", lambda metadata, condition: checked.append(1) or True)
+
+    def matching_ids(vector, **filter):
+        metadata_filter = {field: {"$eq": value} for field, value in filter.items()}
+        return [match["id"] for match in index.query(vector, top_k=500, filter=metadata_filter)["matches"]]
+
+    query = rng.normal(size=8).tolist()
+    found = matching_ids(query, api_key="key-1", genre="errors")
+    assert sorted(found) == sorted(["id-0"] + [f"id-{i}" for i in range(1, 500, 10)])
+    assert len(matching_ids(query, api_key="key-0")) == 49
+    assert matching_ids(query, api_key="unknown") == []
+    assert checked == []
+
+    # With IVF the indexed rows are narrowed to the probed lists, and other fields still filter
+    index.build_ivf(nlist=8)
+    probed = set(matching_ids(query, api_key="key-1"))
+    assert probed and probed <= set(found)
+    # Only those rows are checked against the unindexed field
+    assert set(matching_ids(query, api_key="key-1", issue="boom")) == probed
+    assert len(checked) == len(probed)
+    index.close()
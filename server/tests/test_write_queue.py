@@ -0,0 +1,49 @@
+# Standard library imports
+import asyncio
+import time
+from typing import Any, List
+
+# Internal imports
+from write_queue import WriteBehindQueue
+
+
+def test_failing_kind_does_not_block_other_kinds():
+    async def scenario() -> None:
+        written: List[Any] = []
+
+        def failing(rows: List[Any]) -> None:
+            raise RuntimeError("backend down")
+
+        queue = WriteBehindQueue(
+            {"usage": failing, "recommendations": written.extend},
+            flush_interval=0.01, max_retries=3, base_delay=0.5)
+        queue.start()
+        await queue.submit("usage", {"api_key": "key"})
+        await asyncio.sleep(0.05)
+        await queue.submit("recommendations", {"id": 1})
+        await asyncio.sleep(0.1)
+        assert written == [{"id": 1}]
+        for worker in queue._workers:
+            worker.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_drops_instead_of_writing_inline():
+    async def scenario() -> None:
+        calls: List[Any] = []
+        queue = WriteBehindQueue({"usage": calls.extend}, maxsize=1, submit_timeout=0.05)
+        # Not started, so the buffer stays full
+        await queue.submit("usage", 1)
+        started = time.monotonic()
+        await queue.submit("usage", 2)
+        assert time.monotonic() - started < 0.5
+        assert calls == []
+        assert queue.stats["dropped"] == 1
+        assert queue.depth == 1
+
+        queue.start()
+        await queue.close()
+        assert calls == [1]
+
+    asyncio.run(scenario())
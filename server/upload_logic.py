@@ -0,0 +1,71 @@
+# Standard library imports
+import codecs
+import gzip
+import logging
+import os
+from typing import BinaryIO, List
+
+# Third-party imports
+from fastapi import HTTPException
+
+logger = logging.getLogger("upload_logic")
+
+# Cap on the decompressed size of one uploaded file, to guard against compression bombs
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _zstd_available() -> bool:
+    """Check whether zstd uploads can be read (needs the zstandard package)."""
+    try:
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def open_decompressed(fileobj: BinaryIO) -> BinaryIO:
+    """Wrap an upload in a streaming gzip or zstd reader, detected from its magic bytes.
+
+    Uncompressed uploads are returned unchanged.
+    """
+    head = fileobj.read(len(ZSTD_MAGIC))
+    fileobj.seek(0)
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if head.startswith(ZSTD_MAGIC):
+        if not _zstd_available():
+            raise HTTPException(status_code=415, detail="zstd uploads are not supported by this server")
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    return fileobj
+
+
+def read_upload_text(fileobj: BinaryIO, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """Decompress an uploaded file chunk by chunk and decode it as UTF-8.
+
+    Only one chunk of decompressed data is handled at a time, so a 20 MB log
+    is never held as compressed, raw and decoded copies at once. Blocking:
+    run it on the shared executor.
+    """
+    reader = open_decompressed(fileobj)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parts: List[str] = []
+    total = 0
+    while True:
+        try:
+            chunk = reader.read(UPLOAD_CHUNK_SIZE)
+        except Exception as e:
+            logger.warning(f"Failed to decompress upload: {str(e)}")
+            raise HTTPException(status_code=400, detail="Upload is not valid gzip or zstd data")
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes once decompressed")
+        parts.append(decoder.decode(chunk))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
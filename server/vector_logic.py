@@ -1,18 +1,31 @@
 # Standard library imports
+import functools
+import json
 import os
 import logging
-from typing import List, Dict, Any, Tuple, Optional, Union
+import threading
+from typing import TYPE_CHECKING, List, Dict, Any, Iterator, Tuple, Optional, Union
 
 # Third-party imports
 import openai
 import tiktoken
 import numpy as np
-import pandas as pd
-from pinecone import Pinecone, ServerlessSpec
-from sklearn.cluster import KMeans
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field, validator
 
+# Internal imports
+from cache_logic import EmbeddingCache
+from concurrency import run_blocking
+from resilience import embedding_calls
+from vector_store import InMemoryVectorIndex, LocalVectorIndex, VectorStore
+
+# pandas, sklearn, joblib and pinecone are imported where they are used so
+# that the /analyze path does not pay for them at cold start
+if TYPE_CHECKING:
+    import pandas as pd
+    from pinecone import Pinecone
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
 load_dotenv()
 
 logging.basicConfig(
@@ -22,10 +35,63 @@ logging.basicConfig(
 logger = logging.getLogger("vector_logic")
 
 openai_key = os.environ.get("OPENAI_KEY")
-client = openai.OpenAI(api_key=openai_key)
-
 pinecone_key = os.environ.get("PINECONE_KEY")
-pc = Pinecone(api_key=pinecone_key)
+
+
+# Pinecone caps metadata at 40 KB per vector, measured on the serialized JSON
+MAX_METADATA_BYTES = 40 * 1024 - 1024
+TRUNCATABLE_METADATA_FIELDS = ("issue", "analysis", "new_code")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+# Neighbours checked for a usable answer, in case the nearest one was stored without it
+SEMANTIC_CACHE_CANDIDATES = int(os.environ.get("SEMANTIC_CACHE_CANDIDATES", "5"))
+
+EMBEDDING_MAX_INPUT_TOKENS = 8000
+NATIVE_EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+# Must match the dimension of the vector index; 256-512 cuts storage and search cost
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", "1536"))
+PCA_PROJECTION_PATH = os.environ.get(
+    "PCA_PROJECTION_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "pca_projection.npz")
+)
+CHARS_PER_TOKEN_ESTIMATE = 8
+TOKEN_BOUNDARY_MARGIN = 16
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get("EMBEDDING_BATCH_MAX_TOKENS", "300000"))
+EMBEDDING_BATCH_MAX_INPUTS = 2048
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+
+PINECONE_UPSERT_BATCH_SIZE = 100
+# "pinecone", "memory", or "local", which needs a single server worker (see LocalVectorIndex)
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "pinecone")
+VECTOR_STORE_DTYPE = os.environ.get("VECTOR_STORE_DTYPE", "float32")
+VECTOR_STORE_PATH = os.environ.get(
+    "VECTOR_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "vectors")
+)
+
+CLUSTER_MODEL_PATH = os.environ.get(
+    "CLUSTER_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "cluster_model.joblib")
+)
+
+_vector_index: Optional[Any] = None
+_vector_index_lock = threading.Lock()
+_vector_index_override: Optional[Any] = None
+_embedding_cache: Optional[EmbeddingCache] = None
+_cluster_model: Optional["MiniBatchKMeans"] = None
+# Modification time of the model file the cached model came from
+_cluster_model_mtime: Optional[int] = None
+# Centroids and cluster ids for assign_cluster, which must not load sklearn
+_cluster_centroids: Optional[Tuple[np.ndarray, np.ndarray]] = None
+_cluster_centroids_mtime: Optional[int] = None
+_cluster_model_lock = threading.Lock()
+
+
+def _metadata_size(metadata: Dict[str, Any]) -> int:
+    return len(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
 
 
 # ----- Pydantic Models -----
@@ -36,15 +102,50 @@ class VectorMetadata(BaseModel):
     api_key: str
     issue: str
     timestamp: str
+    repository: Optional[str] = None
+    analysis: Optional[str] = None
+    new_code: Optional[str] = None
+    cluster: Optional[int] = None
+    truncated: Optional[List[str]] = None
     
     class Config:
         validate_assignment = True
 
+    def to_record(self) -> Dict[str, Any]:
+        """Serialize for the index, fitting the whole dict into MAX_METADATA_BYTES.
+
+        Free-text fields are cut at UTF-8 boundaries, each in proportion to
+        its share of the text, until the encoded JSON fits. The names of cut
+        fields are listed under "truncated" so readers know the text is partial.
+        """
+        # Pinecone rejects null metadata values
+        record = self.dict(exclude_none=True)
+        truncated = set(record.get("truncated", []))
+        while True:
+            overflow = _metadata_size(record) - MAX_METADATA_BYTES
+            if overflow <= 0:
+                return record
+            sizes = {
+                name: len(record[name].encode("utf-8"))
+                for name in TRUNCATABLE_METADATA_FIELDS if record.get(name)
+            }
+            if not sizes:
+                raise ValueError(f"Metadata is {overflow} bytes over the limit with no text left to cut")
+            # Escaped characters take more room in JSON than in UTF-8, so cut a little extra
+            excess = overflow + 64
+            total = sum(sizes.values())
+            for name, size in sizes.items():
+                keep = max(0, size - excess * size // total)
+                if keep < size:
+                    record[name] = record[name].encode("utf-8")[:keep].decode("utf-8", "ignore")
+                    truncated.add(name)
+            record["truncated"] = sorted(truncated)
+
 
 class EmbeddingConfig(BaseModel):
     """Configuration for embedding generation"""
     model: str = "text-embedding-3-small"
-    dimensions: int = 1536
+    dimensions: int = EMBEDDING_DIMENSIONS
     
     @validator('model')
     def validate_model_name(cls, v):
@@ -53,24 +154,52 @@ class EmbeddingConfig(BaseModel):
             raise ValueError(f"Model must be one of: {', '.join(valid_models)}")
         return v
 
+    @validator('dimensions')
+    def validate_dimensions(cls, v, values):
+        native = NATIVE_EMBEDDING_DIMENSIONS.get(values.get('model'), 1536)
+        if not 1 <= v <= native:
+            raise ValueError(f"Dimensions must be between 1 and {native}")
+        return v
 
-class ClusteringConfig(BaseModel):
-    """Configuration for clustering"""
-    n_clusters: int = Field(default=8, ge=2, le=100)
-    index_name: str = "github-actions-errors"
-    random_state: int = 42
-    n_init: int = 10
+    @property
+    def api_dimensions(self) -> bool:
+        """Whether the API can shorten embeddings itself (text-embedding-3-*)."""
+        return self.model.startswith("text-embedding-3-")
+
+    @property
+    def needs_projection(self) -> bool:
+        """Whether a local PCA projection is needed to reach the configured dimensions."""
+        return not self.api_dimensions and self.dimensions < NATIVE_EMBEDDING_DIMENSIONS[self.model]
 
 
 class PineconeIndexConfig(BaseModel):
     """Configuration for Pinecone index"""
     name: str = "github-actions-errors"
-    dimension: int = 1536
+    dimension: int = EMBEDDING_DIMENSIONS
     metric: str = "cosine"
     cloud: str = "aws"
     region: str = "us-west-2"
 
 
+class ClusteringConfig(BaseModel):
+    """Configuration for clustering"""
+    n_clusters: int = Field(default=8, ge=2, le=100)
+    index_name: str = PineconeIndexConfig().name
+    random_state: int = 42
+    n_init: int = 10
+    page_size: int = Field(default=100, ge=1, le=1000)
+    batch_size: int = Field(default=1024, ge=1)
+    model_path: str = CLUSTER_MODEL_PATH
+
+
+class CachedAnalysis(BaseModel):
+    """A stored analysis returned by the semantic cache"""
+    vector_id: str
+    score: float
+    analysis: str
+    new_code: str
+
+
 class ClusteringResult(BaseModel):
     """Results from clustering operation"""
     success: bool
@@ -88,56 +217,305 @@ class ClusteringResult(BaseModel):
         )
 
 
+# ----- Clients -----
+
+@functools.lru_cache(maxsize=None)
+def get_openai_client() -> openai.OpenAI:
+    """Return the shared OpenAI client, creating it on first use."""
+    # Retries are handled by the resilience layer, which knows the request deadline
+    return openai.OpenAI(api_key=openai_key, max_retries=0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """Return the shared async OpenAI client, creating it on first use."""
+    return openai.AsyncOpenAI(api_key=openai_key, max_retries=0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pinecone_client() -> "Pinecone":
+    """Return the Pinecone client, importing the SDK on first use."""
+    from pinecone import Pinecone
+
+    return Pinecone(api_key=pinecone_key)
+
+
 # ----- Embedding and Token Functions -----
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> "tiktoken.Encoding":
+    """Return the tiktoken encoding for an encoding or model name, loading it once."""
+    if model_name == "cl100k_base":
+        return tiktoken.get_encoding(model_name)
+    return tiktoken.encoding_for_model(model_name)
+
+
+def truncate_tokens(text: str, max_tokens: int, model_name: str = "cl100k_base", keep: str = "head") -> str:
+    """Truncate text to max_tokens, keeping either the head or the tail.
+
+    Every token covers at least one byte of UTF-8, so text no longer than
+    max_tokens bytes is returned without tokenizing. A character count alone
+    is not a bound, since one character can take up to four bytes and as
+    many tokens; it only decides whether the bytes are worth counting.
+    Longer text is encoded only over a growing prefix (or suffix) window
+    until it holds enough tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    if len(text) <= max_tokens and len(text.encode("utf-8")) <= max_tokens:
+        return text
+
+    encoding = get_encoding(model_name)
+    window = (max_tokens + TOKEN_BOUNDARY_MARGIN) * CHARS_PER_TOKEN_ESTIMATE
+    tokens = None
+    while window < len(text):
+        part = text[:window] if keep == "head" else text[-window:]
+        tokens = encoding.encode(part, disallowed_special=())
+        # The margin absorbs tokens split differently at the window edge
+        if len(tokens) > max_tokens + TOKEN_BOUNDARY_MARGIN:
+            break
+        tokens = None
+        window *= 2
+
+    if tokens is None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+
+    logger.warning(f"Truncating {len(text)} characters to {max_tokens} tokens ({keep})")
+    if keep == "tail":
+        return encoding.decode(tokens[-max_tokens:])
+    return encoding.decode(tokens[:max_tokens])
+
+
 def token_checker(text: str, model_name: str) -> str:
     """Check and truncate tokens if they exceed the model's limit."""
     try:
-        encoding = tiktoken.get_encoding(model_name) if model_name == "cl100k_base" else tiktoken.encoding_for_model(model_name)
-        tokens = encoding.encode(text)
-        max_tokens = 8000
-        if len(tokens) > max_tokens:
-            logger.warning(f"Truncating text from {len(tokens)} to {max_tokens} tokens")
-            return encoding.decode(tokens[:max_tokens])
-        return text
+        return truncate_tokens(text, EMBEDDING_MAX_INPUT_TOKENS, model_name)
     except Exception as e:
         logger.error(f"Error in token checker: {str(e)}")
         raise RuntimeError(f"Failed to process tokens: {str(e)}")
 
 
-def vector_embeddings(
-    text: str, 
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the persistent embedding cache, opening it on first use."""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_ENABLED:
+        try:
+            _embedding_cache = EmbeddingCache()
+        except Exception as e:
+            logger.error(f"Embedding cache unavailable: {str(e)}")
+    return _embedding_cache
+
+
+def plan_embedding_batches(
+    texts: List[str],
+    model_name: str = "cl100k_base",
+    max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    max_batch_inputs: int = EMBEDDING_BATCH_MAX_INPUTS
+) -> List[List[str]]:
+    """Truncate each text to the input limit and group them into request-sized batches."""
+    encoding = get_encoding(model_name)
+    batches: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    for text in texts:
+        text = truncate_tokens(text, EMBEDDING_MAX_INPUT_TOKENS, model_name)
+        tokens = encoding.encode(text, disallowed_special=())
+        if current and (current_tokens + len(tokens) > max_batch_tokens or len(current) >= max_batch_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += len(tokens)
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def fit_pca_projection(
+    vectors: List[List[float]],
+    dimensions: int,
+    path: str = PCA_PROJECTION_PATH
+) -> None:
+    """Fit and save a PCA projection for models that cannot shorten embeddings themselves."""
+    data = np.asarray(vectors, dtype=np.float32)
+    if len(data) < dimensions:
+        raise ValueError(f"Need at least {dimensions} sample vectors to fit the projection")
+    mean = data.mean(axis=0)
+    _, _, components = np.linalg.svd(data - mean, full_matrices=False)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(path, mean=mean, components=components[:dimensions])
+    get_pca_projection.cache_clear()
+    logger.info(f"Saved {dimensions}-dimensional PCA projection to {path}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_pca_projection(path: str = PCA_PROJECTION_PATH) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Load the saved PCA mean and components, or None if none has been fitted."""
+    if not os.path.exists(path):
+        return None
+    projection = np.load(path)
+    return projection["mean"], projection["components"]
+
+
+def _embedding_request_args(config: EmbeddingConfig) -> Dict[str, Any]:
+    """Arguments for embeddings.create, asking the API for reduced dimensions when it can."""
+    args: Dict[str, Any] = {"model": config.model}
+    if config.api_dimensions:
+        args["dimensions"] = config.dimensions
+    return args
+
+
+def _reduce_dimensions(vectors: List[List[float]], config: EmbeddingConfig) -> List[List[float]]:
+    """Project full-size embeddings down to the configured dimensions where the API could not."""
+    if not config.needs_projection or not vectors:
+        return vectors
+    projection = get_pca_projection()
+    if projection is None:
+        raise RuntimeError(
+            f"{config.model} needs a PCA projection for {config.dimensions} dimensions; run fit_pca_projection first")
+    mean, components = projection
+    if components.shape[0] != config.dimensions:
+        raise RuntimeError(f"PCA projection has {components.shape[0]} dimensions, expected {config.dimensions}")
+    reduced = (np.asarray(vectors, dtype=np.float32) - mean) @ components.T
+    return reduced.tolist()
+
+
+def _cached_embeddings(texts: List[str], config: EmbeddingConfig) -> Tuple[Dict[str, str], Dict[str, List[float]]]:
+    """Map each text to its cache key and look up the ones already embedded."""
+    keys = {text: EmbeddingCache.make_key(config.model, config.dimensions, text) for text in texts}
+    cache = get_embedding_cache()
+    if cache is None:
+        return keys, {}
+    try:
+        return keys, cache.get_many(keys.values())
+    except Exception as e:
+        logger.error(f"Embedding cache read failed: {str(e)}")
+        return keys, {}
+
+
+def _store_embeddings(keys: Dict[str, str], vectors: Dict[str, List[float]]) -> None:
+    """Write freshly created embeddings to the cache."""
+    cache = get_embedding_cache()
+    if cache is None or not vectors:
+        return
+    try:
+        cache.set_many({keys[text]: vector for text, vector in vectors.items()})
+    except Exception as e:
+        logger.error(f"Embedding cache write failed: {str(e)}")
+
+
+def vector_embeddings_batch(
+    texts: List[str],
     config: Optional[EmbeddingConfig] = None
-) -> List[float]:
-    """Generate vector embeddings for the given text."""
+) -> List[List[float]]:
+    """Generate embeddings for many texts, batching API calls and reusing cached vectors."""
     if config is None:
         config = EmbeddingConfig()
-        
+
+    unique_texts = list(dict.fromkeys(texts))
+    keys, cached = _cached_embeddings(unique_texts, config)
+    misses = [text for text in unique_texts if keys[text] not in cached]
+    created: Dict[str, List[float]] = {}
+
     try:
-        response = client.embeddings.create(
-            model=config.model, 
-            input=text
-        )
-        return response.data[0].embedding
+        offset = 0
+        for batch in plan_embedding_batches(misses):
+            response = embedding_calls.call_sync(
+                lambda timeout: get_openai_client().embeddings.create(
+                    input=batch,
+                    timeout=timeout,
+                    **_embedding_request_args(config)
+                )
+            )
+            items = sorted(response.data, key=lambda item: item.index)
+            vectors = _reduce_dimensions([item.embedding for item in items], config)
+            for item, vector in zip(items, vectors):
+                created[misses[offset + item.index]] = vector
+            offset += len(batch)
+    except Exception as e:
+        logger.error(f"Failed to create embeddings: {str(e)}")
+        raise RuntimeError(f"Embedding creation failed: {str(e)}")
+    finally:
+        _store_embeddings(keys, created)
+
+    logger.info(f"Embedded {len(created)} texts, {len(unique_texts) - len(misses)} served from cache")
+    return [cached.get(keys[text]) or created[text] for text in texts]
+
+
+async def vector_embeddings_batch_async(
+    texts: List[str],
+    config: Optional[EmbeddingConfig] = None
+) -> List[List[float]]:
+    """Async variant of vector_embeddings_batch."""
+    if config is None:
+        config = EmbeddingConfig()
+
+    unique_texts = list(dict.fromkeys(texts))
+    keys, cached = await run_blocking(_cached_embeddings, unique_texts, config)
+    misses = [text for text in unique_texts if keys[text] not in cached]
+    created: Dict[str, List[float]] = {}
+
+    try:
+        offset = 0
+        batches = await run_blocking(plan_embedding_batches, misses) if misses else []
+        for batch in batches:
+            response = await embedding_calls.call(
+                lambda timeout: get_async_openai_client().embeddings.create(
+                    input=batch,
+                    timeout=timeout,
+                    **_embedding_request_args(config)
+                )
+            )
+            items = sorted(response.data, key=lambda item: item.index)
+            vectors = _reduce_dimensions([item.embedding for item in items], config)
+            for item, vector in zip(items, vectors):
+                created[misses[offset + item.index]] = vector
+            offset += len(batch)
     except Exception as e:
         logger.error(f"Failed to create embeddings: {str(e)}")
         raise RuntimeError(f"Embedding creation failed: {str(e)}")
+    finally:
+        await run_blocking(_store_embeddings, keys, created)
+
+    return [cached.get(keys[text]) or created[text] for text in texts]
+
+
+def vector_embeddings(
+    text: str, 
+    config: Optional[EmbeddingConfig] = None
+) -> List[float]:
+    """Generate vector embeddings for the given text."""
+    return vector_embeddings_batch([text], config)[0]
+
+
+async def vector_embeddings_async(
+    text: str,
+    config: Optional[EmbeddingConfig] = None
+) -> List[float]:
+    """Async variant of vector_embeddings."""
+    return (await vector_embeddings_batch_async([text], config))[0]
 
 
 # ----- Clustering Functions -----
 
 def clustering_classify(
     config: Optional[ClusteringConfig] = None
-) -> Tuple[pd.DataFrame, KMeans]:
+) -> Tuple["pd.DataFrame", Optional["KMeans"]]:
     """Classify vectors into clusters using KMeans."""
+    import pandas as pd
+    from sklearn.cluster import KMeans
+
     if config is None:
         config = ClusteringConfig()
         
     try:
-        index = pc.Index(config.index_name)
+        index = get_vector_index()
         
         query_response = index.query(
-            vector=[0.0] * 1536, 
+            vector=[0.0] * EMBEDDING_DIMENSIONS, 
             top_k=1000,
             include_values=True
         )
@@ -159,34 +537,382 @@ def clustering_classify(
         return pd.DataFrame(), None
 
 
+def iter_index_vectors(
+    index: Any,
+    page_size: int = 100
+) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Page through every vector in the index by ID listing, yielding ids and values."""
+    for id_page in index.list(limit=page_size):
+        if not id_page:
+            continue
+        fetched = _match_field(index.fetch(ids=list(id_page)), "vectors") or {}
+        ids = [vector_id for vector_id in id_page if vector_id in fetched]
+        if ids:
+            values = np.asarray([_match_field(fetched[i], "values") for i in ids], dtype=np.float32)
+            yield ids, values
+
+
+def _centroids_path(model_path: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}.centroids.npz"
+
+
+def _save_cluster_centroids(model: "MiniBatchKMeans", model_path: str) -> None:
+    path = _centroids_path(model_path)
+    # np.savez appends .npz to names without it, so keep the suffix on the temp file
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, centroids=model.cluster_centers_.astype(np.float32), ids=cluster_ids(model))
+    os.replace(tmp_path, path)
+
+
+def _save_cluster_model(model: "MiniBatchKMeans", path: str) -> None:
+    import joblib
+
+    global _cluster_model, _cluster_model_mtime
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, path)
+    _save_cluster_centroids(model, path)
+    _cluster_model, _cluster_model_mtime = model, os.stat(path).st_mtime_ns
+
+
+def get_cluster_model(path: str = CLUSTER_MODEL_PATH) -> Optional["MiniBatchKMeans"]:
+    """Return the persisted incremental cluster model.
+
+    The file is loaded once and again whenever another process (such as
+    fit_clusters.py) replaces it, so a refit is picked up without a restart
+    and is not overwritten by a stale copy.
+    """
+    global _cluster_model, _cluster_model_mtime
+    try:
+        mtime: Optional[int] = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _cluster_model_lock:
+        if mtime != _cluster_model_mtime:
+            _cluster_model, _cluster_model_mtime = None, mtime
+            if mtime is not None:
+                try:
+                    import joblib
+
+                    _cluster_model = joblib.load(path)
+                except Exception as e:
+                    logger.error(f"Failed to load cluster model: {str(e)}")
+        return _cluster_model
+
+
+def cluster_ids(model: "MiniBatchKMeans") -> np.ndarray:
+    """Stable cluster id for each of the model's labels.
+
+    Models fitted before ids were tracked use their labels as ids.
+    """
+    ids = getattr(model, "cluster_ids_", None)
+    if ids is None:
+        return np.arange(len(model.cluster_centers_))
+    return ids
+
+
+def match_cluster_ids(
+    centroids: np.ndarray,
+    previous_centroids: Optional[np.ndarray],
+    previous_ids: Optional[np.ndarray]
+) -> np.ndarray:
+    """Give each refitted cluster the id of the previous cluster it matches.
+
+    k-means numbers its clusters arbitrarily on every fit, so ids such as
+    those in GPT_LARGE_CLUSTERS would otherwise point at unrelated errors
+    after a refit. Clusters are paired one to one by minimum total cosine
+    distance between centroids; clusters without a partner get new ids
+    above any used before.
+    """
+    if previous_centroids is None or previous_centroids.shape[1] != centroids.shape[1]:
+        return np.arange(len(centroids))
+    from scipy.optimize import linear_sum_assignment
+
+    distance = 1.0 - _normalize_rows(centroids) @ _normalize_rows(previous_centroids).T
+    rows, columns = linear_sum_assignment(distance)
+    ids = np.full(len(centroids), -1, dtype=np.int64)
+    ids[rows] = previous_ids[columns]
+    next_id = int(previous_ids.max()) + 1
+    for row in np.nonzero(ids < 0)[0]:
+        ids[row] = next_id
+        next_id += 1
+    return ids
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def clustering_fit_incremental(
+    config: Optional[ClusteringConfig] = None
+) -> Tuple["pd.DataFrame", Optional["MiniBatchKMeans"]]:
+    """Cluster the whole index with mini-batch k-means and persist the model.
+
+    Vectors are paged through by ID listing instead of a top-k query, so the
+    corpus size is not capped, and centroids are updated one mini-batch at a
+    time so memory stays bounded by the batch size. Clusters keep the ids of
+    the previous model's matching clusters (see match_cluster_ids). Run it
+    with fit_clusters.py.
+    """
+    import pandas as pd
+    from sklearn.cluster import MiniBatchKMeans
+
+    if config is None:
+        config = ClusteringConfig()
+
+    try:
+        index = get_vector_index()
+        previous = get_cluster_model(config.model_path)
+        model = MiniBatchKMeans(
+            n_clusters=config.n_clusters,
+            random_state=config.random_state,
+            batch_size=config.batch_size,
+            n_init=config.n_init
+        )
+
+        pending: List[np.ndarray] = []
+        pending_rows = 0
+        fitted = False
+        for ids, values in iter_index_vectors(index, config.page_size):
+            pending.append(values)
+            pending_rows += len(ids)
+            # The first partial_fit needs at least n_clusters samples
+            if pending_rows >= max(config.batch_size, config.n_clusters):
+                model.partial_fit(np.vstack(pending))
+                fitted = True
+                pending, pending_rows = [], 0
+
+        if pending_rows and (fitted or pending_rows >= config.n_clusters):
+            model.partial_fit(np.vstack(pending))
+            fitted = True
+
+        if not fitted:
+            logger.warning("Not enough vectors in index for clustering")
+            return pd.DataFrame(), None
+
+        model.cluster_ids_ = match_cluster_ids(
+            model.cluster_centers_,
+            previous.cluster_centers_ if previous is not None else None,
+            cluster_ids(previous) if previous is not None else None
+        )
+
+        all_ids: List[str] = []
+        labels: List[int] = []
+        for ids, values in iter_index_vectors(index, config.page_size):
+            all_ids.extend(ids)
+            labels.extend(model.cluster_ids_[model.predict(values)].tolist())
+
+        with _cluster_model_lock:
+            _save_cluster_model(model, config.model_path)
+
+        return pd.DataFrame({"id": all_ids, "cluster": labels}), model
+    except Exception as e:
+        logger.error(f"Error in incremental clustering: {str(e)}")
+        return pd.DataFrame(), None
+
+
+def get_cluster_centroids(path: str = CLUSTER_MODEL_PATH) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Return the centroids and cluster ids saved next to the cluster model.
+
+    They are plain numpy arrays, reloaded when the file changes, so
+    assigning a cluster needs neither sklearn nor joblib. A model saved
+    before centroids were written alongside it is converted once.
+    """
+    global _cluster_centroids, _cluster_centroids_mtime
+    centroids_path = _centroids_path(path)
+    if not os.path.exists(centroids_path) and os.path.exists(path):
+        model = get_cluster_model(path)
+        if model is not None:
+            _save_cluster_centroids(model, path)
+    try:
+        mtime: Optional[int] = os.stat(centroids_path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _cluster_model_lock:
+        if mtime != _cluster_centroids_mtime:
+            _cluster_centroids, _cluster_centroids_mtime = None, mtime
+            if mtime is not None:
+                try:
+                    saved = np.load(centroids_path)
+                    _cluster_centroids = saved["centroids"], saved["ids"]
+                except Exception as e:
+                    logger.error(f"Failed to load cluster centroids: {str(e)}")
+        return _cluster_centroids
+
+
+def assign_cluster(vector: List[float], path: str = CLUSTER_MODEL_PATH) -> Optional[int]:
+    """Assign an error vector to its nearest cluster in O(k), or None if no model exists.
+
+    Uses the same squared Euclidean distance as k-means, as one
+    matrix-vector product over the centroids.
+    """
+    saved = get_cluster_centroids(path)
+    if saved is None:
+        return None
+    centroids, ids = saved
+    try:
+        query = np.asarray(vector, dtype=np.float32)
+        # |c - x|^2 = |c|^2 - 2 c.x + |x|^2, and |x|^2 is the same for every centroid
+        distances = np.einsum("ij,ij->i", centroids, centroids) - 2 * (centroids @ query)
+        return int(ids[np.argmin(distances)])
+    except Exception as e:
+        logger.error(f"Cluster assignment failed: {str(e)}")
+        return None
+
+
+def _match_field(match: Any, name: str) -> Any:
+    """Read a field from a query match, whether it is a dict or a Pinecone model."""
+    try:
+        return match[name]
+    except (KeyError, TypeError, AttributeError):
+        return getattr(match, name, None)
+
+
+def set_vector_index(index: Optional[VectorStore]) -> None:
+    """Route vector reads and writes to the given store, or back to the configured backend with None."""
+    global _vector_index_override
+    _vector_index_override = index
+
+
+def get_vector_index(config: Optional[PineconeIndexConfig] = None) -> Any:
+    """Return the cached index handle for error vectors, resolving it on first use.
+
+    VECTOR_STORE_BACKEND picks Pinecone, a LocalVectorIndex under
+    VECTOR_STORE_PATH, or an InMemoryVectorIndex. For Pinecone the control
+    plane is only called the first time, to create the index if needed.
+    """
+    global _vector_index
+    if _vector_index_override is not None:
+        return _vector_index_override
+    if _vector_index is not None:
+        return _vector_index
+
+    if config is None:
+        config = PineconeIndexConfig()
+
+    with _vector_index_lock:
+        if _vector_index is None and VECTOR_STORE_BACKEND == "local":
+            _vector_index = LocalVectorIndex(
+                VECTOR_STORE_PATH, dimension=config.dimension, dtype=VECTOR_STORE_DTYPE)
+        elif _vector_index is None and VECTOR_STORE_BACKEND == "memory":
+            _vector_index = InMemoryVectorIndex()
+        elif _vector_index is None:
+            from pinecone import ServerlessSpec
+
+            pc = get_pinecone_client()
+            if config.name not in [idx.name for idx in pc.list_indexes()]:
+                pc.create_index(
+                    name=config.name,
+                    dimension=config.dimension,
+                    metric=config.metric,
+                    spec=ServerlessSpec(
+                        cloud=config.cloud,
+                        region=config.region
+                    )
+                )
+                logger.info(f"Created new index: {config.name}")
+            _vector_index = pc.Index(config.name)
+    return _vector_index
+
+
+def open_vector_index_snapshot() -> None:
+    """Read a local store through a read-only snapshot, for jobs that run beside the server.
+
+    The server's LocalVectorIndex holds the store's lock, so a second writer
+    would be refused. Other backends are shared services and are used as
+    configured.
+    """
+    if VECTOR_STORE_BACKEND == "local":
+        set_vector_index(LocalVectorIndex(VECTOR_STORE_PATH, dtype=VECTOR_STORE_DTYPE, read_only=True))
+
+
+def close_vector_index() -> None:
+    """Flush and drop the cached index handle, if the backend needs it."""
+    global _vector_index
+    with _vector_index_lock:
+        if isinstance(_vector_index, VectorStore):
+            _vector_index.close()
+        _vector_index = None
+
+
 def add_vector(vector_id: str, vector_values: List[float], metadata: VectorMetadata) -> bool:
     """Add a vector to the Pinecone index."""
     try:
-        index_name = "github-actions-errors"
-        
-        if index_name not in [idx.name for idx in pc.list_indexes()]:
-            pc.create_index(
-                name=index_name,
-                dimension=len(vector_values),
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",  # Changed from 'aws' to 'gcp'
-                    region="us-east1-gcp"  # Changed from 'us-west-2' to 'us-east1-gcp'
-                )
-            )
-            logger.info(f"Created new index: {index_name}")
-        
-        index = pc.Index(index_name)
-        
-        # Convert metadata datetime objects to strings if needed
-        metadata_dict = metadata.dict()
-        
+        index = get_vector_index()
         index.upsert(
-            vectors=[(vector_id, vector_values, metadata_dict)]
+            vectors=[(vector_id, vector_values, metadata.to_record())]
         )
         
         logger.info(f"Vector added successfully with ID {vector_id}")
         return True
     except Exception as e:
         logger.error(f"Failed to add vector to database: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+def add_vectors(vectors: List[Tuple[str, List[float], VectorMetadata]]) -> None:
+    """Upsert a batch of vectors in one request, raising on failure.
+
+    The cluster model is left alone: only the scheduled fit_clusters.py
+    refit writes it, so workers never load sklearn or race each other
+    saving centroids.
+    """
+    if not vectors:
+        return
+    index = get_vector_index()
+    records = []
+    for vector_id, vector_values, metadata in vectors:
+        try:
+            records.append((vector_id, vector_values, metadata.to_record()))
+        except ValueError as e:
+            # Dropping one record beats failing the whole batch on every retry
+            logger.error(f"Skipping vector {vector_id}: {str(e)}")
+    for start in range(0, len(records), PINECONE_UPSERT_BATCH_SIZE):
+        index.upsert(vectors=records[start:start + PINECONE_UPSERT_BATCH_SIZE])
+    logger.info(f"Upserted {len(records)} vectors")
+
+
+def find_cached_analysis(
+    vector_values: List[float],
+    api_key: str,
+    threshold: float = SEMANTIC_CACHE_THRESHOLD
+) -> Optional[CachedAnalysis]:
+    """Return the stored analysis of the nearest prior error for this API key, if similar enough.
+
+    Neighbours stored without a complete answer (a failed analysis, or one
+    truncated to fit the metadata limit) are skipped in favour of the next
+    nearest one above the threshold.
+    """
+    try:
+        index = get_vector_index()
+        response = index.query(
+            vector=vector_values,
+            top_k=SEMANTIC_CACHE_CANDIDATES,
+            include_metadata=True,
+            filter={"api_key": {"$eq": api_key}, "genre": {"$eq": "errors"}}
+        )
+
+        for match in response["matches"]:
+            metadata = _match_field(match, "metadata") or {}
+            # Matches come nearest first, so the rest are further away
+            if match["score"] < threshold:
+                return None
+            if not metadata.get("analysis") or not metadata.get("new_code"):
+                continue
+            if {"analysis", "new_code"} & set(metadata.get("truncated") or []):
+                logger.info(f"Skipping semantic cache hit on {match['id']}: stored answer was truncated")
+                continue
+            logger.info(f"Semantic cache hit on {match['id']} with score {match['score']:.4f}")
+            return CachedAnalysis(
+                vector_id=match["id"],
+                score=match["score"],
+                analysis=metadata["analysis"],
+                new_code=metadata["new_code"]
+            )
+        return None
+    except Exception as e:
+        logger.error(f"Semantic cache lookup failed: {str(e)}")
+        return None
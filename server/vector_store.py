@@ -0,0 +1,559 @@
+# Standard library imports
+import bisect
+import fcntl
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+# Third-party imports
+import numpy as np
+
+logger = logging.getLogger("vector_store")
+
+VectorRecord = Tuple[str, List[float], Dict[str, Any]]
+
+# Metadata fields LocalVectorIndex keeps row lists for, so filtering on them skips the scan
+INDEXED_METADATA_FIELDS = ("api_key", "genre")
+
+
+def _expected_value(condition: Any) -> Any:
+    return condition.get("$eq") if isinstance(condition, dict) else condition
+
+
+def matches_filter(metadata: Dict[str, Any], metadata_filter: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Pinecone-style equality filter against metadata."""
+    for key, condition in (metadata_filter or {}).items():
+        if metadata.get(key) != _expected_value(condition):
+            return False
+    return True
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorStore(ABC):
+    """The subset of the Pinecone Index API the app relies on.
+
+    Any backend implementing it can be passed to vector_logic.set_vector_index.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: List[VectorRecord], **kwargs: Any) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_values: bool = False,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def fetch(self, ids: List[str], **kwargs: Any) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def list(self, prefix: Optional[str] = None, limit: int = 100, **kwargs: Any) -> Iterator[List[str]]:
+        ...
+
+    def close(self) -> None:
+        """Flush and release anything the backend holds open."""
+
+
+class InMemoryVectorIndex(VectorStore):
+    """Pinecone-compatible in-memory index for tests and offline use."""
+
+    def __init__(self) -> None:
+        self.vectors: Dict[str, Tuple[np.ndarray, Dict[str, Any]]] = {}
+
+    def upsert(self, vectors: List[VectorRecord], **kwargs: Any) -> Dict[str, int]:
+        for vector_id, values, metadata in vectors:
+            self.vectors[vector_id] = (np.asarray(values, dtype=np.float32), dict(metadata or {}))
+        return {"upserted_count": len(vectors)}
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_values: bool = False,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        query_vector = np.asarray(vector, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector)
+        matches = []
+        for vector_id, (values, metadata) in self.vectors.items():
+            if not matches_filter(metadata, filter):
+                continue
+            denominator = query_norm * np.linalg.norm(values)
+            score = float(np.dot(query_vector, values) / denominator) if denominator else 0.0
+            match = {"id": vector_id, "score": score}
+            if include_values:
+                match["values"] = values.tolist()
+            if include_metadata:
+                match["metadata"] = metadata
+            matches.append(match)
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return {"matches": matches[:top_k]}
+
+    def fetch(self, ids: List[str], **kwargs: Any) -> Dict[str, Any]:
+        return {"vectors": {
+            vector_id: {"id": vector_id, "values": values.tolist(), "metadata": metadata}
+            for vector_id, (values, metadata) in ((i, self.vectors[i]) for i in ids if i in self.vectors)
+        }}
+
+    def list(self, prefix: Optional[str] = None, limit: int = 100, **kwargs: Any) -> Iterator[List[str]]:
+        ids = [i for i in self.vectors if not prefix or i.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+
+# Storage dtypes and the factor that maps unit-normalized floats onto them
+STORAGE_DTYPES = {
+    "float32": (np.float32, 1.0),
+    "float16": (np.float16, 1.0),
+    "int8": (np.int8, 127.0),
+}
+
+
+class LocalVectorIndex(VectorStore):
+    """Disk-backed index: a memory-mapped vector matrix with brute-force or IVF search.
+
+    Vectors are stored unit-normalized, so a cosine query is one matrix-vector
+    product over the mapped rows. They can be kept as float32, float16 or
+    int8 (scaled by 127) to trade a little precision for memory. Once
+    build_ivf has been called, queries only scan the rows in the nprobe
+    inverted lists closest to the query.
+
+    Writes cost the size of the batch, not the index: ids and metadata are
+    appended to a JSON-lines log, replayed on open and compacted once it is
+    mostly superseded entries, and IVF list assignments live in a
+    memory-mapped file updated in place. Equality filters on
+    INDEXED_METADATA_FIELDS are answered from per-value row lists rather
+    than by checking every row's metadata.
+
+    A store has a single writer. Opening it takes an exclusive lock, and a
+    path that another process already holds is refused rather than letting
+    two logs and in-memory id maps diverge. Run the server with one worker
+    on this backend. Jobs that only read, such as fit_clusters.py, open it
+    with read_only=True, which takes no lock and sees the store as of open.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int = 1536,
+        nprobe: int = 8,
+        dtype: str = "float32",
+        read_only: bool = False
+    ) -> None:
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"dtype must be one of: {', '.join(STORAGE_DTYPES)}")
+        self.path = path
+        self.dimension = dimension
+        self.nprobe = nprobe
+        self.dtype = dtype
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._lock_file: Optional[IO[str]] = None
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+            self._lock_file = self._acquire_lock()
+
+        self._matrix_path = os.path.join(path, "vectors.bin")
+        self._header_path = os.path.join(path, "header.json")
+        self._log_path = os.path.join(path, "meta.jsonl")
+        self._assignments_path = os.path.join(path, "assignments.bin")
+        self._centroids_path = os.path.join(path, "centroids.npy")
+
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.capacity = 0
+        self._rows: Dict[str, int] = {}
+        # Sorted rows per (field, value) of INDEXED_METADATA_FIELDS, and their arrays once queried
+        self._postings: Dict[Tuple[str, str], List[int]] = {}
+        self._posting_arrays: Dict[Tuple[str, str], np.ndarray] = {}
+        self._log_entries = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Optional[np.memmap] = None
+
+        if os.path.exists(self._header_path):
+            # The header is read after the log: a writer grows the capacity before
+            # logging rows past it, so a read-only open never sees rows it cannot map
+            self._replay_log()
+            with open(self._header_path) as f:
+                header = json.load(f)
+            self.dimension = header["dimension"]
+            self.dtype = header.get("dtype", "float32")
+            self.capacity = header["capacity"]
+        self._storage_dtype, self._scale = STORAGE_DTYPES[self.dtype]
+        self._matrix = self._open_matrix(self.capacity)
+        if os.path.exists(self._centroids_path):
+            self.centroids = np.load(self._centroids_path)
+            self.assignments = self._open_assignments(self.capacity)
+        self._log: Optional[IO[str]] = None
+        if not read_only:
+            self._migrate_legacy_files()
+            self._log = open(self._log_path, "a")
+
+    def _acquire_lock(self) -> IO[str]:
+        lock_file = open(os.path.join(self.path, "lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(
+                f"Vector store {self.path} is already open for writing elsewhere. The local "
+                "backend supports a single server worker; open it with read_only=True to read it"
+            ) from None
+        return lock_file
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(f"Vector store {self.path} was opened read-only")
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _open_matrix(self, capacity: int) -> Optional[np.memmap]:
+        if capacity == 0:
+            return None
+        return np.memmap(
+            self._matrix_path, dtype=self._storage_dtype,
+            mode="r" if self.read_only else "r+", shape=(capacity, self.dimension))
+
+    def _open_assignments(self, capacity: int) -> Optional[np.memmap]:
+        if capacity == 0:
+            return None
+        if self.read_only:
+            return np.memmap(self._assignments_path, dtype=np.int32, mode="r", shape=(capacity,))
+        with open(self._assignments_path, "ab") as f:
+            f.truncate(capacity * np.dtype(np.int32).itemsize)
+        return np.memmap(self._assignments_path, dtype=np.int32, mode="r+", shape=(capacity,))
+
+    def _encode(self, values: np.ndarray) -> np.ndarray:
+        if self._scale == 1.0:
+            return values.astype(self._storage_dtype)
+        return np.clip(np.rint(values * self._scale), -self._scale, self._scale).astype(self._storage_dtype)
+
+    def _decode(self, stored: np.ndarray) -> np.ndarray:
+        return stored.astype(np.float32) / self._scale
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the stored vectors."""
+        return self.count * self.dimension * np.dtype(self._storage_dtype).itemsize
+
+    def _apply(self, vector_id: str, metadata: Dict[str, Any]) -> int:
+        row = self._rows.get(vector_id)
+        if row is None:
+            row = self.count
+            self._rows[vector_id] = row
+            self.ids.append(vector_id)
+            self.metadata.append(metadata)
+        else:
+            self._update_postings(row, self.metadata[row], remove=True)
+            self.metadata[row] = metadata
+        self._update_postings(row, metadata)
+        return row
+
+    def _update_postings(self, row: int, metadata: Dict[str, Any], remove: bool = False) -> None:
+        for field in INDEXED_METADATA_FIELDS:
+            value = metadata.get(field)
+            if not isinstance(value, str):
+                continue
+            key = (field, value)
+            rows = self._postings.setdefault(key, [])
+            position = bisect.bisect_left(rows, row)
+            if remove:
+                if position < len(rows) and rows[position] == row:
+                    del rows[position]
+                if not rows:
+                    del self._postings[key]
+            else:
+                rows.insert(position, row)
+            self._posting_arrays.pop(key, None)
+
+    def _posting_rows(self, field: str, value: str) -> np.ndarray:
+        key = (field, value)
+        rows = self._posting_arrays.get(key)
+        if rows is None:
+            rows = np.asarray(self._postings.get(key, []), dtype=np.int64)
+            self._posting_arrays[key] = rows
+        return rows
+
+    def _replay_log(self) -> None:
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be torn, by a crash mid-append
+                    logger.warning(f"Ignoring a truncated entry at the end of {self._log_path}")
+                    break
+                self._apply(entry["id"], entry["metadata"])
+                self._log_entries += 1
+
+    def _migrate_legacy_files(self) -> None:
+        """Convert an index written as a single meta.json and ivf.npz."""
+        legacy_meta = os.path.join(self.path, "meta.json")
+        legacy_ivf = os.path.join(self.path, "ivf.npz")
+        if os.path.exists(legacy_meta) and not os.path.exists(self._header_path):
+            with open(legacy_meta) as f:
+                meta = json.load(f)
+            self.dimension = meta["dimension"]
+            self.dtype = meta.get("dtype", "float32")
+            self._storage_dtype, self._scale = STORAGE_DTYPES[self.dtype]
+            self.capacity = meta["capacity"]
+            for vector_id, metadata in zip(meta["ids"], meta["metadata"]):
+                self._apply(vector_id, metadata)
+            self._matrix = self._open_matrix(self.capacity)
+            self._save_header()
+            self._compact_log()
+            os.remove(legacy_meta)
+            logger.info(f"Migrated {self.count} vectors in {self.path} to the append-only layout")
+        if os.path.exists(legacy_ivf) and self.centroids is None:
+            ivf = np.load(legacy_ivf)
+            self._save_centroids(ivf["centroids"])
+            self.assignments = self._open_assignments(self.capacity)
+            self.assignments[:len(ivf["assignments"])] = ivf["assignments"]
+            self.assignments.flush()
+            os.remove(legacy_ivf)
+
+    def _save_header(self) -> None:
+        tmp_path = f"{self._header_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dimension": self.dimension, "dtype": self.dtype, "capacity": self.capacity}, f)
+        os.replace(tmp_path, self._header_path)
+
+    def _save_centroids(self, centroids: np.ndarray) -> None:
+        # np.save appends .npy to names without it, so keep the suffix on the temp file
+        tmp_path = f"{self._centroids_path}.tmp.npy"
+        np.save(tmp_path, centroids)
+        os.replace(tmp_path, self._centroids_path)
+        self.centroids = centroids
+
+    def _compact_log(self) -> None:
+        """Rewrite the metadata log with one entry per vector."""
+        tmp_path = f"{self._log_path}.tmp"
+        with open(tmp_path, "w") as f:
+            for vector_id, metadata in zip(self.ids, self.metadata):
+                f.write(json.dumps({"id": vector_id, "metadata": metadata}) + "\n")
+        reopen = getattr(self, "_log", None) is not None
+        if reopen:
+            self._log.close()
+        os.replace(tmp_path, self._log_path)
+        if reopen:
+            self._log = open(self._log_path, "a")
+        self._log_entries = self.count
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self.capacity:
+            return
+        new_capacity = max(rows, self.capacity * 2, 1024)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self._matrix_path, "ab") as f:
+            f.truncate(new_capacity * self.dimension * np.dtype(self._storage_dtype).itemsize)
+        self.capacity = new_capacity
+        self._matrix = self._open_matrix(new_capacity)
+        if self.assignments is not None:
+            self.assignments.flush()
+            self.assignments = self._open_assignments(new_capacity)
+        self._save_header()
+
+    def upsert(self, vectors: List[VectorRecord], **kwargs: Any) -> Dict[str, int]:
+        if not vectors:
+            return {"upserted_count": 0}
+        values = _normalize(np.asarray([v[1] for v in vectors], dtype=np.float32))
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {values.shape[1]}")
+
+        self._check_writable()
+        with self._lock:
+            new_ids = {v[0] for v in vectors if v[0] not in self._rows}
+            self._ensure_capacity(self.count + len(new_ids))
+            rows = [self._apply(vector_id, dict(metadata or {})) for vector_id, _, metadata in vectors]
+            self._matrix[rows] = self._encode(values)
+            self._matrix.flush()
+
+            if self.centroids is not None:
+                self.assignments[rows] = np.argmax(values @ self.centroids.T, axis=1)
+                self.assignments.flush()
+
+            # Vectors are written before their ids, so a crash never leaves an id without a vector
+            self._log.write("".join(
+                json.dumps({"id": vector_id, "metadata": self.metadata[row]}) + "\n"
+                for (vector_id, _, _), row in zip(vectors, rows)
+            ))
+            self._log.flush()
+            self._log_entries += len(vectors)
+            if self._log_entries > 2 * self.count + 1000:
+                self._compact_log()
+        return {"upserted_count": len(vectors)}
+
+    def close(self) -> None:
+        """Flush the mapped files, compact the metadata log and release the store's lock."""
+        with self._lock:
+            if self.read_only:
+                return
+            if self._matrix is not None:
+                self._matrix.flush()
+            if self.assignments is not None:
+                self.assignments.flush()
+            if self._log_entries > self.count:
+                self._compact_log()
+            self._log.close()
+            self._lock_file.close()
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, seed: int = 42) -> None:
+        """Cluster stored vectors into nlist inverted lists for approximate search."""
+        self._check_writable()
+        with self._lock:
+            if self.count == 0:
+                return
+            data = self._decode(np.asarray(self._matrix[:self.count]))
+            nlist = min(nlist or max(1, int(np.sqrt(self.count))), self.count)
+            rng = np.random.default_rng(seed)
+            centroids = data[rng.choice(self.count, size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = np.argmax(data @ centroids.T, axis=1)
+                for cluster in range(nlist):
+                    members = data[assignments == cluster]
+                    if len(members):
+                        centroids[cluster] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+            self.assignments = self._open_assignments(self.capacity)
+            self.assignments[:self.count] = np.argmax(data @ centroids.T, axis=1)
+            self.assignments.flush()
+            self._save_centroids(centroids)
+            logger.info(f"Built IVF index with {nlist} lists over {self.count} vectors")
+
+    def _indexed_rows(
+        self,
+        metadata_filter: Dict[str, Any]
+    ) -> Tuple[Optional[np.ndarray], Dict[str, Any]]:
+        """Rows matching the filter's conditions on indexed fields, or None if it has none.
+
+        The conditions left for a row-by-row check are returned alongside.
+        """
+        rows: Optional[np.ndarray] = None
+        remaining: Dict[str, Any] = {}
+        for field, condition in metadata_filter.items():
+            expected = _expected_value(condition)
+            if field not in INDEXED_METADATA_FIELDS or not isinstance(expected, str):
+                remaining[field] = condition
+                continue
+            posting = self._posting_rows(field, expected)
+            rows = posting if rows is None else np.intersect1d(rows, posting, assume_unique=True)
+        return rows, remaining
+
+    def _candidate_rows(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """The rows to score, out of all rows or the given ones, after IVF probing."""
+        if self.centroids is None or self.nprobe >= len(self.centroids):
+            return np.arange(self.count) if rows is None else rows
+        probes = np.argsort(self.centroids @ query_vector)[-self.nprobe:]
+        if rows is None:
+            return np.nonzero(np.isin(self.assignments[:self.count], probes))[0]
+        return rows[np.isin(self.assignments[rows], probes)]
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_values: bool = False,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        with self._lock:
+            if self.count == 0:
+                return {"matches": []}
+            query_vector = _normalize(np.asarray(vector, dtype=np.float32))
+            indexed, remaining = self._indexed_rows(filter or {})
+            rows = self._candidate_rows(query_vector, indexed)
+            if remaining:
+                rows = rows[[matches_filter(self.metadata[row], remaining) for row in rows]]
+            if len(rows) == 0:
+                return {"matches": []}
+
+            # A full scan reads the mapped rows in place instead of gathering a copy,
+            # and scores are scaled after the product rather than decoding every row
+            stored = self._matrix[:self.count] if len(rows) == self.count else self._matrix[rows]
+            scores = (stored @ query_vector).astype(np.float32) / self._scale
+            k = min(top_k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            matches = []
+            for position in best:
+                row = rows[position]
+                match = {"id": self.ids[row], "score": float(scores[position])}
+                if include_values:
+                    match["values"] = self._decode(self._matrix[row]).tolist()
+                if include_metadata:
+                    match["metadata"] = self.metadata[row]
+                matches.append(match)
+            return {"matches": matches}
+
+    def fetch(self, ids: List[str], **kwargs: Any) -> Dict[str, Any]:
+        with self._lock:
+            return {"vectors": {
+                vector_id: {
+                    "id": vector_id,
+                    "values": self._decode(self._matrix[self._rows[vector_id]]).tolist(),
+                    "metadata": self.metadata[self._rows[vector_id]],
+                }
+                for vector_id in ids if vector_id in self._rows
+            }}
+
+    def list(self, prefix: Optional[str] = None, limit: int = 100, **kwargs: Any) -> Iterator[List[str]]:
+        with self._lock:
+            ids = [i for i in self.ids if not prefix or i.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+
+def recall_at_k(
+    full_vectors: np.ndarray,
+    reduced_vectors: np.ndarray,
+    k: int = 10,
+    n_queries: int = 100,
+    seed: int = 42
+) -> float:
+    """Share of the exact top-k neighbours that a reduced representation still finds.
+
+    Both arrays hold the same corpus row for row; queries are sampled from it
+    and excluded from their own neighbour lists.
+    """
+    full = _normalize(np.asarray(full_vectors, dtype=np.float32))
+    reduced = _normalize(np.asarray(reduced_vectors, dtype=np.float32))
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(full), size=min(n_queries, len(full)), replace=False)
+
+    hits = 0
+    for query in queries:
+        exact = full @ full[query]
+        approx = reduced @ reduced[query]
+        exact[query] = approx[query] = -np.inf
+        exact_top = set(np.argpartition(-exact, k)[:k].tolist())
+        approx_top = set(np.argpartition(-approx, k)[:k].tolist())
+        hits += len(exact_top & approx_top)
+    return hits / (k * len(queries))
@@ -0,0 +1,138 @@
+# Standard library imports
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Internal imports
+from concurrency import run_blocking
+
+logger = logging.getLogger("write_queue")
+
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", "1000"))
+WRITE_QUEUE_BATCH_SIZE = int(os.environ.get("WRITE_QUEUE_BATCH_SIZE", "50"))
+WRITE_QUEUE_FLUSH_INTERVAL = float(os.environ.get("WRITE_QUEUE_FLUSH_INTERVAL", "0.5"))
+WRITE_QUEUE_MAX_RETRIES = int(os.environ.get("WRITE_QUEUE_MAX_RETRIES", "5"))
+WRITE_QUEUE_SUBMIT_TIMEOUT = float(os.environ.get("WRITE_QUEUE_SUBMIT_TIMEOUT", "0.1"))
+
+# A handler receives every queued payload of its kind from one batch. It
+# raises if the whole batch failed, or returns the payloads that need a retry.
+BatchHandler = Callable[[List[Any]], Optional[List[Any]]]
+
+
+class WriteBehindQueue:
+    """Bounded in-process queues that batch bookkeeping writes off the response path.
+
+    Each kind of write has its own buffer and worker, which hands batches
+    to that kind's handler on the blocking executor, so a backend that is
+    failing and being retried does not hold up the others. Failed batches
+    are retried with exponential backoff and jitter. When a buffer stays
+    full for submit_timeout, the write is dropped and counted rather than
+    slowing down the response.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, BatchHandler],
+        maxsize: int = WRITE_QUEUE_SIZE,
+        batch_size: int = WRITE_QUEUE_BATCH_SIZE,
+        flush_interval: float = WRITE_QUEUE_FLUSH_INTERVAL,
+        max_retries: int = WRITE_QUEUE_MAX_RETRIES,
+        base_delay: float = 0.5,
+        submit_timeout: float = WRITE_QUEUE_SUBMIT_TIMEOUT
+    ) -> None:
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.submit_timeout = submit_timeout
+        self._queues: Dict[str, asyncio.Queue] = {
+            kind: asyncio.Queue(maxsize=maxsize) for kind in handlers
+        }
+        self._workers: List[asyncio.Task] = []
+        self.stats = {"written": 0, "failed": 0, "dropped": 0}
+
+    @property
+    def depth(self) -> int:
+        """Number of writes waiting in the buffers."""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._run(kind, queue)) for kind, queue in self._queues.items()
+            ]
+
+    async def submit(self, kind: str, payload: Any) -> None:
+        """Queue a write, dropping it if the buffer stays full for submit_timeout."""
+        if kind not in self.handlers:
+            raise ValueError(f"No write handler registered for {kind}")
+        try:
+            await asyncio.wait_for(self._queues[kind].put(payload), timeout=self.submit_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Write queue for {kind} is full, dropping the write")
+            self.stats["dropped"] += 1
+
+    async def close(self) -> None:
+        """Stop accepting work and flush everything still buffered."""
+        if self._workers:
+            for queue in self._queues.values():
+                await queue.put(None)
+            await asyncio.gather(*self._workers)
+            self._workers = []
+        logger.info(f"Write queue closed: {self.stats}")
+
+    async def _run(self, kind: str, queue: asyncio.Queue) -> None:
+        closing = False
+        while not closing:
+            batch = []
+            item = await queue.get()
+            if item is None:
+                closing = True
+            else:
+                batch.append(item)
+
+            deadline = time.monotonic() + self.flush_interval
+            while not closing and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    closing = True
+                else:
+                    batch.append(item)
+
+            # Drain whatever arrived before the close sentinel
+            while closing and not queue.empty():
+                item = queue.get_nowait()
+                if item is not None:
+                    batch.append(item)
+
+            if batch:
+                await self._write(kind, batch)
+
+    async def _write(self, kind: str, payloads: List[Any]) -> None:
+        handler = self.handlers[kind]
+        for attempt in range(self.max_retries + 1):
+            try:
+                failed = await run_blocking(handler, payloads) or []
+                self.stats["written"] += len(payloads) - len(failed)
+                if not failed:
+                    return
+                payloads = failed
+                raise RuntimeError(f"{len(failed)} {kind} writes failed")
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Dropping {len(payloads)} {kind} writes after {attempt + 1} attempts: {str(e)}")
+                    self.stats["failed"] += len(payloads)
+                    return
+                delay = self.base_delay * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"{kind} write failed ({str(e)}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)